@@ -0,0 +1,483 @@
+#!/usr/bin/python3
+'''
+Benchmarks for the Spark API helpers
+
+Usage:
+    python3 benchmark.py [-o results.json] [-b baseline.json] [-t threshold] [--save-baseline] [benchmark ...]
+
+Without benchmark names all benchmarks are executed. The end-to-end benchmarks (pagination, attachments, onboarding,
+token_refresh) run offline against a spark_standin.StandIn serving a spark_tenant.SyntheticTenant.
+
+All results are written as JSON (-o). If a baseline exists (default: benchmark_baseline.json) then each result is
+compared against the baseline. Results ending in '/s' are throughput (higher is better), all other results are time or
+memory (lower is better). Benchmarks only return such measurements; counts and other information are printed only.
+Changes for the worse by more than the threshold (default 20%) are reported as regressions and the exit code is 1.
+
+Timings depend on the machine, so no baseline is checked in. Create one on the machine running the comparison (for
+example in CI before the change under test) and compare against it later:
+
+    python3 benchmark.py --save-baseline
+    python3 benchmark.py -b benchmark_baseline.json
+
+Without a baseline the results are only printed (and written with -o) and the exit code is 0.
+'''
+import sys
+import os
+import json
+import argparse
+import platform
+import tempfile
+import shutil
+import time
+from contextlib import contextmanager
+import tracemalloc
+import gc
+import timeit
+import logging
+import subprocess
+import random
+import string
+import base64
+import uuid
+import datetime
+from functools import wraps
+
+from spark_struct import Struct
+import spark_models
+import spark_api
+import spark_ids
+import spark_time
+import dump_utilities
+import rate_governor
+from spark_standin import StandIn
+from spark_tenant import SyntheticTenant
+
+# registry of all benchmarks: name -> function
+BENCHMARKS = {}
+
+def benchmark(f):
+    BENCHMARKS[f.__name__] = f
+    return f
+
+def sample_messages(n):
+    ''' n message dictionaries as returned by the API (decoded from JSON, no shared strings)
+    '''
+    messages = [{'id' : 'Y2lzY29zcGFyazovL3VzL01FU1NBR0UvOTJkYjNiZTAtNDNiZC0xMWU2LThhZTktZGQ1YjNkZmM1NjVk{:08d}'.format(i),
+                 'roomId' : 'Y2lzY29zcGFyazovL3VzL1JPT00vYmJjZWIxYWQtNDNmMS0zYjU4LTkxNDctZjE0YmIwYzRkMTU0',
+                 'roomType' : 'group',
+                 'text' : 'message number {}'.format(i),
+                 'personId' : 'Y2lzY29zcGFyazovL3VzL1BFT1BMRS9mNWIzNjE4Ny1jOGRkLTQ3MjctOGIyZi1mOWM0NDdmMjkwNDY',
+                 'personEmail' : 'matt@example.com',
+                 'created' : '2016-06-24T17:0{}:31.000Z'.format(i % 10)} for i in range(n)]
+    return json.loads(json.dumps(messages))
+
+def retained(factory):
+    ''' memory (bytes) retained by the object created by factory
+    '''
+    gc.collect()
+    tracemalloc.start()
+    obj = factory()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return size
+
+@benchmark
+def memory_models(n = 100000):
+    ''' memory needed to hold n messages as dictionaries, Struct and spark_models.Message
+    '''
+    source = json.dumps(sample_messages(n))
+    results = {'dict' : retained(lambda: json.loads(source)),
+               'Struct' : retained(lambda: [Struct(m) for m in json.loads(source)]),
+               'Message' : retained(lambda: [spark_models.Message(m) for m in json.loads(source)])}
+    # the factories for Struct and Message temporarily need the dictionaries as well. Peak doesn't matter, only
+    # the memory retained at the end
+    for name, size in results.items():
+        print('{:10s} {:8.1f} MB {:6.0f} bytes/message {:4.0%}'.format(name, size / 2**20, size / n, size / results['dict']))
+    return results
+
+def _legacy_dump_args(func):
+    ''' dumpArgs as it was before the argument mapping was precomputed (for comparison)
+    '''
+    log = spark_api.log
+    @wraps(func)
+    def wrapper(*func_args, **func_kwargs):
+        if log.isEnabledFor(logging.DEBUG): 
+            arg_names = func.__code__.co_varnames[:func.__code__.co_argcount]
+            args = func_args[:len(arg_names)]
+            defaults = func.__defaults__ or ()
+            args = args + defaults[len(defaults) - (func.__code__.co_argcount - len(args)):]
+            params = [list(z) for z in zip(arg_names, args) if z[0] != 'self']
+            args = func_args[len(arg_names):]
+            if args: params.append(('args', args))
+            if func_kwargs:
+                for p in params:
+                    if p[0] in func_kwargs: 
+                        p[1] = func_kwargs[p[0]]
+            log.debug(func.__name__ + ' (' + ', '.join('%s = %r' % (p[0], p[1]) for p in params) + ')')
+        return func(*func_args, **func_kwargs)
+    return wrapper
+
+def _list_rooms(self, p_showSipAddress = None, p_teamId = None, p_max = None, p_type = None):
+    return self
+
+def _time_per_call(variants, number = 200000, repeat = 7):
+    ''' best time per call in nanoseconds for each variant. The variants are measured interleaved so that changes of
+    the machine load affect all of them alike
+    '''
+    best = {}
+    for _ in range(repeat):
+        for name, f in variants.items():
+            t = timeit.timeit(lambda: f(None, 'team', p_max=100), number=number) / number * 1e9
+            best[name] = min(best.get(name, t), t)
+    return best
+
+@benchmark
+def dump_args():
+    ''' per call overhead of the dumpArgs decorator (ns): debug logging disabled and enabled
+    '''
+    logger = spark_api.log
+    level, propagate, handlers = logger.level, logger.propagate, logger.handlers
+    # with debug logging enabled records are created, but not written anywhere
+    logger.propagate = False
+    logger.handlers = [logging.NullHandler()]
+    variants = {'undecorated' : _list_rooms,
+                'legacy' : _legacy_dump_args(_list_rooms),
+                'dumpArgs' : spark_api.dumpArgs(_list_rooms)}
+    results = {}
+    try:
+        for debug in (False, True):
+            logger.setLevel(logging.DEBUG if debug else logging.INFO)
+            for name, t in _time_per_call(variants, number = 50000 if debug else 1000000).items():
+                results['{}, debug {}'.format(name, 'on' if debug else 'off')] = t
+    finally:
+        logger.setLevel(level)
+        logger.propagate = propagate
+        logger.handlers = handlers
+    # with SPARK_API_TRACE=0 the decorator is removed when spark_api is imported
+    env = dict(os.environ, SPARK_API_TRACE='0')
+    code = 'import spark_api; print(spark_api.dumpArgs(len) is len)'
+    results['SPARK_API_TRACE=0 removes wrapper'] = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                                                          cwd=os.path.dirname(os.path.abspath(__file__))).strip() == b'True'
+    for name, value in results.items():
+        print('{:35s} {}'.format(name, value if isinstance(value, bool) else '{:8.0f} ns'.format(value)))
+    return results
+
+@benchmark
+def redaction(n_secrets = 500, n_words = 20000):
+    ''' time to mask n_secrets secrets in a text: one str.replace per secret vs. dump_utilities.Redactor
+    '''
+    rnd = random.Random(1)
+    alphabet = string.ascii_letters + string.digits
+    secrets = [''.join(rnd.choice(alphabet) for _ in range(rnd.randint(16, 64))) for _ in range(n_secrets)]
+    text = ' '.join(rnd.choice(secrets + ['lorem', 'ipsum'] * n_secrets) for _ in range(n_words))
+    redactor = dump_utilities.Redactor()
+    redactor.add(*secrets)
+    
+    def replace():
+        t = text
+        for s in secrets:
+            t = t.replace(s, '*' * len(s))
+        return t
+    
+    assert replace() == redactor.redact(text)
+    results = {'str.replace' : min(timeit.repeat(replace, number=5, repeat=3)) / 5,
+               'Redactor' : min(timeit.repeat(lambda: redactor.redact(text), number=5, repeat=3)) / 5}
+    for name, value in results.items():
+        print('{:15s} {:8.2f} ms'.format(name, value * 1000))
+    return results
+
+############################ micro benchmarks
+def per_call(f, number = 100000):
+    ''' time per call in nanoseconds
+    '''
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e9
+
+def print_results(results):
+    for name, value in results.items():
+        print('{:35s} {:12.1f}'.format(name, value))
+
+@benchmark
+def micro():
+    ''' time per call (ns) of frequently used helpers
+    '''
+    from get_attachments import valid_filename
+    message = sample_messages(1)[0]
+    results = {'Struct ns' : per_call(lambda: Struct(message)),
+               'Struct.view ns' : per_call(lambda: Struct.view(message)),
+               'Struct attribute ns' : per_call(lambda s=Struct(message): s.personEmail, number=1000000),
+               'str_to_time ns' : per_call(lambda: spark_api.str_to_time(message['created'])),
+               'base64_id_to_str ns' : per_call(lambda: spark_api.base64_id_to_str(message['roomId'])),
+               'valid_filename ns' : per_call(lambda: valid_filename(' Quarterly Review (final) v2.pptx '))}
+    print_results(results)
+    return results
+
+@benchmark
+def ids(n = 10000):
+    ''' time per ID (ns) to decode Spark IDs: legacy decode, to_uuid, cached decode (miss/hit), batch decode of a page
+    with repeated IDs, encode
+    '''
+    rnd = random.Random(1)
+    uids = [uuid.UUID(int=rnd.getrandbits(128)) for _ in range(n)]
+    id_list = [spark_ids.encode(u, 'messages') for u in uids]
+    # a page of memberships: many IDs repeat (rooms, people)
+    page = [id_list[rnd.randrange(n // 20)] for _ in range(n)]
+    legacy = lambda i: base64.b64decode(i + '==').decode().split('/')[-1]
+
+    def cold():
+        spark_ids.clear_cache()
+        for i in id_list: spark_ids.cached_decode(i)
+
+    results = {'legacy decode ns' : per_call(lambda: [legacy(i) for i in id_list], number=10) / n,
+               'to_uuid ns' : per_call(lambda: [spark_ids.to_uuid(i) for i in id_list], number=10) / n,
+               'cached_decode miss ns' : per_call(cold, number=10) / n,
+               'cached_decode hit ns' : per_call(lambda: [spark_ids.cached_decode(i) for i in id_list],
+                                                 number=10) / n,
+               'legacy page ns' : per_call(lambda: [legacy(i) for i in page], number=10) / n,
+               'decode_many page ns' : per_call(lambda: spark_ids.decode_many(page), number=10) / n,
+               'encode ns' : per_call(lambda: [spark_ids.encode(u, 'ROOM') for u in uids], number=10) / n}
+    print_results(results)
+    return results
+
+@benchmark
+def timestamps(n = 10000):
+    ''' time per timestamp (ns): strptime vs. spark_time.parse (miss/hit) and conversion of a column to epoch seconds
+    '''
+    rnd = random.Random(1)
+    column = ['2016-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}.{:03d}Z'.format(rnd.randint(1, 12), rnd.randint(1, 28),
+                                                                      rnd.randint(0, 23), rnd.randint(0, 59),
+                                                                      rnd.randint(0, 59), rnd.randint(0, 999))
+              for _ in range(n)]
+    strptime = lambda s: datetime.datetime.strptime(s, spark_time.FORMAT)
+
+    def cold():
+        spark_time.parse.cache_clear()
+        for s in column: spark_time.parse(s)
+
+    results = {'strptime ns' : per_call(lambda: [strptime(s) for s in column], number=5) / n,
+               'parse miss ns' : per_call(cold, number=5) / n,
+               'parse hit ns' : per_call(lambda: [spark_time.parse(s) for s in column], number=5) / n,
+               'strptime epoch ns' : per_call(lambda: [strptime(s).timestamp() for s in column], number=5) / n,
+               'to_epoch ns' : per_call(lambda: spark_time.to_epoch(column), number=5) / n}
+    try:
+        results['to_epoch numpy ns'] = per_call(lambda: spark_time.to_epoch(column, array=True), number=5) / n
+    except ImportError:
+        pass
+    print_results(results)
+    return results
+
+############################ end-to-end benchmarks against the stand-in
+@contextmanager
+def standin(tenant = None, latency = 0):
+    ''' stand-in serving a tenant and an API instance using it (with its own governor and w/o debug logging)
+    '''
+    level = spark_api.log.level
+    spark_api.log.setLevel(logging.INFO)
+    server = StandIn(tenant or SyntheticTenant(seed=1), latency=latency).start()
+    try:
+        yield server, spark_api.SparkAPI('benchmark', base_url=server.base_url, governor=rate_governor.RateGovernor())
+    finally:
+        server.stop()
+        spark_api.log.setLevel(level)
+
+def throughput(f):
+    ''' (number of items returned by f, seconds)
+    '''
+    start = time.perf_counter()
+    n = f()
+    return n, time.perf_counter() - start
+
+def busy_room(tenant, rooms = 1000):
+    ''' index of the room with most messages among the first rooms
+    '''
+    return max(range(rooms), key=lambda r: tenant._room_info(r)[4])
+
+@benchmark
+def pagination():
+    ''' items per second read by the list_* iterators
+    '''
+    tenant = SyntheticTenant(seed=1, rooms=5000, messages_per_room=200)
+    room_id = tenant.room(busy_room(tenant))['id']
+    room_ids = [tenant.room(r)['id'] for r in range(300)]
+    results = {}
+    with standin(tenant) as (server, spark):
+        variants = {'list_rooms' : lambda: sum(1 for _ in spark.list_rooms(p_max=1000)),
+                    'list_messages' : lambda: sum(1 for _ in spark.list_messages(room_id, p_max=1000)),
+                    'list_messages prefetch' : lambda: sum(1 for _ in spark.list_messages(room_id, p_max=1000,
+                                                                                        prefetch=2)),
+                    'list_messages stream' : lambda: sum(1 for _ in spark.list_messages(room_id, p_max=1000,
+                                                                                      stream=True)),
+                    'list_memberships' : lambda: sum(sum(1 for _ in spark.list_memberships(p_roomId=r))
+                                                     for r in room_ids)}
+        for name, f in variants.items():
+            n, seconds = throughput(f)
+            results['{} items/s'.format(name)] = n / seconds
+    print_results(results)
+    return results
+
+@benchmark
+def attachments(files = 100):
+    ''' attachment download throughput: stream to files the same way get_attachments does
+    '''
+    tenant = SyntheticTenant(seed=2, rooms=1000, messages_per_room=300, attachment_ratio=0.2,
+                             max_attachment_size=5 * 2**20)
+    room_id = tenant.room(busy_room(tenant))['id']
+    folder = tempfile.mkdtemp()
+    try:
+        with standin(tenant) as (server, spark):
+            urls = [url for m in spark.list_messages(room_id, p_max=1000) for url in m.get('files', [])][:files]
+            size = 0
+            start = time.perf_counter()
+            for i, url in enumerate(urls):
+                response = spark.get(url, stream=True)
+                with open(os.path.join(folder, str(i)), 'wb') as f:
+                    response.raw.decode_content = True
+                    shutil.copyfileobj(response.raw, f)
+                    size += f.tell()
+                response.close()
+            seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(folder)
+    results = {'download MB/s' : size / 2**20 / seconds, 'download files/s' : len(urls) / seconds}
+    print_results(results)
+    return results
+
+@benchmark
+def onboarding(teams = 4, users = 50, latency = 0.01):
+    ''' bulk team onboarding (create_teams.create_team) with some server latency
+    '''
+    import create_teams
+    with standin(latency=latency) as (server, spark):
+        start = time.perf_counter()
+        for t in range(teams):
+            create_teams.create_team(spark, 'Department {}'.format(t),
+                                     [{'E-Mail Address' : 'user{}.{}@example.com'.format(t, u)} for u in range(users)])
+        seconds = time.perf_counter() - start
+    results = {'memberships/s' : teams * users / seconds}
+    print_results(results)
+    return results
+
+@benchmark
+def people_resolution(people = 5000, emails = 1000, latency = 0.01):
+    ''' resolve e-mail addresses (20% duplicates) with some server latency: one list_people call per address vs.
+    resolve_people()
+    '''
+    tenant = SyntheticTenant(seed=1, people=people)
+    addresses = [tenant.person(p * 7919 % people)['emails'][0] for p in range(emails * 4 // 5)]
+    addresses += addresses[:emails - len(addresses)]
+    with standin(tenant, latency=latency) as (server, spark):
+        n, seconds = throughput(lambda: sum(1 for e in addresses[:100] if next(spark.list_people(p_email=e), None)))
+        results = {'sequential addresses/s' : n / seconds}
+        n, seconds = throughput(lambda: sum(1 for p in spark.resolve_people(addresses).values() if p))
+        results['resolve_people addresses/s'] = emails / seconds
+    print_results(results)
+    # a count, not a measurement: not part of the results compared with the baseline
+    print('{:35s} {:12d}'.format('people resolved', n))
+    return results
+
+@benchmark
+def room_lookup(rooms = 5000, lookups = 2000):
+    ''' find_room() by title: linear scan of list_rooms vs. the room directory
+    '''
+    tenant = SyntheticTenant(seed=1, rooms=rooms)
+    titles = [tenant.room(r * 7919 % rooms)['title'] for r in range(lookups)]
+    with standin(tenant) as (server, spark):
+        def scan(title):
+            for r in spark.list_rooms(p_max=1000):
+                if r['title'] == title: return r
+        n, seconds = throughput(lambda: sum(1 for t in titles[:5] if scan(t)))
+        results = {'scan lookups/s' : n / seconds}
+        build = throughput(lambda: spark.room_directory.refresh(full=True))[1]
+        n, seconds = throughput(lambda: sum(1 for t in titles if spark.find_room(t)))
+        results.update({'directory build ms' : build * 1000, 'directory lookups/s' : n / seconds})
+        seconds = throughput(spark.room_directory.refresh)[1]
+        results['incremental refresh ms'] = seconds * 1000
+    print_results(results)
+    return results
+
+@benchmark
+def token_refresh():
+    ''' cost of token handling: refresh of the access token and bearer_auth() on each request
+    '''
+    from identity_broker import SparkDevIdentityBroker, OAuthToken
+    user_info = {'id' : 'benchmark', 'email' : 'benchmark@example.com', 'password' : 'benchmark-password'}
+    client_info = {'id' : 'client', 'secret' : 'benchmark-secret', 'redirect_uri' : 'http://localhost/redirect'}
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        # OAuthToken reads the cached refresh token from the current directory
+        os.chdir(folder)
+        with open('benchmark-refresh.json', 'w') as f:
+            json.dump({'token' : 'refresh', 'expires_in' : 7776000, 'token_type' : 'Refresh',
+                       'expires_at' : '2099-01-01 00:00:00'}, f)
+        with standin() as (server, spark):
+            ib = SparkDevIdentityBroker(host=server.host, scheme='http')
+            token = OAuthToken(ib, user_info, client_info)
+            refresh = min(timeit.repeat(token.refresh_access_token, number=20, repeat=3)) / 20
+            bearer = per_call(token.bearer_auth, number=20000)
+            results = {'refresh ms' : refresh * 1000, 'bearer_auth ns' : bearer}
+            for name, api in (('str token', spark),
+                              ('OAuthToken', spark_api.SparkAPI(token, base_url=server.base_url,
+                                                                governor=rate_governor.RateGovernor()))):
+                n, seconds = throughput(lambda: sum(1 for _ in api.list_rooms(p_max=10)))
+                results['list_rooms {} pages/s'.format(name)] = n / 10 / seconds
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+    print_results(results)
+    return results
+
+############################ baselines
+def compare(results, baseline, threshold):
+    ''' print the comparison with the baseline and return the regressions
+    '''
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not base: continue
+            change = value / base - 1
+            # throughput: higher is better, everything else: lower is better
+            worse = -change if metric.endswith('/s') else change
+            flag = ''
+            if worse > threshold:
+                flag = 'REGRESSION'
+                regressions.append((name, metric, base, value))
+            print('{:15s} {:35s} {:12.1f} {:12.1f} {:+7.0%} {}'.format(name, metric, base, value, change, flag))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks for the Spark API helpers')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all): {}'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    parser.add_argument('-b', '--baseline', default='benchmark_baseline.json', help='baseline to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2, help='relative change treated as regression')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as new baseline')
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHMARKS: parser.error('unknown benchmark: {}'.format(name))
+    
+    results = {}
+    for name in args.names or BENCHMARKS:
+        print('{}:'.format(name))
+        results[name] = BENCHMARKS[name]()
+    output = {'python' : platform.python_version(), 'platform' : platform.platform(), 'results' : results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    regressions = []
+    if not os.path.exists(args.baseline) and not args.save_baseline:
+        print('\nNo baseline {}: nothing to compare against (create one with --save-baseline)'.format(args.baseline))
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print('\nComparison with baseline {}:'.format(args.baseline))
+        regressions = compare(results, baseline, args.threshold)
+        print('{} regression(s)'.format(len(regressions)))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=2)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
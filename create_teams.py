@@ -12,12 +12,18 @@ Alex Jones    ajones@collabedge-162.dc-01.com    Sales
 
 For each department found in the file a team is created with the coresponding users as mambers
 
+People, teams and team memberships read from the API can be kept in a persistent cache so that repeated runs don't
+look up the same people again:
+    python3 create_teams.py --cache create_teams.db [--cache-ttl 86400] [--refresh-cache]
+
 '''
 import logging
 import os
 import csv
+import argparse
 import spark_api
 from dump_utilities import set_mask_password
+from disk_cache import DiskCache
 import json
 import datetime
 
@@ -65,13 +71,15 @@ def department_to_team_room(department):
     '''
     return 'Team {}'.format(department)
 
-def create_team(spark, department, users):
+def create_team(spark, department, users, people = None):
     ''' create team room
     
     parameters:
         spark: spark client API
         department: department name
         users: iterable with all users to be added to the team room
+        people: optional dictionary mapping e-mail addresses to people (see resolve_people()). Users with a known
+            person are added by person id
     '''
     
     # map department name to team name
@@ -93,14 +101,19 @@ def create_team(spark, department, users):
     for l in json.dumps(result, indent=2).splitlines():
         log.debug('Create team "{}" result: {}'.format(team_name, l))
     
-    # now add all users to that team
-    for user in users:
-        # try to add as user and intercept spark API errors
-        user_email = user['E-Mail Address']
-        try:
-            result = spark.create_team_membership(p_teamId = team_id, p_personEmail = user_email)
-        except spark_api.APIError as e:
-            log.error('Failed to add user {} to team {}: {}'.format(user_email, team_name, e))
+    # now add all users to that team. The memberships are created concurrently
+    emails = [user['E-Mail Address'] for user in users]
+    people = people or {}
+    memberships = []
+    for email in emails:
+        person = people.get(email)
+        if person:
+            memberships.append({'p_teamId' : team_id, 'p_personId' : person['id']})
+        else:
+            memberships.append({'p_teamId' : team_id, 'p_personEmail' : email})
+    for user_email, membership in zip(emails, spark.bulk_create_team_memberships(memberships)):
+        if membership.error:
+            log.error('Failed to add user {} to team {}: {}'.format(user_email, team_name, membership.error))
         else:
             log.info('  Added user {} to team {}'.format(user_email, team_name))
     log.info('Done creating and adding users to team {}'.format(team_name))
@@ -121,9 +134,26 @@ def read_csv():
 
     return users
 
-def setup_spark():
+def setup_cache(file_name, ttl = 86400, refresh = False):
+    ''' persistent cache for people, teams and team memberships (including the results of the list calls)
+    
+    parameters:
+        file_name: SQLite database file
+        ttl: seconds cached records and lists are used
+        refresh: if True then all cached records are dropped
+    '''
+    lists = {resource : ttl for resource in ('people', 'teams', 'team/memberships')}
+    cache = DiskCache(file_name, ttl = ttl, list_ttls = lists)
+    if refresh:
+        cache.refresh()
+    return cache
+
+def setup_spark(cache = None):
     ''' setup a Spark API instance
     
+    parameters:
+        cache: optional cache for the records read from the API (see setup_cache())
+    
     returns the Spark API instance
     '''
     # the dump_utilities methods called by the Spark API for detailed logging of HTTPS requests can mask a password
@@ -131,10 +161,10 @@ def setup_spark():
     # set some dummy string typically not present
     set_mask_password('.' * 20)
     
-    spark = spark_api.SparkAPI(ACCESS_TOKEN)
+    spark = spark_api.SparkAPI(ACCESS_TOKEN, cache = cache)
     return spark
     
-def create_teams():
+def create_teams(cache = None):
     ''' the actual magic
     read user data from the CSV and create the teams
     '''
@@ -159,18 +189,25 @@ def create_teams():
     print('Departments:\n  {}'.format('\n  '.join((d for d in departments))))
     
     # get a Spark API instance
-    spark = setup_spark()
+    spark = setup_spark(cache)
+    
+    # resolve all e-mail addresses at once: duplicates are only looked up once and the lookups run concurrently
+    people = spark.resolve_people(user['E-Mail Address'] for user in users)
+    unknown = [email for email, person in people.items() if person is None]
+    print('Resolved {} e-mail addresses, {} unknown'.format(len(people), len(unknown)))
+    for email in unknown:
+        log.warning('No person found for {}. Users will be added by e-mail address'.format(email))
     
     # let's now create a team room for each department with the appropriate members
     for department in departments:
-        create_team(spark, department, (user for user in users if department == user['Department']))
+        create_team(spark, department, (user for user in users if department == user['Department']), people)
     print('Done')
  
-def cleanup_teams():
+def cleanup_teams(cache = None):
     ''' delete all teams created by this script
     '''
     # get a Spark API instance
-    spark = setup_spark()
+    spark = setup_spark(cache)
     
     users = read_csv()
     
@@ -193,10 +230,7 @@ def cleanup_teams():
         memberships = spark.list_team_memberships(p_teamId = team['id'])
         
         # try to delete all memberships and ignore Spark API errors
-        for membership in memberships:
-            try:
-                spark.delete_team_membership(membership_id = membership['id'])
-            except spark_api.APIError: pass
+        spark.bulk_delete_team_memberships([membership['id'] for membership in memberships])
         
         # finally try to delete the team and ignore Spark API errors
         log.info('Deleting team {}'.format(team['name']))
@@ -206,9 +240,17 @@ def cleanup_teams():
         except spark_api.APIError: pass
     return
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Create teams for the departments in users.txt')
+    parser.add_argument('--cache', help = 'SQLite file to cache people, teams and team memberships across runs')
+    parser.add_argument('--cache-ttl', type = int, default = 86400, help = 'seconds cached records are used')
+    parser.add_argument('--refresh-cache', action = 'store_true', help = 'drop all cached records first')
+    args = parser.parse_args()
+    
     setup_logging()
     
+    cache = args.cache and setup_cache(args.cache, args.cache_ttl, args.refresh_cache)
+    
     # we have code to create teams and to clean up "the mess"
     # uncomment whatever you want to do
-    create_teams()
-    #cleanup_teams()
\ No newline at end of file
+    create_teams(cache)
+    #cleanup_teams(cache)
\ No newline at end of file
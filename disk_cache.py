@@ -0,0 +1,162 @@
+'''
+Persistent cache for Spark API records
+
+DiskCache keeps results of the get_*_details methods (and optionally all records returned by the list_* methods) in a
+SQLite database so that they survive across runs. It has the same interface as spark_api.ResponseCache and is used the
+same way:
+
+    spark = SparkAPI(token, cache=DiskCache('spark_cache.db', ttls={'people' : 86400}))
+
+Records older than their TTL are ignored and re-read from the API. refresh() drops cached records explicitly.
+
+Complete results of list_* calls can be cached as well. This is enabled per resource by list_ttls; a list_* call with
+the same parameters is then answered from the cache until the TTL expires:
+
+    cache = DiskCache('spark_cache.db', list_ttls={'people' : 86400, 'teams' : 3600})
+
+Creates, updates and deletes through the API instance drop the cached lists of the resource.
+'''
+import sqlite3
+import threading
+import json
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+def _to_json(o):
+    # spark_models.Model instances are cached as dictionaries
+    return o.to_dict()
+
+class DiskCache:
+    def __init__(self, file_name, ttl = 3600, ttls = None, store_listed = True, list_ttls = None):
+        '''
+        parameters:
+            file_name: name of the SQLite database file. Created if it doesn't exist
+            ttl:    default time to live in seconds
+            ttls:   dictionary with TTLs for specific resources ('people', 'rooms', 'memberships', 'teams',
+                    'team/memberships', 'webhooks')
+            store_listed: if True then all records read by list_* methods are cached as well
+            list_ttls: dictionary with TTLs for complete list results of specific resources. Lists of resources
+                    not in list_ttls are not cached
+        '''
+        self.file_name = file_name
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.store_listed = store_listed
+        self.list_ttls = list_ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(file_name, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS records (resource TEXT, id TEXT, params TEXT, stored REAL, value TEXT, '
+                         'PRIMARY KEY (resource, id, params))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS lists (resource TEXT, params TEXT, stored REAL, value TEXT, '
+                         'PRIMARY KEY (resource, params))')
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, resource, resource_id, params = ()):
+        ''' get a cached record. Raises KeyError if there is no valid cached record
+        '''
+        with self._lock:
+            row = self._db.execute('SELECT stored, value FROM records WHERE resource=? AND id=? AND params=?',
+                                   (resource, resource_id, json.dumps(params))).fetchone()
+            if row is None or row[0] + self.ttls.get(resource, self.ttl) < time.time():
+                self.misses += 1
+                raise KeyError((resource, resource_id, params))
+            self.hits += 1
+        return json.loads(row[1])
+
+    def put(self, resource, resource_id, value, params = ()):
+        self.put_many(resource, [(resource_id, value)], params)
+
+    def put_many(self, resource, records, params = ()):
+        ''' cache multiple records of the same resource in a single transaction
+        records is an iterable of (id, value) tuples
+        '''
+        now = time.time()
+        params = json.dumps(params)
+        rows = [(resource, resource_id, params, now, json.dumps(value, default=_to_json)) for resource_id, value in records]
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+
+    def get_list(self, resource, params):
+        ''' get a cached list result. Raises KeyError if there is no valid cached list
+        '''
+        params = json.dumps(sorted(params.items()))
+        with self._lock:
+            row = self._db.execute('SELECT stored, value FROM lists WHERE resource=? AND params=?',
+                                   (resource, params)).fetchone()
+            if row is None or row[0] + self.list_ttls.get(resource, 0) < time.time():
+                self.misses += 1
+                raise KeyError((resource, params))
+            self.hits += 1
+        return json.loads(row[1])
+
+    def put_list(self, resource, params, items):
+        ''' cache the complete result of a list_* call
+        '''
+        row = (resource, json.dumps(sorted(params.items())), time.time(), json.dumps(items, default=_to_json))
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO lists VALUES (?, ?, ?, ?)', row)
+            self._db.commit()
+
+    def invalidate(self, resource, resource_id):
+        ''' remove all cached records for a given resource. Cached lists of the resource are dropped as well
+        '''
+        self.refresh(resource, resource_id)
+
+    def invalidate_lists(self, resource):
+        ''' drop all cached lists of a resource
+        '''
+        with self._lock:
+            self._db.execute('DELETE FROM lists WHERE resource=?', (resource, ))
+            self._db.commit()
+
+    def refresh(self, resource = None, resource_id = None):
+        ''' drop cached records so that they are read from the API again
+        If no resource is given all records are dropped. If resource_id is not given all records of the resource are
+        dropped
+        '''
+        sql = 'DELETE FROM records'
+        args = ()
+        if resource is not None:
+            sql += ' WHERE resource=?'
+            args = (resource, )
+            if resource_id is not None:
+                sql += ' AND id=?'
+                args += (resource_id, )
+        with self._lock:
+            self._db.execute(sql, args)
+            self._db.execute('DELETE FROM lists' + (' WHERE resource=?' if resource is not None else ''),
+                             args[:1])
+            self._db.commit()
+
+    def clear(self):
+        self.refresh()
+
+    def purge(self):
+        ''' delete all expired records from the database
+        '''
+        now = time.time()
+        with self._lock:
+            for resource, in self._db.execute('SELECT DISTINCT resource FROM records').fetchall():
+                self._db.execute('DELETE FROM records WHERE resource=? AND stored<?',
+                                 (resource, now - self.ttls.get(resource, self.ttl)))
+            for resource, in self._db.execute('SELECT DISTINCT resource FROM lists').fetchall():
+                self._db.execute('DELETE FROM lists WHERE resource=? AND stored<?',
+                                 (resource, now - self.list_ttls.get(resource, 0)))
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+            lists = self._db.execute('SELECT COUNT(*) FROM lists').fetchone()[0]
+            return {'size' : size, 'lists' : lists, 'hits' : self.hits, 'misses' : self.misses}
@@ -2,33 +2,194 @@
 Created on 07.12.2015
 
 @author: jkrohn
+
+Detailed logging of requests and responses (log level DEBUG).
+
+By default dump_response() formats everything synchronously on the thread executing the request. After
+set_async_dump() dump_response() only captures the request and response and queues the capture; formatting and logging
+happens on a background thread:
+    * bodies are capped at max_body bytes
+    * only 1 in sample responses is dumped; responses with status code >= 400 are always dumped
+    * if the queue is full the capture is dropped instead of blocking the API call. Dropped captures are counted and
+      reported in the log
+
+All secrets registered with the redactor (redactor.add(), set_mask_password()) are masked in the dumps. OAuth tokens
+and the credentials used by identity_broker.OAuthToken are registered automatically. Streamed bodies are logged while
+they are read by passing the chunks through dump_stream(); secrets spanning chunks are masked as well.
 '''
 from urllib.parse import urlparse, parse_qsl
 import xml.dom.minidom
 import logging
 import json
+import threading
+import queue
+import itertools
+import atexit
+import time
+import re
+from collections import OrderedDict
 
 log = logging.getLogger(__name__)
 
+def _trie_regex(secrets):
+    ''' regular expression matching any of the secrets
+    The secrets are arranged in a trie so that the regex engine only follows the branches matching the text and
+    doesn't have to try all secrets at each position
+    '''
+    trie = {}
+    for secret in secrets:
+        node = trie
+        for c in secret:
+            node = node.setdefault(c, {})
+        node[''] = None
+    
+    def pattern(node):
+        end = '' in node
+        branches = [re.escape(c) + pattern(child) for c, child in sorted(node.items()) if c]
+        if not branches: return ''
+        if len(branches) == 1 and not end:
+            return branches[0]
+        result = '(?:' + '|'.join(branches) + ')'
+        # the longest match wins: the optional branches are tried first
+        return result + '?' if end else result
+    return pattern(trie)
+
+class Redactor:
+    ''' masks many secrets in a single pass
+    All secrets are compiled into a single regular expression. The expression is rebuilt (lazily) when secrets are
+    added or removed. Only the max_secrets most recently added secrets are kept.
+    '''
+    def __init__(self, mask = '*', max_secrets = 1000, min_length = 4):
+        self.mask = mask
+        self.max_secrets = max_secrets
+        self.min_length = min_length
+        self._secrets = OrderedDict()
+        self._lock = threading.Lock()
+        self._patterns = None
+        
+    def add(self, *secrets):
+        with self._lock:
+            for secret in secrets:
+                # very short secrets would mask random parts of the text
+                if not isinstance(secret, str) or len(secret) < self.min_length: continue
+                self._secrets.pop(secret, None)
+                self._secrets[secret] = None
+            while len(self._secrets) > self.max_secrets:
+                self._secrets.popitem(last = False)
+            self._patterns = None
+            
+    def remove(self, *secrets):
+        with self._lock:
+            for secret in secrets:
+                self._secrets.pop(secret, None)
+            self._patterns = None
+    
+    def __len__(self):
+        return len(self._secrets)
+    
+    @property
+    def max_length(self):
+        # in bytes: at least the length in characters
+        return max((len(s.encode('utf-8')) for s in self._secrets), default = 0)
+            
+    def _compiled(self):
+        patterns = self._patterns
+        if patterns is None:
+            with self._lock:
+                if self._secrets:
+                    regex = _trie_regex(self._secrets)
+                    patterns = (re.compile(regex), re.compile(regex.encode('utf-8')))
+                else:
+                    patterns = (None, None)
+                self._patterns = patterns
+        return patterns
+    
+    def redact(self, text):
+        ''' text (str or bytes) with all secrets masked
+        '''
+        pattern = self._compiled()[isinstance(text, bytes)]
+        if pattern is None or not text: return text
+        mask = self.mask.encode('utf-8') if isinstance(text, bytes) else self.mask
+        return pattern.sub(lambda m: mask * len(m.group()), text)
+    
+    def redact_stream(self, chunks):
+        ''' redact an iterable of chunks (str or bytes)
+        The last max_length - 1 characters of each chunk are held back until the next chunk arrives so that secrets
+        spanning chunk boundaries are masked as well
+        '''
+        stream = _StreamRedaction(self)
+        for chunk in chunks:
+            data = stream.feed(chunk)
+            if data: yield data
+        data = stream.close()
+        if data: yield data
+
+    def truncate(self, text, length):
+        ''' the first length characters (or bytes) of text with all secrets masked. Secrets cut off at length are
+        masked as well
+        '''
+        return self.redact(text[:length + max(self.max_length - 1, 0)])[:length]
+
+class _StreamRedaction:
+    ''' state of the redaction of a stream: the part of the data which might be the start of a secret
+    '''
+    def __init__(self, redactor):
+        self.redactor = redactor
+        self.tail = None
+
+    def feed(self, chunk):
+        ''' redacted data which can be released after adding chunk
+        '''
+        data = chunk if self.tail is None else self.tail + chunk
+        cut = max(len(data) - max(self.redactor.max_length - 1, 0), 0)
+        pattern = self.redactor._compiled()[isinstance(data, bytes)]
+        if pattern is not None:
+            for m in pattern.finditer(data):
+                if m.end() > cut:
+                    # never split a match: hold back the complete match
+                    cut = min(cut, m.start())
+                    break
+        self.tail = data[cut:]
+        return self.redactor.redact(data[:cut])
+
+    def close(self):
+        ''' redacted remainder at the end of the stream
+        '''
+        tail, self.tail = self.tail, None
+        return self.redactor.redact(tail) if tail else tail
+
+redactor = Redactor()
+
 pwd = None
 def set_mask_password(password):
     global pwd
     pwd = password
+    redactor.add(password)
 
-def print_pwd(text):
-    global pwd
-    if not pwd: raise Exception('Before using dump_utilities a password to be masked in the output needs to be set by calling "set_mask_password"')
+def _ascii(text):
     try:
-        text = text.replace(pwd, '*' * len(pwd))
         text = text.encode('ascii', 'replace')
         text = text.decode('ascii')
     except Exception: pass
-    log.debug(text)
+    return text
+
+def print_pwd(text):
+    global pwd
+    if not pwd: raise Exception('Before using dump_utilities a password to be masked in the output needs to be set by calling "set_mask_password"')
+    log.debug(_ascii(redactor.redact(text)))
+
+def print_lines(text, indent = '    '):
+    ''' log the non empty lines of a text. The text is redacted once and not line by line
+    '''
+    if not pwd: raise Exception('Before using dump_utilities a password to be masked in the output needs to be set by calling "set_mask_password"')
+    if isinstance(text, bytes): text = text.decode('utf-8', 'replace')
+    text = _ascii(redactor.redact(text))
+    for l in (l for l in text.splitlines() if l.strip()): log.debug(indent + l)
     
 def dump_req_body(request):
     if not request.body: return
     log.debug('Request body:')
-    for l in (l for l in request.body.splitlines() if l): print_pwd('  %s' % l)
+    print_lines(request.body, '  ')
     if request.headers['content-type'] == 'application/x-www-form-urlencoded':
         print_pwd('  Form data:')
         query = parse_qsl(request.body, keep_blank_values=True)
@@ -36,8 +197,10 @@ def dump_req_body(request):
             print_pwd('    %s=%s' % (k,v))
 
 def print_header(header, value):
-    if header == 'Authorization':
-        value = value[:20] + '...'
+    if header.lower() == 'authorization':
+        # credentials are never dumped, not even if they are unknown to the redactor: only the scheme is shown
+        scheme, _, credentials = value.partition(' ')
+        value = '{} {}'.format(scheme, redactor.mask * len(credentials)) if credentials else redactor.mask * len(value)
     print_pwd('  >%s: %s<' % (header, value))
     if header == 'location':
         parsed_url = urlparse(value)
@@ -67,17 +230,22 @@ def dump_resp_body(response):
     if not response.content: return
     
     log.debug('Response content:')
+    if getattr(response, 'truncated', 0):
+        # captured body has been capped: can't be parsed
+        print_lines(response.text)
+        print_pwd('    ... ({} more bytes)'.format(response.truncated))
+        return
     if response.headers['content-type'].startswith('text/html'):
         try:
             xml_p = xml.dom.minidom.parseString(response.text)
         except Exception:
-            for l in (l for l in response.text.splitlines() if l.strip()): print_pwd('    %s' % l)
+            print_lines(response.text)
         else:
-            for l in (l for l in xml_p.toprettyxml().splitlines() if l.strip()): print_pwd('    %s' % l)
+            print_lines(xml_p.toprettyxml())
         return
     if response.headers['content-type'].startswith('application/json'):
         #print('    %s' % response.json())
-        s = json.dumps(response.json(), indent=2)
+        s = redactor.redact(json.dumps(response.json(), indent=2))
         class DumpStop(Exception): pass
         line = 1
         try:
@@ -91,16 +259,191 @@ def dump_resp_body(response):
         return
     print_pwd(response.content)
    
+def dump_stream(chunks, max_body = 16384):
+    ''' pass through the chunks of a streamed body (str or bytes). With debug logging the body is logged while it is
+    read: secrets are masked even if they span chunks. Only the first max_body bytes are logged
+    '''
+    if not log.isEnabledFor(logging.DEBUG):
+        yield from chunks
+        return
+    log.debug('Streamed content:')
+    stream = _StreamRedaction(redactor)
+    logged = 0
+    size = 0
+
+    def print_chunk(data):
+        if isinstance(data, bytes): data = data.decode('utf-8', 'replace')
+        for l in (l for l in data.splitlines() if l.strip()): log.debug('    ' + _ascii(l))
+
+    for chunk in chunks:
+        size += len(chunk)
+        if logged < max_body:
+            data = stream.feed(chunk)[:max_body - logged]
+            logged += len(data)
+            print_chunk(data)
+        yield chunk
+    if logged < max_body:
+        print_chunk((stream.close() or '')[:max_body - logged])
+    elif size > max_body:
+        log.debug('    ... ({} more bytes)'.format(size - max_body))
+
 def dump_response(response, dump_history=True, force = False, dump_body=True):
     ''' Dump all 'relevant' information from a requests response
     '''
     if not log.isEnabledFor(logging.DEBUG): return
+    if pipeline is not None:
+        pipeline.submit(response, dump_history=dump_history, dump_body=dump_body)
+        return
+    _dump(response, dump_history, dump_body)
+
+def _dump(response, dump_history, dump_body):
+    ''' format a response (requests.Response or a capture of a response)
+    '''
     if dump_history:
-        for r in response.history: dump_response(r, dump_history=False, force=force)
+        for r in response.history: _dump(r, False, True)
     dump_request(response.request)
     log.debug('=' * 10 + 'Response start')
     log.debug('Status Code: %s %s' % (response.status_code, response.reason))
     log.debug('Response headers:')
     for h in response.headers: print_header(h, response.headers[h])
     if dump_body: dump_resp_body(response)
-    log.debug('=' * 10 + ' Response end') 
+    log.debug('=' * 10 + ' Response end')
+
+class _CapturedRequest:
+    ''' copy of the parts of a requests.PreparedRequest needed by dump_request()
+    '''
+    def __init__(self, request, max_body):
+        self.method = request.method
+        self.url = request.url
+        self.headers = request.headers.copy()
+        body = request.body
+        if not isinstance(body, (str, bytes)):
+            # streamed uploads (files, generators) are not dumped
+            body = None
+        if body and len(body) > max_body:
+            # a secret cut off at max_body would not be recognized later
+            body = redactor.truncate(body, max_body)
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        self.body = body
+
+class _CapturedResponse:
+    ''' copy of the parts of a requests.Response needed by dump_response()
+    '''
+    def __init__(self, response, max_body, dump_body):
+        self.request = _CapturedRequest(response.request, max_body)
+        self.status_code = response.status_code
+        self.reason = response.reason
+        self.headers = response.headers.copy()
+        self.history = [_CapturedResponse(r, max_body, False) for r in response.history]
+        self.truncated = 0
+        self.content = b''
+        if dump_body:
+            content = response.content or b''
+            if len(content) > max_body:
+                self.truncated = len(content) - max_body
+                # a secret cut off at max_body would not be recognized later
+                content = redactor.truncate(content, max_body)
+            self.content = content
+        self.encoding = response.encoding or 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+class DumpPipeline:
+    ''' queue of captured responses formatted and logged by a background thread
+    '''
+    def __init__(self, max_queue = 1000, sample = 1, max_body = 16384):
+        self.sample = max(int(sample), 1)
+        self.max_body = max_body
+        self.queue = queue.Queue(maxsize = max_queue)
+        # counters are updated by the threads submitting responses and by the background thread
+        self._lock = threading.Lock()
+        self.dumped = 0
+        self.skipped = 0
+        self.dropped = 0
+        self._reported = 0
+        self._counter = itertools.count()
+        self._thread = threading.Thread(target = self._run, name = 'dump_utilities', daemon = True)
+        self._thread.start()
+
+    def submit(self, response, dump_history = True, dump_body = True):
+        if response.status_code < 400 and next(self._counter) % self.sample:
+            with self._lock:
+                self.skipped += 1
+            return
+        try:
+            self.queue.put_nowait((_CapturedResponse(response, self.max_body, dump_body), dump_history))
+        except queue.Full:
+            # never block an API call b/c of logging
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                if entry is None: return
+                captured, dump_history = entry
+                with self._lock:
+                    dropped = self.dropped - self._reported
+                    self._reported = self.dropped
+                if dropped:
+                    log.debug('{} response dump(s) dropped (queue full)'.format(dropped))
+                # bodies not to be dumped have not been captured
+                _dump(captured, dump_history, True)
+                with self._lock:
+                    self.dumped += 1
+            except Exception:
+                log.exception('Dumping response failed')
+            finally:
+                self.queue.task_done()
+        # while True:
+
+    def flush(self, timeout = 5):
+        ''' wait until all queued captures have been logged. Returns False if the timeout expired
+        '''
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if time.monotonic() > deadline: return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout = 5):
+        self.flush(timeout)
+        try:
+            self.queue.put(None, timeout = timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'queued' : self.queue.qsize(), 'dumped' : self.dumped, 'skipped' : self.skipped,
+                    'dropped' : self.dropped}
+
+pipeline = None
+def set_async_dump(enabled = True, max_queue = 1000, sample = 1, max_body = 16384):
+    ''' enable (or disable) formatting of dumps on a background thread
+    parameters:
+        max_queue: maximum number of captures waiting to be logged. Further captures are dropped
+        sample: only dump 1 in sample responses. Responses with status code >= 400 are always dumped
+        max_body: request and response bodies are capped at that many bytes
+    returns the DumpPipeline (or None)
+    '''
+    global pipeline
+    if pipeline is not None:
+        pipeline.stop()
+        pipeline = None
+    if enabled:
+        pipeline = DumpPipeline(max_queue = max_queue, sample = sample, max_body = max_body)
+    return pipeline
+
+@atexit.register
+def _flush_at_exit():
+    if pipeline is not None:
+        pipeline.flush()
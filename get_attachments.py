@@ -19,20 +19,40 @@ Configuration required:
     * client ID and secret
     * user: id, email, password
     * base folder: 
+
+Optional persistent cache (section [cache] in get_attachments.ini). The list of rooms is taken from the cache for ttl
+seconds; rooms with new activity are only detected once the cached list has expired:
+    [cache]
+    file = get_attachments.db
+    ttl = 3600
+Running with --refresh-cache drops the cached records.
+
+Optional trace of all rooms, message pages and attachment downloads (section [trace] in get_attachments.ini). The
+trace contains the room titles:
+    [trace]
+    file = get_attachments.trace
+
+Requests and responses can be formatted for the debug log on a background thread (dumps are dropped if the thread
+can't keep up and are logged after the log messages of the API calls):
+    [dump]
+    async = yes
 '''
 import logging
 import configparser
 import re
-import datetime
 import cgi
 import os
 import shutil
 import json
 import time
+import argparse
 
-from dump_utilities import set_mask_password, dump_response
+from dump_utilities import set_mask_password, dump_response, set_async_dump
 from identity_broker import SparkDevIdentityBroker, OAuthToken
 import spark_api 
+import spark_time
+from spark_trace import Tracer, NullTracer
+from disk_cache import DiskCache
 
 def setup_logging():
     logging.basicConfig(level=logging.DEBUG,
@@ -63,10 +83,9 @@ def valid_filename(s):
     return re.sub(r'(?u)[^-\w.]', '', s)  
         
 def str_to_datetime(s):
-    dt = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
-    return dt
+    return spark_time.parse(s)
 
-def get_attachments():
+def get_attachments(refresh_cache = False):
     
     def assert_folder(p_state, base_path, room_id, room_folder):
         ''' make sure that the folder is created for the room
@@ -277,11 +296,34 @@ def get_attachments():
     ib = SparkDevIdentityBroker()
     oauth_token = OAuthToken(ib, spark_config['user'], spark_config['client'])
     
-    spark = spark_api.SparkAPI(oauth_token)
-    
     att_config = configparser.ConfigParser()
     att_config.read(os.path.splitext(__file__)[0] + '.ini')
     
+    if att_config.getboolean('dump', 'async', fallback = False):
+        # requests and responses are formatted on a background thread and not on the request path. Dumps are
+        # dropped if the background thread can't keep up
+        set_async_dump(max_queue=1000, max_body=16384)
+    
+    # optional trace of all rooms, message pages and attachment downloads. Each room is written to the trace file when
+    # it is done: the trace held in memory doesn't grow with the number of rooms
+    tracing = att_config.has_section('trace')
+    trace_file = None
+    
+    def write_trace(span):
+        # the span of the room being processed when an exception occurs only finishes after the file is closed
+        if trace_file is not None and not trace_file.closed:
+            trace_file.write('\n'.join(span.format()) + '\n')
+    
+    tracer = Tracer(sink=write_trace) if tracing else NullTracer()
+    
+    cache = None
+    if att_config.has_section('cache'):
+        ttl = att_config['cache'].getint('ttl', 3600)
+        cache = DiskCache(os.path.expanduser(att_config['cache']['file']), ttl = ttl, list_ttls = {'rooms' : ttl})
+        if refresh_cache:
+            cache.refresh()
+    spark = spark_api.SparkAPI(oauth_token, tracer=tracer if tracing else None, cache=cache)
+    
     base_path = os.path.abspath(os.path.expanduser(att_config['path']['base']))
     
     state_file = os.path.splitext(__file__)[0] + '.json'
@@ -295,25 +337,29 @@ def get_attachments():
         p_state = json.load(f)
         f.close()
     
-    logging.info('Getting list of rooms...')
+    if tracing:
+        trace_file = open(os.path.expanduser(att_config['trace']['file']), 'w')
     try:
-        rooms = list(spark.list_rooms())
-    except spark_api.APIError as e:
+        logging.info('Getting list of rooms...')
         try:
-            logging.error('Error getting rooms: %s' % e.args[2]['message'])
-        except Exception:
-            logging.error('Error getting rooms: %s' % e.args[2])
-        rooms = []
-    logging.info('Found {} rooms'.format(len(rooms)))
-    
-    try:
-        for room in rooms:
+            with tracer.span('rooms'):
+                rooms = list(spark.list_rooms())
+        except spark_api.APIError as e:
+            try:
+                logging.error('Error getting rooms: %s' % e.args[2]['message'])
+            except Exception:
+                logging.error('Error getting rooms: %s' % e.args[2])
+            rooms = []
+        logging.info('Found {} rooms'.format(len(rooms)))
+        
+        for room in tracer.traced(rooms, 'room', lambda room: {'title' : room.get('title', room['id'])}):
             room_id = room['id']
             # in case the room doesn't have a title we use the room ID as fallback
             room_folder = valid_filename(room.get('title', room_id))
             
             logging.info('Checking room \'%s\'' % room_folder)
-            logging.debug('ID: %s, %s' % (room_id, spark_api.base64_id_to_str(room_id)))
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug('ID: %s, %s' % (room_id, spark_api.base64_id_to_str(room_id)))
             last_activity = check_new_activity(p_state, room)
             if last_activity == None:
                 logging.info('No new activity. Skipping room')
@@ -344,7 +390,8 @@ def get_attachments():
                     message_created = str_to_datetime(message['created'])
                     logging.info('  %s: Message with %s attachments.' % (message_created.isoformat(), len(message['files'])))
                     
-                    for attachment_index in range(len(message['files'])):
+                    for attachment_index in tracer.traced(range(len(message['files'])), 'attachment',
+                                                          lambda index: {'index' : index}):
                         attachment = message['files'][attachment_index]
                         
                         class DownloadError(Exception): pass
@@ -410,16 +457,16 @@ def get_attachments():
                 messages = []
             
             logging.debug('Saving state to file %s' % state_file)
-            f = open(state_file, 'w')
-            json.dump(p_state, f, indent = 4)
-            f.close()
+            with open(state_file, 'w') as f:
+                json.dump(p_state, f, indent = 4)
                 
-    except Exception:
+    finally:
+        # also if interrupted
         logging.debug('Saving state to file %s' % state_file)
-        f = open(state_file, 'w')
-        json.dump(p_state, f, indent = 4)
-        f.close()
-        raise
+        with open(state_file, 'w') as f:
+            json.dump(p_state, f, indent = 4)
+        if trace_file is not None:
+            trace_file.close()
     # Setting the last modified date of the folders in line with the latest attachment in the room is a nice idea
     for room_state in (r for r in p_state.values() if 'folder' in r):
         folder = os.path.join(base_path, room_state['folder'])
@@ -434,4 +481,7 @@ def get_attachments():
     return
 
 if __name__ == '__main__':
-    get_attachments()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = 'Download the attachments of all Spark rooms')
+    parser.add_argument('--refresh-cache', action = 'store_true', help = 'drop all cached records first')
+    args = parser.parse_args()
+    get_attachments(refresh_cache = args.refresh_cache)
\ No newline at end of file
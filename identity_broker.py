@@ -34,8 +34,8 @@ import json
 import base64
 import xml.dom.minidom
 
-from spark_struct import Struct
-from dump_utilities import dump_response
+from spark_struct import Struct, StructView
+from dump_utilities import dump_response, redactor
 
 log = logging.getLogger(__name__)
 
@@ -45,12 +45,19 @@ class IbError(Exception): pass
 
 class CiscoIdentityBroker:
         
-    def __init__(self, host='idbroker.webex.com'):
+    def __init__(self, host='idbroker.webex.com', scheme='https', adapter=None):
+        ''' scheme 'http' can be used with a local stand-in (spark_standin.StandIn)
+        adapter is an optional transport adapter for all requests (for example a spark_cassette.RecordingAdapter)
+        '''
         self.host = host
+        self.scheme = scheme
         self.session = requests.Session()
+        if adapter:
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
         
     def endpoint(self, ep):
-        return 'https://' + self.host + '/idb/oauth2/v1/' + ep
+        return self.scheme + '://' + self.host + '/idb/oauth2/v1/' + ep
     
     class URLIntercepted (Exception): pass
     
@@ -324,7 +331,7 @@ class CiscoIdentityBroker:
         dump_response(response)
         if response.status_code != 200: raise IbError('Unexpected status code on POST(12): {} {}'.format(response.status_code, response.reason))
         
-        oauth_token = Struct(response.json())
+        oauth_token = StructView(response.json())
         return oauth_token
     
     def refresh_token_to_access_token(self, refresh_token, client_info):
@@ -342,18 +349,18 @@ class CiscoIdentityBroker:
             if response.status_code != 401: break
             log.warning('Got 401 on token refresh. Retrying...')
         if response.status_code != 200: raise IbError('Unexpected status code on GET(12): {} {}'.format(response.status_code, response.reason), response.status_code, response.reason, response.text)
-        result = Struct(response.json())
+        result = StructView(response.json())
         return result
 
 class SparkDevIdentityBroker(CiscoIdentityBroker):
     ''' Identity broker API specific to the the api.ciscospark.com flows:
     https://dev-preview.ciscospark.com/authentication.html
     '''
-    def __init__(self, host='api.ciscospark.com'):
-        CiscoIdentityBroker.__init__(self, host)
+    def __init__(self, host='api.ciscospark.com', scheme='https', adapter=None):
+        CiscoIdentityBroker.__init__(self, host, scheme, adapter)
         
     def endpoint(self, ep):
-        return 'https://' + self.host + '/v1/' + ep
+        return self.scheme + '://' + self.host + '/v1/' + ep
     
     def auth_code_grant_flow(self, user_info, client_info, scope = 'spark:people_read spark:rooms_read spark:memberships_read spark:messages_read spark:rooms_write spark:memberships_write spark:messages_write spark:teams_read spark:teams_write spark:team_memberships_read spark:team_memberships_write'):
         ''' scope is a space separated list of requested scopes:
@@ -377,6 +384,8 @@ class SparkCCMIndentityBroker(CiscoIdentityBroker):
 class AuthToken(Struct):
     def __init__(self, token, expires_in, token_type, expires_at = None):
         Struct.__init__(self, {k:v for k,v in locals().items() if k != 'self'})
+        # tokens should never show up in dumps
+        redactor.add(token)
         if expires_at == None:
             issued = datetime.utcnow()
             self.expires_at = issued + timedelta(seconds=self.expires_in)
@@ -425,6 +434,7 @@ class OAuthToken(AuthToken):
         self._user_info = user_info
         self._client_info = client_info
         self.cache_token = cache_token
+        redactor.add(user_info.get('password'), client_info.get('secret'))
         
         refresh_token = None
         if cache_token:
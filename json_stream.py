@@ -0,0 +1,160 @@
+'''
+Incremental parsing of JSON documents
+
+iter_items() takes an iterable of byte chunks (for example response.iter_content() of a streamed requests response)
+and yields the elements of a list in a JSON object as soon as they have been decoded:
+
+    for item in iter_items(response.iter_content(chunk_size=65536)):
+        ...
+
+Only the element being decoded and the current chunk are held in memory, independent of the size of the document.
+Objects, arrays and strings are only decoded once they are complete: the chunks are scanned for the end of the value
+(each character once) and the value is then decoded in a single call of the JSON decoder.
+'''
+import json
+import codecs
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = _whitespace + ',]}:'
+# characters changing the nesting depth or starting a string; characters ending a string or starting an escape
+_structural = re.compile(r'[\[\]{}"]')
+_string = re.compile(r'["\\]')
+
+class _Reader:
+    ''' buffer over an iterable of byte chunks
+    '''
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        # state of the scan for the end of the current value: position (relative to pos), depth, in string
+        self._scan = (0, 0, False)
+
+    def more(self):
+        ''' append the next chunk to the buffer. Returns False if there is no more data
+        '''
+        if self.eof: return False
+        text = ''
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text: break
+        else:
+            text = self._utf8.decode(b'', final=True)
+            self.eof = True
+        # drop what has been consumed already
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return bool(text) or not self.eof
+
+    def peek(self):
+        ''' next non whitespace character ('' at the end of the document)
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, chars):
+        ''' consume the next non whitespace character which has to be one of chars
+        '''
+        c = self.peek()
+        if not c or c not in chars:
+            raise json.JSONDecodeError('Expecting one of {!r}'.format(chars), self.buf, self.pos)
+        self.pos += 1
+        return c
+
+    def _end(self):
+        ''' end of the object, array or string starting at pos (None if it's not complete yet)
+        The scan continues where the previous call stopped
+        '''
+        buf = self.buf
+        i, depth, in_string = self._scan
+        i += self.pos
+        while True:
+            if in_string:
+                m = _string.search(buf, i)
+                if m is None:
+                    i = len(buf)
+                    break
+                if m.group() == '\\':
+                    if m.end() >= len(buf):
+                        # the escaped character is in the next chunk
+                        i = m.start()
+                        break
+                    i = m.end() + 1
+                    continue
+                in_string = False
+                i = m.end()
+                if depth == 0: return i
+                continue
+            m = _structural.search(buf, i)
+            if m is None:
+                i = len(buf)
+                break
+            c = m.group()
+            i = m.end()
+            if c == '"':
+                in_string = True
+            elif c in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0: return i
+        self._scan = (i - self.pos, depth, in_string)
+        return None
+
+    def value(self):
+        ''' decode the next JSON value
+        '''
+        c = self.peek()
+        if c and c in '{["':
+            # decode only once the value is complete
+            self._scan = (0, 0, False)
+            while self._end() is None:
+                if not self.more():
+                    raise json.JSONDecodeError('Unterminated value', self.buf, self.pos)
+            value, self.pos = _decoder.raw_decode(self.buf, self.pos)
+            return value
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # value might be incomplete
+                if not self.more(): raise
+                continue
+            if (end == len(self.buf) or self.buf[end] not in _delimiters) and not self.eof and self.more():
+                # a number might continue in the next chunk: '1.' and '1.5e' are decoded as 1
+                continue
+            self.pos = end
+            return value
+
+def iter_items(chunks, key = 'items'):
+    ''' yield the elements of the list stored under key in the JSON object read from chunks
+    All other members of the object are skipped
+    '''
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key:
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']': break
+        else:
+            reader.value()
+        if reader.expect(',}') == '}': break
+    return
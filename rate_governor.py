@@ -0,0 +1,100 @@
+'''
+Process wide rate governor for Spark API calls
+
+All SparkAPI (and AsyncSparkAPI) instances by default share the module level governor instance. Before each request
+a token is taken from a token bucket; if the bucket is empty the caller has to wait until the bucket has been refilled.
+If the server answers with a 429 the Retry-After value is honored globally: all callers wait until the retry time
+has passed instead of each caller retrying on its own.
+
+Client side pacing is disabled by default (rate = None). To pace all API calls of the process:
+
+    rate_governor.governor.configure(rate=5, burst=10)
+'''
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+class RateGovernor:
+    def __init__(self, rate = None, burst = None):
+        '''
+        parameters:
+            rate:   sustained number of requests per second. None disables client side pacing
+            burst:  size of the token bucket, defaults to rate (at least 1)
+        '''
+        self._lock = threading.Lock()
+        self._blocked_until = 0
+        self.throttled = 0
+        self.configure(rate, burst)
+
+    def configure(self, rate = None, burst = None):
+        with self._lock:
+            self.rate = rate
+            self.burst = burst or max(rate or 1, 1)
+            self._tokens = self.burst
+            self._last = time.monotonic()
+
+    def _refill(self, now):
+        if now > self._last:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+    def reserve(self):
+        ''' take a token from the bucket
+        returns the number of seconds the caller has to wait before sending the request
+        '''
+        with self._lock:
+            now = time.monotonic()
+            wait = 0
+            if self.rate:
+                self._refill(now)
+                self._tokens -= 1
+                # tokens only accrue after _last; a negative balance is the debt the caller needs to wait for
+                wait = max(0, self._last - now) + max(0, -self._tokens) / self.rate
+            return max(wait, self._blocked_until - now)
+
+    def acquire(self):
+        ''' wait until the next request can be sent
+        '''
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def retry_after(self, seconds):
+        ''' server sent a 429 with Retry-After: no request should be sent before that time has passed
+        '''
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            if self.rate:
+                # start refilling an empty bucket when the block is over
+                self._refill(now)
+                self._tokens = min(self._tokens, 0)
+                self._last = max(self._last, self._blocked_until)
+
+    def budget(self):
+        ''' current budget of the governor
+        returns a dictionary with
+            rate:           configured rate
+            burst:          configured size of the token bucket
+            tokens:         requests which can be sent right now w/o waiting (None if no client side pacing)
+            blocked_for:    seconds until the current Retry-After block ends
+            throttled:      number of 429s seen so far
+        '''
+        with self._lock:
+            now = time.monotonic()
+            tokens = None
+            if self.rate:
+                self._refill(now)
+                tokens = self._tokens
+            return {'rate' : self.rate,
+                    'burst' : self.burst,
+                    'tokens' : tokens,
+                    'blocked_for' : max(0, self._blocked_until - now),
+                    'throttled' : self.throttled}
+
+# the governor shared by all API instances of the process
+governor = RateGovernor()
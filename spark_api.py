@@ -7,30 +7,51 @@ Simplified Spark APIs
 https://developer.ciscospark.com
 '''
 import requests
-import base64
-from datetime import datetime
+import requests.adapters
+from urllib3.connection import HTTPConnection
+import socket
 from json.decoder import JSONDecodeError
 from functools import wraps
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import inspect
 import logging
 import time
+import os
+import threading
+import queue
+import itertools
 
-from dump_utilities import dump_response
+from dump_utilities import dump_response, dump_stream, redactor
+import json_stream
+import spark_models
+import rate_governor
+import spark_metrics
+import spark_trace
+import spark_directory
+import spark_ids
+import spark_time
 
 log = logging.getLogger(__name__)
 
+# size of the chunks read from the network when decoding streamed pages
+STREAM_CHUNK_SIZE = 65536
+
+# base URL of the API. Can be changed per SparkAPI instance (for example to use spark_standin)
+BASE_URL = 'https://api.ciscospark.com/v1'
+
 def base64_id_to_str(spark_id):
-    ''' decode a Spark id (base64 encoded)
+    ''' decode a Spark id (base64 encoded). See spark_ids
     '''
-    #spark_id += '=' * ((4 - len(spark_id) % 4) % 4)
-    return base64.b64decode(spark_id + '==').decode()        
+    return spark_ids.decode(spark_id)
 
 def base64_id_to_UUID(spark_id):
-    return base64_id_to_str(spark_id).split('/')[-1] 
+    return spark_ids.to_uuid(spark_id)
 
 def str_to_time(s):
-    ''' converts a date/time string as used commonly in the Spark APIs to a datetime object
+    ''' converts a date/time string as used commonly in the Spark APIs to a datetime object. See spark_time
     '''
-    return datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
+    return spark_time.parse(s)
 
 def time_to_str(t):
     ''' converts a datetime object to a time string commonly used in the Spark APIs
@@ -48,25 +69,45 @@ class APIError(Exception):
     def __str__(self):
         return self.__repr__()
 
+# Tracing of API calls by dumpArgs. With debug logging off the arguments aren't formatted, but each call still goes
+# through the wrapper (an additional call with argument packing). The level can't be checked once when the decorator is
+# applied as logging usually is configured after this module has been imported. If set to False (by setting
+# environment variable SPARK_API_TRACE=0 before this module is imported) then dumpArgs doesn't wrap the decorated
+# functions at all and calls have no overhead
+TRACE_CALLS = os.environ.get('SPARK_API_TRACE', '1') != '0'
+
 def dumpArgs(func):
     '''Decorator to print function call details - parameters names and effective values'''
+    if not TRACE_CALLS:
+        return func
+    
+    # everything needed to map arguments to parameter names is determined once
+    name = func.__name__
+    arg_names = func.__code__.co_varnames[:func.__code__.co_argcount]
+    defaults = func.__defaults__ or ()
+    defaults = dict(zip(arg_names[len(arg_names) - len(defaults):], defaults))
+    
+    def format_args(func_args, func_kwargs):
+        params = []
+        for i, arg_name in enumerate(arg_names):
+            if arg_name in func_kwargs:
+                value = func_kwargs[arg_name]
+            elif i < len(func_args):
+                value = func_args[i]
+            elif arg_name in defaults:
+                value = defaults[arg_name]
+            else:
+                continue
+            if arg_name != 'self':
+                params.append('%s = %r' % (arg_name, value))
+        if len(func_args) > len(arg_names):
+            params.append('args = %r' % (func_args[len(arg_names):], ))
+        return ', '.join(params)
+    
     @wraps(func)
     def wrapper(*func_args, **func_kwargs):
-        global log
         if log.isEnabledFor(logging.DEBUG): 
-            arg_names = func.__code__.co_varnames[:func.__code__.co_argcount]
-            args = func_args[:len(arg_names)]
-            defaults = func.__defaults__ or ()
-            args = args + defaults[len(defaults) - (func.__code__.co_argcount - len(args)):]
-            params = [list(z) for z in zip(arg_names, args) if z[0] != 'self']
-            args = func_args[len(arg_names):]
-            if args: params.append(('args', args))
-            if func_kwargs:
-                for p in params:
-                    if p[0] in func_kwargs: 
-                        p[1] = func_kwargs[p[0]]
-                #if func_kwargs: params.append(('kwargs', func_kwargs))
-            log.debug(func.__name__ + ' (' + ', '.join('%s = %r' % (p[0], p[1]) for p in params) + ')')
+            log.debug('%s (%s)', name, format_args(func_args, func_kwargs))
         return func(*func_args, **func_kwargs)
     return wrapper         
         
@@ -75,14 +116,23 @@ def _api_call(f):
     '''
      
     @wraps(f)
-    def wrapper (*args, **kwargs):    
-        r = f(*args, **kwargs)
+    def wrapper (*args, **kwargs):
+        spark = args[0]
+        if spark.tracer is None:
+            return result(spark, f(*args, **kwargs))
+        with spark.tracer.span(f.__name__):
+            return result(spark, f(*args, **kwargs))
+    
+    def result(spark, r):
         if r.status_code >= 200 and r.status_code <= 299:
             if r.text:
+                model = spark.models and spark_models.MODELS.get(spark.resource(r.url))
                 r = r.json()
                 # if result has 'items' then just return that
                 if isinstance(r, dict):
                     r = r.get('items', r)
+                if model:
+                    r = [model(i) for i in r] if isinstance(r, list) else model(r)
             else:
                 r = ''
             return r
@@ -91,74 +141,333 @@ def _api_call(f):
             info = r.json()
         except JSONDecodeError:
             info = '{}'
-        raise APIError(r.status_code, r.reason, info)
+        error = APIError(r.status_code, r.reason, info)
+        spark._fire('error', method = r.request.method, url = r.url, error = error)
+        raise error
     return wrapper
 
 
+class Pagination:
+    ''' Iterator over all items of a paginated list as returned by the list_* methods
+    
+    The cursor attribute is a JSON serializable position in the list: the URL (and parameters) of the current page
+    plus the number of items already consumed from that page. To resume an interrupted listing the saved cursor is
+    passed to the list_* method; the listing then continues with the 1st item not consumed before:
+    
+        messages = spark.list_messages(room_id)
+        for message in messages:
+            process(message)
+            save(messages.cursor)
+        ...
+        for message in spark.list_messages(room_id, cursor=load()):
+            ...
+    '''
+    def __init__(self, pages, endpoint, params, skip = 0):
+        '''
+        parameters:
+            pages:  iterator returning a (endpoint, params, items, next endpoint) tuple for each page
+            endpoint, params: endpoint and parameters to get the 1st page
+            skip:   number of items to skip on the 1st page
+        '''
+        self._pages = pages
+        self._endpoint = endpoint
+        self._params = params
+        self._next = None
+        self._items = iter(())
+        self._index = skip
+        self._skip = skip
+        # number of items of the current page. None if unknown (streamed pages)
+        self._length = None
+        self._exhausted = False
+        
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        while True:
+            for item in self._items:
+                self._index += 1
+                return item
+            # current page is exhausted
+            self._exhausted = True
+            try:
+                (self._endpoint, self._params, items, self._next) = next(self._pages)
+            except StopIteration:
+                self._endpoint = None
+                self._params = {}
+                self._index = 0
+                raise
+            self._exhausted = False
+            self._index = 0
+            self._length = len(items) if isinstance(items, list) else None
+            self._items = iter(items)
+            if self._skip:
+                # resuming: skip the items consumed before
+                self._index = len(list(itertools.islice(self._items, self._skip)))
+                self._skip = 0
+                
+    @property
+    def cursor(self):
+        ''' position of the iterator: a dictionary with the endpoint and parameters of the current page and the number
+        of items already consumed from that page. The endpoint is None if the listing is complete
+        If all items of the current page have been consumed then the cursor points to the next page. For streamed
+        pages this is only known after the next item has been requested
+        '''
+        consumed = self._exhausted or (self._length is not None and self._index >= self._length)
+        if consumed and self._next:
+            # no need to get the current page again if all items have been consumed
+            return {'endpoint' : self._next, 'params' : {}, 'index' : 0}
+        return {'endpoint' : self._endpoint, 'params' : self._params, 'index' : self._index}
+    
+    def close(self):
+        ''' stop iterating. Stops prefetching pages in the background
+        '''
+        self._pages.close()
+
 def _pagination_iterator(f):
     ''' Decorator/wrapper for iterators
+    All list_* methods return a Pagination iterator and accept additional parameters:
+        prefetch: If prefetch is set (or if it's not set, but the SparkAPI instance has been created with prefetch > 0) 
+                then up to that many pages are requested by a background thread while the consumer is still working on 
+                the current page.
+        cursor: Cursor of a Pagination iterator returned by a previous call. The listing continues at the position of 
+                the cursor
+        stream: If stream is set (or if it's not set, but the SparkAPI instance has been created with stream_pages=True)
+                then the items of each page are decoded incrementally while the page is read from the network. Memory
+                usage then doesn't depend on the page size
+    If the API instance has a cache which stores listed records then all items are cached. If the cache also stores
+    complete lists of the resource (disk_cache.DiskCache with list_ttls) then the list is answered from the cache;
+    lists read from the API are cached once the last page has been read. Cached lists are not streamed.
     '''
     
-    def pagination(spark, endpoint, params):
+    def stream_items(spark, r, resource, model):
+        ''' decode the items of a streamed page
+        '''
+        batch = []
+        try:
+            for item in json_stream.iter_items(dump_stream(r.iter_content(chunk_size=STREAM_CHUNK_SIZE))):
+                if resource:
+                    batch.append((item['id'], item))
+                    if len(batch) >= 100:
+                        spark.cache.put_many(resource, batch)
+                        batch = []
+                yield model(item) if model else item
+            if batch:
+                spark.cache.put_many(resource, batch)
+        finally:
+            r.close()
+    
+    def fetch(spark, endpoint, params, resource, model, stream, parent):
+        ''' get one page. Returns the endpoint, parameters and items of the page and the URL of the next page (or None)
+        '''
+        if spark.tracer is None:
+            return read_page(spark, endpoint, params, resource, model, stream)
+        # pages are read while the caller iterates (or by a prefetch thread): the span of the list_* call is the parent
+        with spark.tracer.span('page', parent = parent, endpoint = spark.endpoint_label(endpoint)):
+            return read_page(spark, endpoint, params, resource, model, stream)
+    
+    def read_page(spark, endpoint, params, resource, model, stream):
+        r = spark.get(endpoint, params=params, stream=stream)
+        if r.status_code != 200: 
+            try:
+                info = r.json()
+            except JSONDecodeError:
+                info = '{}'
+            error = APIError(r.status_code, r.reason, info)
+            spark._fire('error', method = 'GET', url = r.url, error = error)
+            raise error
+        spark._fire('page_fetched', url = r.url, response = r)
+        if stream:
+            items = stream_items(spark, r, resource, model)
+        else:
+            items = r.json()['items']
+            if resource:
+                spark.cache.put_many(resource, ((item['id'], item) for item in items))
+            if model:
+                items = [model(item) for item in items]
+        # let's see if we have a 'next' header
+        next_endpoint = r.links.get('next', None)
+        if next_endpoint:
+            next_endpoint = next_endpoint['url']
+            log.debug('Pagination next %s' % next_endpoint)
+        return endpoint, params, items, next_endpoint
+    
+    def store_list(spark, pages, resource, params):
+        ''' pass through the pages of a list. The complete list is cached when the last page is read
+        '''
+        items = []
+        for page in pages:
+            items.extend(page[2])
+            if not page[3]:
+                spark.cache.put_list(resource, params, items)
+            yield page
+        return
+    
+    def pages(spark, endpoint, params, resource, model, stream, parent):
         global log
         log.debug('Pagination get 1st: %s' % endpoint)
         while endpoint:
-            r = spark.get(endpoint, params=params)
+            page = fetch(spark, endpoint, params, resource, model, stream, parent)
+            yield page
             # params are only needed in the first call, for further calls the link headers have the parameters
+            endpoint = page[3]
             params = {}
-            if r.status_code != 200: 
+        return
+    
+    def prefetch_pages(spark, endpoint, params, resource, model, stream, parent, depth):
+        log.debug('Pagination get 1st: %s, prefetching up to %s page(s)' % (endpoint, depth))
+        queued = queue.Queue(maxsize=depth)
+        # a slot for each page fetched or queued but not yet taken by the consumer
+        slots = threading.Semaphore(depth)
+        stop = threading.Event()
+        
+        def acquire():
+            # wait for a free slot before fetching the next page
+            while not stop.is_set():
+                if slots.acquire(timeout=0.1):
+                    return True
+            return False
+            
+        def put(entry):
+            # don't block forever if the consumer has gone away
+            while not stop.is_set():
                 try:
-                    info = r.json()
-                except JSONDecodeError:
-                    info = '{}'
-                raise APIError(r.status_code, r.reason, info)
-            items = r.json()['items']
-            for item in items:
-                yield item
-            # let's see if we have a 'next' header
-            endpoint = r.links.get('next', None)
-            if not endpoint: break
-            endpoint = endpoint['url']
-            log.debug('Pagination get next %s' % endpoint)
+                    queued.put(entry, timeout=0.1)
+                except queue.Full:
+                    continue
+                return
+            
+        def producer(endpoint, params):
+            try:
+                while endpoint and acquire():
+                    page = fetch(spark, endpoint, params, resource, model, stream, parent)
+                    put((page, None))
+                    endpoint = page[3]
+                    params = {}
+            except Exception as e:
+                put((None, e))
+            else:
+                put(None)
+                
+        threading.Thread(target=producer, args=(endpoint, params), daemon=True).start()
+        try:
+            while True:
+                entry = queued.get()
+                if entry is None: break
+                page, error = entry
+                if error: raise error
+                slots.release()
+                yield page
+        finally:
+            # consumer is done (or has given up): tell the producer to stop
+            stop.set()
         return
     
     @wraps(f)
-    def wrapper(*args, **kwargs):
+    def wrapper(*args, prefetch = None, cursor = None, stream = None, **kwargs):
         (spark, endpoint, params) = f(*args, **kwargs)
-        return pagination(spark, endpoint, params)
+        resource = spark.resource(endpoint)
+        model = spark.models and spark_models.MODELS.get(resource)
+        list_resource = None
+        if not cursor and resource in getattr(spark.cache, 'list_ttls', ()):
+            list_resource = resource
+            try:
+                items = spark.cache.get_list(resource, params)
+            except KeyError:
+                pass
+            else:
+                if model:
+                    items = [model(item) for item in items]
+                return Pagination(iter([(endpoint, params, items, None)]), endpoint, params)
+        if spark.cache is None or not spark.cache.store_listed or resource not in _cached_resources:
+            resource = None
+        skip = 0
+        if cursor:
+            endpoint = cursor['endpoint']
+            params = cursor['params']
+            skip = cursor['index']
+        if prefetch is None: prefetch = spark.prefetch
+        if stream is None: stream = spark.stream_pages
+        if list_resource: stream = False
+        parent = spark.tracer and spark.tracer.current()
+        if prefetch:
+            page_iterator = prefetch_pages(spark, endpoint, params, resource, model, stream, parent, prefetch)
+        else:
+            page_iterator = pages(spark, endpoint, params, resource, model, stream, parent)
+        if list_resource:
+            page_iterator = store_list(spark, page_iterator, list_resource, params)
+        return Pagination(page_iterator, endpoint, params, skip)
     
     return wrapper
 
 def _method(f):
     ''' Decorator for get, post, put, delete methods
     Adds OAuth authentication and checks for code 429 (too many requests), 500 and 502
+    All requests are paced by the rate governor of the API instance. A 429 blocks all users of that governor for the
+    time given in the Retry-After header.
+    Latency, status codes, retries, sleeps and bytes transferred are recorded in the metrics of the API instance.
+    Hooks registered with add_hook() are called for each request, response, retry and error. If the API instance has a
+    tracer then each request is recorded as a span.
     '''
+    method = f.__name__.upper()
     
     @wraps(f)
     def wrapper(self, endpoint, auto_retry = False, **kwargs):
+        if self.tracer is None:
+            return send(self, endpoint, auto_retry, kwargs)
+        with self.tracer.span('{} {}'.format(method, self.endpoint_label(endpoint))) as span:
+            response = send(self, endpoint, auto_retry, kwargs)
+            span.attributes['status'] = response.status_code
+            return response
+    
+    def send(self, endpoint, auto_retry, kwargs):
         self.add_auth_to_headers(kwargs)
+        label = self.endpoint_label(endpoint)
+        stream = kwargs.get('stream', False)
         back_off = 1
         retries = 0
+        sleep_reason = 'rate_limit'
         while True:
+            waited = self.governor.acquire()
+            if waited:
+                self.metrics.sleep(sleep_reason, waited)
+            sleep_reason = 'rate_limit'
+            self._fire('before_request', method = method, url = endpoint, kwargs = kwargs)
+            start = time.perf_counter()
             try:
                 response = f(self, endpoint, **kwargs)
-            except requests.exceptions.ConnectionError:
+            except requests.exceptions.ConnectionError as e:
                 if retries < 5:
                     log.warning('Connection error encountered. Retry')
+                    self.metrics.retry(label, method, 'connection_error')
+                    self._fire('retry', method = method, url = endpoint, reason = 'connection_error', wait = 0)
                     retries = retries + 1
                     continue
                 else:
+                    self.metrics.error(label, method, 'connection_error')
+                    self._fire('error', method = method, url = endpoint, error = e)
                     raise
             retries = 0
+            
+            # the body of a streamed response is only read by the caller
+            latency = time.perf_counter() - start
+            received = int(response.headers.get('content-length', 0)) if stream else len(response.content)
+            self.metrics.request(label, method, response.status_code, latency,
+                                 sent = len(response.request.body or b''), received = received)
+            self._fire('after_response', method = method, url = endpoint, response = response, latency = latency)
                 
-            dump_response(response)
+            # the body of a streamed response can only be read once
+            dump_response(response, dump_body = not stream)
             if response.status_code == 429:
                 try:
-                    retry_after = min(int(response.headers['retry-after']), 1)
+                    retry_after = max(int(response.headers['retry-after']), 0)
                 except Exception:
                     retry_after = 1
                 log.warning ('429 encountered. Retry after {} seconds'.format(retry_after))
-                time.sleep(retry_after)
+                self.metrics.retry(label, method, '429')
+                self._fire('retry', method = method, url = endpoint, reason = '429', wait = retry_after)
+                self.governor.retry_after(retry_after)
+                sleep_reason = 'retry_after'
                 continue
             
             if (response.status_code in [500, 502]) and auto_retry and back_off < 600:
@@ -176,6 +485,9 @@ def _method(f):
                     break
                 # if message.get..
                 log.warning('\'{}\' encountered. Message {}. Retry, waiting for {} second(s)'.format(response.reason, message, back_off))
+                self.metrics.retry(label, method, str(response.status_code))
+                self.metrics.sleep('back_off', back_off)
+                self._fire('retry', method = method, url = endpoint, reason = str(response.status_code), wait = back_off)
                 time.sleep(back_off)
                 back_off = back_off * 2
                 continue
@@ -186,28 +498,329 @@ def _method(f):
         
     return wrapper
 
+class ResponseCache:
+    ''' in-memory cache for results of the get_*_details methods
+    
+    Entries expire after a per resource TTL. If the cache has more than max_size entries then the least recently used
+    entries are evicted. Cached results are shared by all callers and should be treated as read-only.
+    
+    To use the cache pass an instance to the SparkAPI constructor:
+        spark = SparkAPI(token, cache=ResponseCache(max_size=5000, ttls={'people' : 3600}))
+    '''
+    def __init__(self, max_size = 1000, ttl = 300, ttls = None, store_listed = False):
+        '''
+        parameters:
+            max_size: maximum number of cached results
+            ttl:    default time to live in seconds
+            ttls:   dictionary with TTLs for specific resources ('people', 'rooms', 'memberships', 'teams', 
+                    'team/memberships', 'webhooks')
+            store_listed: if True then all records read by list_* methods are cached as well
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.store_listed = store_listed
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # (resource, id) -> keys of all cached results for the resource (with different parameters)
+        self._keys = {}
+        self._lock = threading.Lock()
+        
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys[key[:2]]
+        keys.discard(key)
+        if not keys:
+            del self._keys[key[:2]]
+        
+    def get(self, resource, resource_id, params = ()):
+        ''' get a cached result. Raises KeyError if there is no valid cached result
+        '''
+        key = (resource, resource_id, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None: self._remove(key)
+                self.misses += 1
+                raise KeyError(key)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        
+    def put(self, resource, resource_id, value, params = ()):
+        self.put_many(resource, [(resource_id, value)], params)
+        
+    def put_many(self, resource, records, params = ()):
+        ''' cache multiple results of the same resource
+        records is an iterable of (id, value) tuples
+        '''
+        expires = time.monotonic() + self.ttls.get(resource, self.ttl)
+        with self._lock:
+            for resource_id, value in records:
+                key = (resource, resource_id, params)
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+                self._keys.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                
+    def invalidate(self, resource, resource_id):
+        ''' remove all cached results for a given resource
+        '''
+        with self._lock:
+            for key in self._keys.pop((resource, resource_id), ()):
+                del self._entries[key]
+            
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            
+    def stats(self):
+        with self._lock:
+            return {'size' : len(self._entries), 'hits' : self.hits, 'misses' : self.misses}
+        
+class SingleFlight:
+    ''' concurrent calls with the same key share a single execution
+    The 1st caller for a key executes the call, all callers arriving while the call is in flight wait for it and get
+    the same result (or exception). Results are shared and should be treated as read-only.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+        
+    def do(self, key, f, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                # [event, result, exception]
+                call = self._calls[key] = [threading.Event(), None, None]
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call[0].wait()
+            if call[2] is not None: raise call[2]
+            return call[1]
+        try:
+            call[1] = f(*args, **kwargs)
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1]
+    
+    def stats(self):
+        with self._lock:
+            return {'calls' : self.calls, 'shared' : self.shared, 'in_flight' : len(self._calls)}
+        
+def _resource_call(f):
+    ''' split a call to f in the id of the resource addressed by the call and a tuple of the remaining parameters
+    The 1st parameter after self is the id of the resource. Parameters which are not set are not part of the tuple
+    '''
+    signature = inspect.signature(f)
+    id_name = list(signature.parameters)[1]
+    def split(spark, *args, **kwargs):
+        arguments = signature.bind(spark, *args, **kwargs)
+        arguments.apply_defaults()
+        arguments = arguments.arguments
+        resource_id = arguments.pop(id_name)
+        return resource_id, tuple((k, v) for k, v in arguments.items() if k != 'self' and v is not None)
+    return split
+        
+# resources for which get_*_details results are cached
+_cached_resources = set()
+
+def _cached(resource):
+    ''' Decorator for get_*_details methods: if the API instance has a cache then results are taken from the cache
+    If the API instance coalesces requests then concurrent identical calls share a single request
+    '''
+    _cached_resources.add(resource)
+    
+    def decorator(f):
+        split = _resource_call(f)
+        
+        def call(self, resource_id, params, args, kwargs):
+            r = f(self, *args, **kwargs)
+            if self.cache is not None:
+                self.cache.put(resource, resource_id, r, params)
+            return r
+        
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            if self.cache is None and self.coalescer is None:
+                return f(self, *args, **kwargs)
+            resource_id, params = split(self, *args, **kwargs)
+            if self.cache is not None:
+                try:
+                    r = self.cache.get(resource, resource_id, params)
+                except KeyError:
+                    pass
+                else:
+                    # persistent caches return dictionaries
+                    if self.models and isinstance(r, dict):
+                        r = spark_models.MODELS[resource](r)
+                    return r
+            if self.coalescer is None:
+                return call(self, resource_id, params, args, kwargs)
+            return self.coalescer.do((resource, resource_id, params), call, self, resource_id, params, args, kwargs)
+        return wrapper
+    return decorator
+
+def _invalidates(resource):
+    ''' Decorator for update_* and delete_* methods: remove cached results for the updated/deleted resource
+    Directories of the resource are updated with the result of the call
+    '''
+    def decorator(f):
+        split = _resource_call(f)
+        
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            try:
+                r = f(self, *args, **kwargs)
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate(resource, split(self, *args, **kwargs)[0])
+            directory = self.directories.get(resource)
+            if directory is not None:
+                directory.changed(split(self, *args, **kwargs)[0], r)
+            return r
+        return wrapper
+    return decorator
+
+def _creates(resource):
+    ''' Decorator for create_* methods: the created resource is added to the directory of the resource (if any)
+    Cached lists of the resource are dropped
+    '''
+    def decorator(f):
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            try:
+                r = f(self, *args, **kwargs)
+            finally:
+                if resource in getattr(self.cache, 'list_ttls', ()):
+                    self.cache.invalidate_lists(resource)
+            directory = self.directories.get(resource)
+            if directory is not None and r:
+                directory.changed(r['id'], r)
+            return r
+        return wrapper
+    return decorator
+
+# result of a single call in a bulk operation: the item, the result of the call (None if the call failed) and the
+# exception raised by the call (None if the call succeeded)
+BulkResult = namedtuple('BulkResult', ['item', 'result', 'error'])
+
 class TrivialToken:
     def __init__(self, token):
         self.auth = token
+        redactor.add(token)
         
     def bearer_auth(self):
         return 'Bearer {}'.format(self.auth)
     
+class _PooledAdapter(requests.adapters.HTTPAdapter):
+    ''' HTTP adapter with TCP keep-alive on all pooled connections
+    '''
+    def __init__(self, keep_alive = True, **kwargs):
+        self.keep_alive = keep_alive
+        requests.adapters.HTTPAdapter.__init__(self, **kwargs)
+        
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keep_alive:
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        return requests.adapters.HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+    
 class SparkAPI:
-    def __init__(self, token):
+    ''' Access to the Spark APIs
+    
+    An instance can be shared by multiple threads: each thread uses its own requests.Session, but all sessions share
+    the same connection pool. Connections (and with them the TLS sessions) are kept open and reused by all threads.
+    To avoid connections being discarded and re-established the pool size should be at least the number of threads
+    using the instance concurrently.
+    '''
+    def __init__(self, token, prefetch = 0, governor = None, pool_connections = 10, pool_maxsize = 10, pool_block = False,
+                 keep_alive = True, cache = None, stream_pages = False, models = False, metrics = None, tracer = None,
+                 base_url = BASE_URL, adapter = None, coalesce = False):
         ''' 
         parameters:
             token:  OAuth token. Can be a string or an object. If an object is passed then the object has to have
                     a bearer_auth method returning a Bearer authentication header for the token
+            prefetch: default number of pages list_* iterators request in the background while the current page
+                    is consumed. 0 disables prefetching. Can be overridden per call: spark.list_messages(room_id, prefetch=2)
+            governor: rate_governor.RateGovernor pacing the requests of this instance. Defaults to the governor shared
+                    by all instances in the process
+            pool_connections: number of per host connection pools to keep
+            pool_maxsize: maximum number of connections kept open per host
+            pool_block: if True then never more than pool_maxsize connections per host are opened; threads wait for a
+                    free connection instead of opening an additional connection which is discarded after the request
+            keep_alive: if True connections are kept open (with TCP keep-alive) and reused. If False each request
+                    uses a new connection
+            cache:  optional ResponseCache (in memory) or disk_cache.DiskCache (persistent) for the results of the 
+                    get_*_details methods. Updates and deletes through this instance invalidate the cached results
+            stream_pages: default for incremental decoding of the pages read by list_* iterators. Can be overridden
+                    per call: spark.list_messages(room_id, p_max=1000, stream=True)
+            models: if True then resources are returned as spark_models.Model instances instead of dictionaries
+            metrics: spark_metrics.Metrics instance to record all requests in. If not given the instance gets its own
+                    metrics. Available as spark.metrics
+            tracer: optional spark_trace.Tracer. API calls, pages read by list_* iterators and HTTP requests are
+                    recorded as spans of the tracer
+            base_url: base URL of the API. Can point to a spark_standin.StandIn for offline tests
+            adapter: transport adapter used instead of the connection pool of the instance. For example a
+                    spark_cassette.RecordingAdapter or ReplayAdapter. The pool parameters and keep_alive are ignored
+            coalesce: if True then concurrent identical get_*_details calls (same id and parameters) from multiple
+                    threads share a single request and the parsed result. Statistics in spark.coalescer.stats()
         '''
         if isinstance(token, str):
             self.token = TrivialToken(token)
         else:
             self.token = token
-        self.session = requests.Session()
+        self.prefetch = prefetch
+        self.governor = governor or rate_governor.governor
+        self.keep_alive = keep_alive
+        self.cache = cache
+        self.stream_pages = stream_pages
+        self.models = models
+        self.metrics = metrics or spark_metrics.Metrics()
+        self.tracer = tracer
+        self.base_url = base_url.rstrip('/')
+        self.coalescer = SingleFlight() if coalesce else None
+        # index of all rooms used by find_room(). Built on first use
+        self.room_directory = spark_directory.RoomDirectory(self)
+        # e-mail addresses resolved by resolve_people()
+        self.people_directory = spark_directory.PeopleDirectory(self)
+        self.directories = {'rooms' : self.room_directory, 'people' : self.people_directory}
+        self.hooks = {event : [] for event in spark_trace.EVENTS}
+        self._adapter = adapter or _PooledAdapter(keep_alive = keep_alive, pool_connections = pool_connections, 
+                                                  pool_maxsize = pool_maxsize, pool_block = pool_block)
+        self._local = threading.local()
+        self._token_lock = threading.Lock()
+        
+    @property
+    def session(self):
+        ''' requests.Session of the current thread
+        '''
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+        return session
         
     def bearer_auth(self):
-        return self.token.bearer_auth()
+        # a token refresh should only be triggered once even if multiple threads need a token at the same time
+        with self._token_lock:
+            return self.token.bearer_auth()
         
     def add_auth_to_headers(self, kwargs):
         headers = kwargs.get('headers', {})
@@ -215,12 +828,49 @@ class SparkAPI:
         kwargs['headers'] = headers
         return kwargs['headers']
     
+    def add_hook(self, event, callback):
+        ''' register a callback for an event (see spark_trace.EVENTS). The callback is called with keyword arguments
+        '''
+        if event not in self.hooks:
+            raise ValueError('Unknown event: {}'.format(event))
+        self.hooks[event].append(callback)
+        
+    def remove_hook(self, event, callback):
+        self.hooks[event].remove(callback)
+        
+    def _fire(self, event, **kwargs):
+        for callback in self.hooks[event]:
+            try:
+                callback(**kwargs)
+            except Exception:
+                # a failing hook should never break an API call
+                log.exception('Hook {} for {} failed'.format(callback, event))
+    
     def endpoint(self, api = None, para = None):
-        ep = 'https://api.ciscospark.com/v1'
+        ep = self.base_url
         if api: ep += '/' + api
         if para: ep += '/' + para
         return ep
     
+    def resource(self, url):
+        ''' API resource addressed by an URL: 'rooms', 'team/memberships', ... (None for URLs outside the API)
+        '''
+        base = self.endpoint() + '/'
+        if not url.startswith(base): return None
+        path = url[len(base):].split('?')[0]
+        if path.startswith('team/'):
+            return '/'.join(path.split('/')[:2])
+        return path.split('/')[0]
+    
+    def endpoint_label(self, url):
+        ''' URL with ids replaced by a placeholder: 'rooms', 'rooms/{id}', 'team/memberships/{id}', ...
+        '''
+        resource = self.resource(url)
+        if resource is None: return 'other'
+        path = url[len(self.endpoint()) + 1:].split('?')[0].rstrip('/')
+        if path == resource: return resource
+        return resource + '/{id}'
+    
     ############################ basic HTTP methods
     @_method
     def get(self, endpoint, **kwargs):
@@ -250,6 +900,7 @@ class SparkAPI:
         endpoint = self.endpoint('people')
         return (self, endpoint, params)
     
+    @_cached('people')
     @_api_call
     @dumpArgs
     def get_person_details(self, personId):
@@ -258,17 +909,25 @@ class SparkAPI:
         '''
         endpoint = self.endpoint('people', personId)
         return self.get(endpoint)
+    
+    def resolve_people(self, emails, max_workers = None):
+        ''' map e-mail addresses to people. Answered from the people directory of the instance
+        returns a dictionary mapping each address to the person (None if no person has that address)
+        '''
+        return self.people_directory.resolve_people(emails, max_workers)
         
     ############################# rooms
             
     @_pagination_iterator
     @dumpArgs
-    def list_rooms(self, p_showSipAddress = None, p_teamId = None, p_max = None, p_type = None):
+    def list_rooms(self, p_showSipAddress = None, p_teamId = None, p_max = None, p_type = None, p_sortBy = None):
         assert p_type == None or (isinstance(p_type, str) and p_type in ['direct', 'group']), "type needs to be 'direct' or 'group'"
+        assert p_sortBy == None or p_sortBy in ['id', 'lastactivity', 'created'], "sortBy needs to be 'id', 'lastactivity' or 'created'"
         params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v}
         endpoint = self.endpoint('rooms')
         return (self, endpoint, params)
             
+    @_creates('rooms')
     @_api_call
     @dumpArgs
     def create_room(self, p_title, p_teamId = None):
@@ -276,6 +935,7 @@ class SparkAPI:
         endpoint = self.endpoint('rooms')
         return self.post(endpoint, json = params)
         
+    @_cached('rooms')
     @_api_call
     @dumpArgs
     def get_room_details(self, roomId, p_showSipAddress = None):
@@ -283,6 +943,7 @@ class SparkAPI:
         endpoint = self.endpoint('rooms', roomId)
         return self.get(endpoint, params=params)
     
+    @_invalidates('rooms')
     @_api_call
     @dumpArgs
     def update_room(self, roomId, p_title = None):
@@ -290,6 +951,7 @@ class SparkAPI:
         endpoint = self.endpoint('rooms', roomId)
         return self.put(endpoint, json=params)
     
+    @_invalidates('rooms')
     @_api_call
     @dumpArgs
     def delete_room(self, roomId):
@@ -298,10 +960,9 @@ class SparkAPI:
     
     @dumpArgs
     def find_room(self, title):
-        for r in self.list_rooms():
-            if r['title'] == title:
-                return r
-        return None
+        ''' room with the given title. Answered from the room directory of the instance
+        '''
+        return self.room_directory.find(title)
         
     ############################# memberships
     
@@ -312,6 +973,7 @@ class SparkAPI:
         endpoint = self.endpoint('memberships')
         return (self, endpoint, params)
     
+    @_creates('memberships')
     @_api_call
     @dumpArgs
     def create_membership(self, p_roomId, p_personId = None, p_personEmail = None, p_isModerator = None):
@@ -319,12 +981,14 @@ class SparkAPI:
         endpoint = self.endpoint('memberships')
         return self.post(endpoint, json=params)
     
+    @_cached('memberships')
     @_api_call
     @dumpArgs
     def get_membership_details(self, membership_id):
         endpoint = self.endpoint('memberships', membership_id)
         return self.get(endpoint)
     
+    @_invalidates('memberships')
     @_api_call
     @dumpArgs
     def update_membership(self, membership_id, p_isModerator):
@@ -332,6 +996,7 @@ class SparkAPI:
         endpoint = self.endpoint('memberships', membership_id)
         return self.put(endpoint, json=params)
     
+    @_invalidates('memberships')
     @_api_call
     @dumpArgs
     def delete_membership(self, membership_id):
@@ -376,6 +1041,7 @@ class SparkAPI:
         endpoint = self.endpoint('teams')
         return (self, endpoint, params)
     
+    @_creates('teams')
     @_api_call
     @dumpArgs
     def create_team(self, p_name = None):
@@ -383,12 +1049,14 @@ class SparkAPI:
         endpoint = self.endpoint('teams')
         return self.post(endpoint, json=params)
     
+    @_cached('teams')
     @_api_call
     @dumpArgs
     def get_team_details(self, team_id):
         endpoint = self.endpoint('teams', team_id)
         return self.get(endpoint)
     
+    @_invalidates('teams')
     @_api_call
     @dumpArgs
     def update_team(self, team_id, p_name):
@@ -396,6 +1064,7 @@ class SparkAPI:
         endpoint = self.endpoint('teams', team_id)
         return self.put(endpoint, json=params)
     
+    @_invalidates('teams')
     @_api_call
     @dumpArgs
     def delete_team(self, team_id):
@@ -411,6 +1080,7 @@ class SparkAPI:
         endpoint = self.endpoint('team/memberships')
         return (self, endpoint, params)
     
+    @_creates('team/memberships')
     @_api_call
     @dumpArgs
     def create_team_membership(self, p_teamId, p_personId = None, p_personEmail = None, p_isModerator = None):
@@ -418,12 +1088,14 @@ class SparkAPI:
         endpoint = self.endpoint('team/memberships')
         return self.post(endpoint, json=params)
     
+    @_cached('team/memberships')
     @_api_call
     @dumpArgs
     def get_team_membership_details(self, membership_id):
         endpoint = self.endpoint('team/memberships', membership_id)
         return self.get(endpoint)
     
+    @_invalidates('team/memberships')
     @_api_call
     @dumpArgs
     def update_team_membership(self, membership_id, p_isModerator):
@@ -431,6 +1103,7 @@ class SparkAPI:
         endpoint = self.endpoint('team/memberships', membership_id)
         return self.put(endpoint, json=params)
     
+    @_invalidates('team/memberships')
     @_api_call
     @dumpArgs
     def delete_team_membership(self, membership_id):
@@ -447,6 +1120,7 @@ class SparkAPI:
         endpoint = self.endpoint('webhooks')
         return (self, endpoint, params)
     
+    @_creates('webhooks')
     @_api_call
     @dumpArgs
     def create_webhook(self, p_name, p_targetUrl=None, p_resource=None, p_event=None, p_filter=None):
@@ -454,12 +1128,14 @@ class SparkAPI:
         endpoint = self.endpoint('webhooks')
         return self.post(endpoint, json=params)
     
+    @_cached('webhooks')
     @_api_call
     @dumpArgs
     def get_webhook_details(self, webhook_id):
         endpoint = self.endpoint('webhooks', webhook_id)
         return self.get(endpoint)
     
+    @_invalidates('webhooks')
     @_api_call
     @dumpArgs
     def update_webhook(self, webhook_id, p_name=None, p_targetUrl=None):
@@ -467,8 +1143,51 @@ class SparkAPI:
         endpoint = self.endpoint('webhooks', webhook_id)
         return self.put(endpoint, json=params)
     
+    @_invalidates('webhooks')
     @_api_call
     @dumpArgs
     def delete_webhook(self, webhook_id):
         endpoint = self.endpoint('webhooks', webhook_id)
-        return self.delete(endpoint)
\ No newline at end of file
+        return self.delete(endpoint)
+    
+    ############################# bulk operations
+    
+    def _bulk(self, method, items, max_workers):
+        ''' call method for each item; up to max_workers calls are executed concurrently
+        items are either dictionaries with keyword arguments for method or single values passed as 1st argument
+        returns a list of BulkResult (in the order of items). Failed calls don't stop the remaining calls; the
+        exception is reported in the error attribute of the result instead
+        '''
+        def call(item):
+            try:
+                if isinstance(item, dict):
+                    result = method(**item)
+                else:
+                    result = method(item)
+            except Exception as e:
+                log.debug('Bulk {} failed for {}: {}'.format(method.__name__, item, e))
+                return BulkResult(item, None, e)
+            return BulkResult(item, result, None)
+        
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            return list(executor.map(call, items))
+    
+    def bulk_create_memberships(self, memberships, max_workers = 8):
+        ''' create multiple memberships
+        memberships is an iterable of dictionaries with the parameters for create_membership, for example
+        {'p_roomId' : room_id, 'p_personEmail' : email}
+        '''
+        return self._bulk(self.create_membership, memberships, max_workers)
+    
+    def bulk_delete_memberships(self, membership_ids, max_workers = 8):
+        return self._bulk(self.delete_membership, membership_ids, max_workers)
+    
+    def bulk_create_team_memberships(self, team_memberships, max_workers = 8):
+        ''' create multiple team memberships
+        team_memberships is an iterable of dictionaries with the parameters for create_team_membership, for example
+        {'p_teamId' : team_id, 'p_personEmail' : email}
+        '''
+        return self._bulk(self.create_team_membership, team_memberships, max_workers)
+    
+    def bulk_delete_team_memberships(self, membership_ids, max_workers = 8):
+        return self._bulk(self.delete_team_membership, membership_ids, max_workers)
@@ -0,0 +1,504 @@
+'''
+asyncio variant of the simplified Spark APIs
+
+AsyncSparkAPI offers the same methods as spark_api.SparkAPI, but all API calls are coroutines and all list_*
+methods return async generators. This allows to have many API calls in flight from a single process:
+
+    async with AsyncSparkAPI(token) as spark:
+        rooms = [r async for r in spark.list_rooms()]
+        details = await asyncio.gather(*(spark.get_room_details(r['id']) for r in rooms))
+
+Requires aiohttp.
+'''
+import aiohttp
+import asyncio
+from json.decoder import JSONDecodeError
+from functools import wraps
+import logging
+
+from spark_api import APIError, TrivialToken, dumpArgs, BASE_URL
+import rate_governor
+
+log = logging.getLogger(__name__)
+
+def _params_to_str(params):
+    ''' aiohttp only accepts str, int and float query parameters. Booleans are passed as 'true' and 'false'
+    '''
+    return {k:(str(v).lower() if isinstance(v, bool) else v) for k,v in params.items()}
+
+async def _response_info(r):
+    ''' try to get some description (JSON) from a failed request
+    '''
+    try:
+        return await r.json(content_type=None)
+    except (JSONDecodeError, ValueError):
+        return '{}'
+
+def _api_call(f):
+    '''Decorator/wrapper for all API calls
+    '''
+
+    @wraps(f)
+    async def wrapper (*args, **kwargs):
+        r = await f(*args, **kwargs)
+        if r.status >= 200 and r.status <= 299:
+            if await r.text():
+                r = await r.json(content_type=None)
+                # if result has 'items' then just return that
+                if isinstance(r, dict):
+                    r = r.get('items', r)
+            else:
+                r = ''
+            return r
+        raise APIError(r.status, r.reason, await _response_info(r))
+    return wrapper
+
+class AsyncSingleFlight:
+    ''' concurrent coroutines calling with the same key share a single execution
+    asyncio variant of spark_api.SingleFlight. Waiting callers are shielded: if a waiting caller is cancelled the
+    shared call still completes for the others
+    '''
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, f, *args, **kwargs):
+        future = self._calls.get(key)
+        if future is None:
+            self.calls += 1
+            future = self._calls[key] = asyncio.ensure_future(f(*args, **kwargs))
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {'calls' : self.calls, 'shared' : self.shared, 'in_flight' : len(self._calls)}
+
+def _coalesced(f):
+    ''' Decorator for get_*_details methods: if the API instance coalesces requests then concurrent identical calls
+    share a single request
+    '''
+
+    @wraps(f)
+    async def wrapper(self, *args, **kwargs):
+        if self.coalescer is None:
+            return await f(self, *args, **kwargs)
+        key = (f.__name__, args, tuple(sorted(kwargs.items())))
+        return await self.coalescer.do(key, f, self, *args, **kwargs)
+    return wrapper
+
+def _pagination_iterator(f):
+    ''' Decorator/wrapper for async generators
+    '''
+
+    async def pagination(spark, endpoint, params):
+        log.debug('Pagination get 1st: %s' % endpoint)
+        while endpoint:
+            r = await spark.get(endpoint, params=params)
+            # params are only needed in the first call, for further calls the link headers have the parameters
+            params = {}
+            if r.status != 200:
+                raise APIError(r.status, r.reason, await _response_info(r))
+            items = (await r.json(content_type=None))['items']
+            for item in items:
+                yield item
+            # let's see if we have a 'next' header
+            endpoint = r.links.get('next', None)
+            if not endpoint: break
+            endpoint = str(endpoint['url'])
+            log.debug('Pagination get next %s' % endpoint)
+        return
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        (spark, endpoint, params) = f(*args, **kwargs)
+        return pagination(spark, endpoint, params)
+
+    return wrapper
+
+def _method(f):
+    ''' Decorator for get, post, put, delete methods
+    Adds OAuth authentication and checks for code 429 (too many requests), 500 and 502.
+    Same retry logic and rate governor as spark_api._method. Unless stream=True is passed the response body is read
+    before the response is returned. The response then is released and can still be accessed using text() or json().
+    '''
+
+    @wraps(f)
+    async def wrapper(self, endpoint, auto_retry = False, stream = False, **kwargs):
+        self.add_auth_to_headers(kwargs)
+        if 'params' in kwargs:
+            kwargs['params'] = _params_to_str(kwargs['params'])
+        back_off = 1
+        retries = 0
+        while True:
+            wait = self.governor.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                response = await f(self, endpoint, **kwargs)
+                if not stream:
+                    await response.read()
+                    response.release()
+            except aiohttp.ClientConnectionError:
+                if retries < 5:
+                    log.warning('Connection error encountered. Retry')
+                    retries = retries + 1
+                    continue
+                else:
+                    raise
+            retries = 0
+
+            log.debug('{} {}: {} {}'.format(f.__name__.upper(), response.url, response.status, response.reason))
+            if response.status == 429:
+                try:
+                    retry_after = max(int(response.headers['retry-after']), 0)
+                except Exception:
+                    retry_after = 1
+                log.warning ('429 encountered. Retry after {} seconds'.format(retry_after))
+                response.release()
+                self.governor.retry_after(retry_after)
+                continue
+
+            if (response.status in [500, 502]) and auto_retry and back_off < 600:
+                # if we get a 500 b/c a message can not be decrypted then a retry will not help
+                try:
+                    message = await response.json(content_type=None)
+                except (JSONDecodeError, ValueError):
+                    message = {}
+                if not isinstance(message, dict): message = {}
+                if message.get('message', '') in ['Unable to parse encrypted message',
+                                                  'Unable to decrypt content name.',
+                                                  'Unable to decrypt message',
+                                                  'DefaultActivityEncryptionKeyUrl not found.']:
+                    # retry does not help
+                    break
+                # if message.get..
+                log.warning('\'{}\' encountered. Message {}. Retry, waiting for {} second(s)'.format(response.reason, message, back_off))
+                response.release()
+                await asyncio.sleep(back_off)
+                back_off = back_off * 2
+                continue
+            # if (response.status ...
+            break
+        # while True:
+        return response
+
+    return wrapper
+
+class AsyncSparkAPI:
+    def __init__(self, token, limit = 100, governor = None, base_url = BASE_URL, coalesce = False):
+        '''
+        parameters:
+            token:  OAuth token. Can be a string or an object. If an object is passed then the object has to have
+                    a bearer_auth method returning a Bearer authentication header for the token
+            limit:  maximum number of concurrent connections
+            governor: rate_governor.RateGovernor pacing the requests of this instance. Defaults to the governor shared
+                    by all instances in the process
+            base_url: base URL of the API. Can point to a spark_standin.StandIn for offline tests
+            coalesce: if True then concurrent identical get_*_details calls share a single request and the parsed
+                    result. Statistics in spark.coalescer.stats()
+        The aiohttp session is created on first use so that the instance can be created outside of a running event loop
+        '''
+        if isinstance(token, str):
+            self.token = TrivialToken(token)
+        else:
+            self.token = token
+        self.limit = limit
+        self.governor = governor or rate_governor.governor
+        self.base_url = base_url.rstrip('/')
+        self.coalescer = AsyncSingleFlight() if coalesce else None
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def bearer_auth(self):
+        return self.token.bearer_auth()
+
+    def add_auth_to_headers(self, kwargs):
+        headers = kwargs.get('headers', {})
+        headers['Authorization'] = self.bearer_auth()
+        kwargs['headers'] = headers
+        return kwargs['headers']
+
+    def endpoint(self, api = None, para = None):
+        ep = self.base_url
+        if api: ep += '/' + api
+        if para: ep += '/' + para
+        return ep
+
+    ############################ basic HTTP methods
+    @_method
+    async def get(self, endpoint, **kwargs):
+        return await self.session.get(endpoint, **kwargs)
+
+    @_method
+    async def head(self, endpoint, **kwargs):
+        return await self.session.head(endpoint, **kwargs)
+
+    @_method
+    async def post(self, endpoint, **kwargs):
+        return await self.session.post(endpoint, **kwargs)
+
+    @_method
+    async def put(self, endpoint, **kwargs):
+        return await self.session.put(endpoint, **kwargs)
+
+    @_method
+    async def delete(self, endpoint, **kwargs):
+        return await self.session.delete(endpoint, **kwargs)
+
+    ############################# people
+    @_pagination_iterator
+    @dumpArgs
+    def list_people(self, p_email=None, p_displayName=None, p_max=None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v}
+        endpoint = self.endpoint('people')
+        return (self, endpoint, params)
+
+    @_coalesced
+    @_api_call
+    @dumpArgs
+    async def get_person_details(self, personId):
+        ''' Get person details
+        personId can be 'me'
+        '''
+        endpoint = self.endpoint('people', personId)
+        return await self.get(endpoint)
+
+    ############################# rooms
+
+    @_pagination_iterator
+    @dumpArgs
+    def list_rooms(self, p_showSipAddress = None, p_teamId = None, p_max = None, p_type = None, p_sortBy = None):
+        assert p_type == None or (isinstance(p_type, str) and p_type in ['direct', 'group']), "type needs to be 'direct' or 'group'"
+        assert p_sortBy == None or p_sortBy in ['id', 'lastactivity', 'created'], "sortBy needs to be 'id', 'lastactivity' or 'created'"
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v}
+        endpoint = self.endpoint('rooms')
+        return (self, endpoint, params)
+
+    @_api_call
+    @dumpArgs
+    async def create_room(self, p_title, p_teamId = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v}
+        endpoint = self.endpoint('rooms')
+        return await self.post(endpoint, json = params)
+
+    @_coalesced
+    @_api_call
+    @dumpArgs
+    async def get_room_details(self, roomId, p_showSipAddress = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v}
+        endpoint = self.endpoint('rooms', roomId)
+        return await self.get(endpoint, params=params)
+
+    @_api_call
+    @dumpArgs
+    async def update_room(self, roomId, p_title = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v}
+        endpoint = self.endpoint('rooms', roomId)
+        return await self.put(endpoint, json=params)
+
+    @_api_call
+    @dumpArgs
+    async def delete_room(self, roomId):
+        endpoint = self.endpoint('rooms', roomId)
+        return await self.delete(endpoint)
+
+    @dumpArgs
+    async def find_room(self, title):
+        async for r in self.list_rooms():
+            if r['title'] == title:
+                return r
+        return None
+
+    ############################# memberships
+
+    @_pagination_iterator
+    @dumpArgs
+    def list_memberships(self, p_roomId = None, p_personId = None, p_personEmail = None, p_max = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('memberships')
+        return (self, endpoint, params)
+
+    @_api_call
+    @dumpArgs
+    async def create_membership(self, p_roomId, p_personId = None, p_personEmail = None, p_isModerator = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('memberships')
+        return await self.post(endpoint, json=params)
+
+    @_coalesced
+    @_api_call
+    @dumpArgs
+    async def get_membership_details(self, membership_id):
+        endpoint = self.endpoint('memberships', membership_id)
+        return await self.get(endpoint)
+
+    @_api_call
+    @dumpArgs
+    async def update_membership(self, membership_id, p_isModerator):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('memberships', membership_id)
+        return await self.put(endpoint, json=params)
+
+    @_api_call
+    @dumpArgs
+    async def delete_membership(self, membership_id):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('memberships', membership_id)
+        return await self.delete(endpoint, json=params)
+
+    ############################# messages
+
+    @_pagination_iterator
+    @dumpArgs
+    def list_messages(self, p_roomId, p_before=None, p_beforeMessage=None, p_max=None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('messages')
+        return (self, endpoint, params)
+
+    @_api_call
+    @dumpArgs
+    async def create_message(self, p_roomId, p_text=None, p_files=None, p_file=None, p_toPersonId=None, p_toPersonEmail=None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('messages')
+        return await self.post(endpoint, json=params)
+
+    @_coalesced
+    @_api_call
+    @dumpArgs
+    async def get_message_details(self, message_id):
+        endpoint = self.endpoint('messages', message_id)
+        return await self.get(endpoint)
+
+    @_api_call
+    @dumpArgs
+    async def delete_message(self, message_id):
+        endpoint = self.endpoint('messages', message_id)
+        return await self.delete(endpoint)
+
+    ############################# teams
+
+    @_pagination_iterator
+    @dumpArgs
+    def list_teams(self, p_max = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('teams')
+        return (self, endpoint, params)
+
+    @_api_call
+    @dumpArgs
+    async def create_team(self, p_name = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('teams')
+        return await self.post(endpoint, json=params)
+
+    @_coalesced
+    @_api_call
+    @dumpArgs
+    async def get_team_details(self, team_id):
+        endpoint = self.endpoint('teams', team_id)
+        return await self.get(endpoint)
+
+    @_api_call
+    @dumpArgs
+    async def update_team(self, team_id, p_name):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('teams', team_id)
+        return await self.put(endpoint, json=params)
+
+    @_api_call
+    @dumpArgs
+    async def delete_team(self, team_id):
+        endpoint = self.endpoint('teams', team_id)
+        return await self.delete(endpoint)
+
+    ############################# team memberships
+
+    @_pagination_iterator
+    @dumpArgs
+    def list_team_memberships(self, p_teamId = None, p_max = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('team/memberships')
+        return (self, endpoint, params)
+
+    @_api_call
+    @dumpArgs
+    async def create_team_membership(self, p_teamId, p_personId = None, p_personEmail = None, p_isModerator = None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('team/memberships')
+        return await self.post(endpoint, json=params)
+
+    @_coalesced
+    @_api_call
+    @dumpArgs
+    async def get_team_membership_details(self, membership_id):
+        endpoint = self.endpoint('team/memberships', membership_id)
+        return await self.get(endpoint)
+
+    @_api_call
+    @dumpArgs
+    async def update_team_membership(self, membership_id, p_isModerator):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('team/memberships', membership_id)
+        return await self.put(endpoint, json=params)
+
+    @_api_call
+    @dumpArgs
+    async def delete_team_membership(self, membership_id):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('team/memberships', membership_id)
+        return await self.delete(endpoint, json=params)
+
+    ############################# webhooks
+
+    @_pagination_iterator
+    @dumpArgs
+    def list_webhooks(self, p_max=None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('webhooks')
+        return (self, endpoint, params)
+
+    @_api_call
+    @dumpArgs
+    async def create_webhook(self, p_name, p_targetUrl=None, p_resource=None, p_event=None, p_filter=None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('webhooks')
+        return await self.post(endpoint, json=params)
+
+    @_coalesced
+    @_api_call
+    @dumpArgs
+    async def get_webhook_details(self, webhook_id):
+        endpoint = self.endpoint('webhooks', webhook_id)
+        return await self.get(endpoint)
+
+    @_api_call
+    @dumpArgs
+    async def update_webhook(self, webhook_id, p_name=None, p_targetUrl=None):
+        params = {k[2:]:v for k,v in locals().items() if k[:2] == 'p_' and v != None}
+        endpoint = self.endpoint('webhooks', webhook_id)
+        return await self.put(endpoint, json=params)
+
+    @_api_call
+    @dumpArgs
+    async def delete_webhook(self, webhook_id):
+        endpoint = self.endpoint('webhooks', webhook_id)
+        return await self.delete(endpoint)
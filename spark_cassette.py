@@ -0,0 +1,266 @@
+'''
+Record and replay HTTP exchanges
+
+A Cassette holds HTTP exchanges (method, URL, request body hash, status, response headers and body, offset and latency)
+in a gzip compressed JSON
+lines file. RecordingAdapter records all exchanges of a requests session while talking to the real service,
+ReplayAdapter answers the requests from a cassette w/o any network access. Both are requests transport adapters and
+can be passed to SparkAPI and to the identity brokers:
+
+    with Cassette('run.jsonl.gz', 'w') as cassette:
+        spark = SparkAPI(token, adapter=RecordingAdapter(cassette))
+        ...
+
+    cassette = Cassette('run.jsonl.gz')
+    spark = SparkAPI(token, adapter=ReplayAdapter(cassette, speed=1))
+
+Requests are matched by method, URL and a hash of the request body: two POSTs to the same endpoint with different
+JSON bodies get their own responses. The boundary of multipart bodies is not part of the hash. Repeated identical
+requests are answered in the order they were recorded. Cassettes recorded w/o body hashes are matched by method and URL.
+
+For each exchange the offset of the request (seconds since the first request of the recording) and the latency of the
+response are recorded. Replay either runs at full speed (speed=None) or reproduces the recorded pacing: a request is
+not answered before its recorded offset (relative to the first replayed request) and then only after the recorded
+latency (speed=1; speed=2 for half the offsets and latencies).
+
+Non-JSON bodies larger than max_body (attachments) can be left out of the cassette to keep it compact: only their size
+is recorded and replay returns the same number of zero bytes. JSON bodies (API responses) are always recorded
+completely as the API class has to decode them on replay. While recording, response bodies are read into a spooled
+temporary file: bodies larger than spool_size are written to disk as they stream instead of being held in memory.
+
+Request headers (and with them the Authorization header) are never recorded. Response bodies are recorded as they are:
+a cassette of an identity broker flow contains tokens.
+'''
+import requests.adapters
+from urllib3 import HTTPResponse
+from collections import defaultdict, deque
+import threading
+import tempfile
+import hashlib
+import base64
+import gzip
+import json
+import time
+import io
+import logging
+
+log = logging.getLogger(__name__)
+
+# response headers not recorded: the body is stored decoded and complete
+_SKIP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive')
+
+# size of the chunks read from the network when recording
+CHUNK_SIZE = 65536
+
+# response bodies larger than this are spooled to disk while recording
+SPOOL_SIZE = 1024 * 1024
+
+class CassetteError(Exception): pass
+
+def _is_json(headers):
+    content_type = next((v for k, v in headers.items() if k.lower() == 'content-type'), '')
+    return 'json' in content_type.lower()
+
+def body_hash(request):
+    ''' hash of the body of a prepared request used to match requests on replay
+    None if the request has no body or if the body is streamed (file or generator)
+    '''
+    body = request.body
+    if not body: return None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if not isinstance(body, bytes): return None
+    # the boundary of multipart bodies is random
+    content_type = request.headers.get('Content-Type', '')
+    if content_type.startswith('multipart/') and 'boundary=' in content_type:
+        boundary = content_type.split('boundary=', 1)[1].split(';')[0].strip('"')
+        body = body.replace(boundary.encode(), b'')
+    return hashlib.sha1(body).hexdigest()
+
+class Cassette:
+    def __init__(self, file_name, mode = 'r', max_body = None):
+        '''
+        parameters:
+            file_name: name of the cassette file
+            mode:   'r' to read an existing cassette, 'w' to record a new cassette
+            max_body: when recording only the size of larger non-JSON bodies is recorded
+        '''
+        self.file_name = file_name
+        self.mode = mode
+        self.max_body = max_body
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = defaultdict(deque)
+        self._start = None
+        self.recorded = 0
+        if mode == 'w':
+            self._file = gzip.open(file_name, 'wt', encoding = 'utf-8', compresslevel = 5)
+        else:
+            with gzip.open(file_name, 'rt', encoding = 'utf-8') as f:
+                for line in f:
+                    exchange = json.loads(line)
+                    key = (exchange['method'], exchange['url'], exchange.get('body_hash'))
+                    self._pending[key].append(exchange)
+
+    def offset(self):
+        ''' seconds since the first request of the recording
+        '''
+        now = time.perf_counter()
+        with self._lock:
+            if self._start is None:
+                self._start = now
+            return now - self._start
+
+    def record(self, method, url, status, reason, headers, body, latency, offset = None, body_hash = None):
+        ''' record an exchange
+        parameters:
+            body:   response body. Either bytes or a binary file positioned at the start of the body
+            offset: offset of the request (see offset())
+            body_hash: hash of the request body (see body_hash())
+        '''
+        exchange = {'method' : method, 'url' : url, 'body_hash' : body_hash, 'status' : status, 'reason' : reason,
+                    'headers' : {k : v for k, v in headers.items() if k.lower() not in _SKIP_HEADERS},
+                    'offset' : offset, 'latency' : latency}
+        if isinstance(body, bytes):
+            size = len(body)
+        else:
+            start = body.tell()
+            size = body.seek(0, io.SEEK_END) - start
+            body.seek(start)
+        if self.max_body is not None and size > self.max_body and not _is_json(headers):
+            exchange['body_size'] = size
+        else:
+            if not isinstance(body, bytes):
+                body = body.read()
+            try:
+                exchange['body'] = body.decode('utf-8')
+            except UnicodeDecodeError:
+                exchange['body_b64'] = base64.b64encode(body).decode()
+        line = json.dumps(exchange) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self.recorded += 1
+
+    def next(self, method, url, body_hash = None):
+        ''' next recorded exchange for a request
+        '''
+        with self._lock:
+            pending = self._pending.get((method, url, body_hash))
+            if not pending and body_hash is not None:
+                # cassette recorded w/o body hashes
+                pending = self._pending.get((method, url, None))
+            if not pending:
+                raise CassetteError('No recorded exchange for {} {}'.format(method, url))
+            exchange = pending.popleft()
+        if 'body' in exchange:
+            body = exchange['body'].encode('utf-8')
+        elif 'body_b64' in exchange:
+            body = base64.b64decode(exchange['body_b64'])
+        elif _is_json(exchange['headers']):
+            raise CassetteError('Body of {} {} not recorded (size only). JSON bodies can\'t be replayed w/o the '
+                                'body'.format(method, url))
+        else:
+            body = bytes(exchange['body_size'])
+        return exchange, body
+
+    def remaining(self):
+        ''' number of recorded exchanges not replayed yet
+        '''
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class RecordingAdapter(requests.adapters.HTTPAdapter):
+    ''' transport adapter recording all exchanges in a cassette
+    Response bodies are read completely before the response is returned. Streamed responses can still be read using
+    iter_content() or raw
+    '''
+    def __init__(self, cassette, spool_size = SPOOL_SIZE, **kwargs):
+        '''
+        parameters:
+            cassette: Cassette to record to
+            spool_size: response bodies larger than this are written to a temporary file on disk while they are read
+        '''
+        super().__init__(**kwargs)
+        self.cassette = cassette
+        self.spool_size = spool_size
+
+    def send(self, request, **kwargs):
+        offset = self.cassette.offset()
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        body = tempfile.SpooledTemporaryFile(max_size = self.spool_size)
+        try:
+            for chunk in response.raw.stream(CHUNK_SIZE, decode_content = True):
+                body.write(chunk)
+            # for chunk ..
+            latency = time.perf_counter() - start
+            body.seek(0)
+            self.cassette.record(request.method, request.url, response.status_code, response.reason,
+                                 response.headers, body, latency, offset = offset, body_hash = body_hash(request))
+        except Exception:
+            body.close()
+            raise
+        finally:
+            response.raw.release_conn()
+        size = body.seek(0, io.SEEK_END)
+        body.seek(0)
+        # the body has been consumed (and decoded): replace the raw stream so that it can be read again
+        headers = {k : v for k, v in response.headers.items()
+                   if k.lower() not in ('content-encoding', 'content-length')}
+        headers['Content-Length'] = str(size)
+        response.raw = HTTPResponse(body = body, headers = headers, status = response.status_code,
+                                    reason = response.reason, preload_content = False, decode_content = False)
+        return response
+
+class ReplayAdapter(requests.adapters.HTTPAdapter):
+    ''' transport adapter answering all requests from a cassette
+    '''
+    def __init__(self, cassette, speed = None, **kwargs):
+        '''
+        parameters:
+            cassette: Cassette to replay
+            speed:  None: full speed. Otherwise the recorded offsets and latencies divided by speed are reproduced
+        '''
+        super().__init__(**kwargs)
+        self.cassette = cassette
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._start = None
+
+    def pace(self, exchange):
+        ''' wait for the recorded offset and latency of an exchange
+        '''
+        offset = exchange.get('offset')
+        if offset is not None:
+            now = time.perf_counter()
+            with self._lock:
+                if self._start is None:
+                    # the first replayed request defines the start of the replay
+                    self._start = now - offset / self.speed
+                wait = self._start + offset / self.speed - now
+            if wait > 0:
+                time.sleep(wait)
+        time.sleep(exchange['latency'] / self.speed)
+
+    def send(self, request, **kwargs):
+        exchange, body = self.cassette.next(request.method, request.url, body_hash(request))
+        if self.speed:
+            self.pace(exchange)
+        headers = dict(exchange['headers'])
+        headers['Content-Length'] = str(len(body))
+        raw = HTTPResponse(body = io.BytesIO(body), headers = headers, status = exchange['status'],
+                           reason = exchange['reason'], preload_content = False, decode_content = False,
+                           request_method = request.method)
+        return self.build_response(request, raw)
@@ -0,0 +1,377 @@
+'''
+In-memory directories of Spark resources
+
+Looking up a room by title with the API means paging through all rooms. RoomDirectory reads all rooms once and keeps
+them indexed by title, normalized title, team and type. Later lookups are answered from the index. The index is kept
+up to date incrementally: rooms are listed sorted by last activity and only the rooms active since the last refresh are
+read (usually a single page):
+
+    directory = RoomDirectory(spark)
+    room = directory.find('Project X')
+    rooms = directory.find_all(teamId=team['id'], type='group')
+
+SparkAPI.find_room() uses the directory of the API instance (spark.room_directory).
+
+Rooms deleted by other clients can't be detected incrementally: they are only removed by the periodic full refresh.
+Rooms created, deleted or renamed through the API instance owning the directory are updated in the index right away.
+
+PeopleDirectory maps e-mail addresses to people. resolve_people() looks up many addresses at once: duplicates are
+looked up once, the lookups run concurrently (paced by the rate governor of the API instance) and the results are
+cached for ttl seconds. People seen are also indexed by id and display name:
+
+    people = spark.resolve_people(['alice@example.com', 'bob@example.com'])
+    person = spark.people_directory.get(people['alice@example.com']['id'])
+'''
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import unicodedata
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+def normalize_title(title):
+    ''' normalized title for case and whitespace insensitive lookups
+    '''
+    return ' '.join(unicodedata.normalize('NFKC', title or '').casefold().split())
+
+class RoomDirectory:
+    # attributes of a room which are indexed
+    _INDEXED = ('title', 'normalized', 'teamId', 'type')
+
+    def __init__(self, spark, max_age = 300, min_age = 5, full_refresh = 3600):
+        '''
+        parameters:
+            spark:  SparkAPI instance used to list the rooms
+            max_age: lookups trigger an incremental refresh if the last refresh is older than max_age seconds
+            min_age: lookups not finding a room trigger an incremental refresh if the last refresh is older than
+                    min_age seconds
+            full_refresh: all rooms are read again after full_refresh seconds. This removes rooms deleted by other
+                    clients
+        Nothing is read before the first lookup or refresh()
+        '''
+        self.spark = spark
+        self.max_age = max_age
+        self.min_age = min_age
+        self.full_refresh = full_refresh
+        self._lock = threading.Lock()
+        # only one refresh at a time. Lookups don't wait for a refresh in progress (they are answered from the current
+        # index) unless the index has never been built
+        self._refresh_lock = threading.Lock()
+        self._rooms = {}
+        self._index = {attribute : defaultdict(set) for attribute in self._INDEXED}
+        # changes reported while a refresh reads the rooms (room id -> room or None). Applied again after the rooms read
+        # by the refresh as these might predate the changes
+        self._pending = None
+        # lastActivity of the most recently active room listed so far. Only moved forward by refresh()
+        self._watermark = ''
+        self._built = None
+        self._refreshed = None
+        self.refreshes = 0
+        self.full_refreshes = 0
+
+    ############################ index maintenance
+    def _keys(self, room):
+        return {'title' : room.get('title'),
+                'normalized' : normalize_title(room.get('title')),
+                'teamId' : room.get('teamId'),
+                'type' : room.get('type')}
+
+    def _add(self, room):
+        self._discard(room['id'])
+        self._rooms[room['id']] = room
+        for attribute, key in self._keys(room).items():
+            self._index[attribute][key].add(room['id'])
+
+    def _discard(self, room_id):
+        room = self._rooms.pop(room_id, None)
+        if room is None: return
+        for attribute, key in self._keys(room).items():
+            ids = self._index[attribute][key]
+            ids.discard(room_id)
+            if not ids:
+                del self._index[attribute][key]
+
+    def _age(self):
+        with self._lock:
+            return None if self._refreshed is None else time.monotonic() - self._refreshed
+
+    def refresh(self, full = False, max_age = None, wait = True):
+        ''' update the index. Incremental unless full is set or the last full refresh is older than full_refresh
+        If max_age is set then the index is only refreshed if the last refresh is older than max_age seconds.
+        If wait is not set and another refresh is in progress then nothing is done (unless the index has never been
+        built)
+        '''
+        if not self._refresh_lock.acquire(blocking = wait):
+            with self._lock:
+                built = self._built is not None
+            if built: return
+            self._refresh_lock.acquire()
+        try:
+            age = self._age()
+            if max_age is not None and age is not None and age <= max_age: return
+            now = time.monotonic()
+            with self._lock:
+                full = full or self._built is None or now - self._built > self.full_refresh
+                watermark = self._watermark
+                self._pending = {}
+            if full:
+                rooms = list(self.spark.list_rooms())
+            else:
+                rooms = []
+                for room in self.spark.list_rooms(p_sortBy = 'lastactivity'):
+                    # newest first: all remaining rooms have been seen before
+                    if (room.get('lastActivity') or '') < watermark: break
+                    rooms.append(room)
+                # for room ..
+            with self._lock:
+                if full:
+                    self._rooms = {}
+                    self._index = {attribute : defaultdict(set) for attribute in self._INDEXED}
+                    watermark = ''
+                    self._built = now
+                    self.full_refreshes += 1
+                else:
+                    self.refreshes += 1
+                for room in rooms:
+                    self._add(room)
+                    watermark = max(watermark, room.get('lastActivity') or '')
+                for room_id, room in self._pending.items():
+                    if room:
+                        self._add(room)
+                    else:
+                        self._discard(room_id)
+                self._watermark = watermark
+                self._refreshed = now
+            log.debug('{} refresh: {} rooms read'.format('full' if full else 'incremental', len(rooms)))
+        finally:
+            with self._lock:
+                self._pending = None
+            self._refresh_lock.release()
+
+    def changed(self, room_id, room = None):
+        ''' a room has been updated (room set) or deleted (room not set)
+        The watermark is not moved: rooms active before the updated room still have to be read by the next refresh
+        '''
+        with self._lock:
+            if room:
+                self._add(room)
+            else:
+                self._discard(room_id)
+            if self._pending is not None:
+                self._pending[room_id] = room
+
+    ############################ lookups
+    def _lookup(self, **keys):
+        with self._lock:
+            ids = None
+            for attribute, key in keys.items():
+                matches = self._index[attribute].get(key, ())
+                ids = set(matches) if ids is None else ids & matches
+                if not ids: return []
+            rooms = [self._rooms[room_id] for room_id in (self._rooms if ids is None else ids)]
+        # most recently active first
+        rooms.sort(key = lambda r: r.get('lastActivity') or '', reverse = True)
+        return rooms
+
+    def find_all(self, title = None, normalized_title = None, teamId = None, type = None):
+        ''' all rooms matching all given criteria, most recently active first
+        '''
+        keys = {}
+        if title is not None: keys['title'] = title
+        if normalized_title is not None: keys['normalized'] = normalize_title(normalized_title)
+        if teamId is not None: keys['teamId'] = teamId
+        if type is not None: keys['type'] = type
+        self.refresh(max_age = self.max_age, wait = False)
+        rooms = self._lookup(**keys)
+        if not rooms and keys:
+            # a miss forces a refresh unless the index has just been refreshed
+            self.refresh(max_age = self.min_age, wait = False)
+            rooms = self._lookup(**keys)
+        return rooms
+
+    def find(self, title, normalized = False):
+        ''' the most recently active room with the given title (or None). If normalized is set then case and
+        whitespace are ignored
+        '''
+        rooms = self.find_all(normalized_title = title) if normalized else self.find_all(title = title)
+        return rooms[0] if rooms else None
+
+    def get(self, room_id):
+        with self._lock:
+            return self._rooms.get(room_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rooms)
+
+    def stats(self):
+        with self._lock:
+            return {'rooms' : len(self._rooms), 'refreshes' : self.refreshes, 'full_refreshes' : self.full_refreshes,
+                    'last_activity' : self._watermark}
+
+class PeopleDirectory:
+    def __init__(self, spark, ttl = 3600, negative_ttl = 300, max_workers = 8):
+        '''
+        parameters:
+            spark:  SparkAPI instance used for the lookups
+            ttl:    seconds a person found is cached
+            negative_ttl: seconds an address w/o a matching person is cached
+            max_workers: default number of concurrent lookups
+        '''
+        self.spark = spark
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        # normalized e-mail address -> (expiry, person or None)
+        self._by_email = {}
+        # id -> (expiry, person)
+        self._by_id = {}
+        self._by_name = defaultdict(set)
+        self.lookups = 0
+        self.hits = 0
+
+    ############################ index maintenance
+    @staticmethod
+    def _key(email):
+        return email.strip().lower()
+
+    def _add(self, person, expiry):
+        old = self._by_id.get(person['id'])
+        if old is not None:
+            self._discard_name(old[1])
+        self._by_id[person['id']] = (expiry, person)
+        self._by_name[person.get('displayName')].add(person['id'])
+        for email in person.get('emails') or ():
+            self._by_email[self._key(email)] = (expiry, person)
+
+    def _discard_name(self, person):
+        ids = self._by_name.get(person.get('displayName'))
+        if ids is not None:
+            ids.discard(person['id'])
+            if not ids:
+                del self._by_name[person.get('displayName')]
+
+    def add(self, person):
+        ''' add a person obtained otherwise (for example from list_people)
+        '''
+        with self._lock:
+            self._add(person, time.monotonic() + self.ttl)
+
+    def changed(self, person_id, person = None):
+        ''' a person has been updated (person set) or deleted (person not set)
+        '''
+        with self._lock:
+            entry = self._by_id.pop(person_id, None)
+            if entry is not None:
+                self._discard_name(entry[1])
+                for email in entry[1].get('emails') or ():
+                    self._by_email.pop(self._key(email), None)
+            if person:
+                self._add(person, time.monotonic() + self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._by_email.clear()
+            self._by_id.clear()
+            self._by_name.clear()
+
+    ############################ lookups
+    def _lookup(self, email):
+        ''' person with the given e-mail address from the API (or None)
+        '''
+        for person in self.spark.list_people(p_email = email):
+            return person
+        return None
+
+    def _cached(self, key, now):
+        ''' (True, person or None) for a valid cache entry, (False, None) otherwise
+        '''
+        entry = self._by_email.get(key)
+        if entry is None or entry[0] < now:
+            return False, None
+        return True, entry[1]
+
+    def resolve_people(self, emails, max_workers = None):
+        ''' resolve multiple e-mail addresses
+        returns a dictionary mapping each address to the person with that address (None if no person has that
+        address). Addresses are case insensitive and each distinct address is looked up at most once.
+        Failed lookups are logged and not cached; their addresses are missing from the result
+        '''
+        now = time.monotonic()
+        result = {}
+        missing = {}
+        with self._lock:
+            for email in emails:
+                if email in result: continue
+                key = self._key(email)
+                found, person = self._cached(key, now)
+                if found:
+                    self.hits += 1
+                    result[email] = person
+                else:
+                    missing.setdefault(key, []).append(email)
+        if missing:
+            keys = list(missing)
+
+            def lookup(key):
+                try:
+                    return self._lookup(key), None
+                except Exception as e:
+                    return None, e
+
+            workers = min(max_workers or self.max_workers, len(keys))
+            with ThreadPoolExecutor(max_workers = workers) as executor:
+                lookups = list(executor.map(lookup, keys))
+            now = time.monotonic()
+            with self._lock:
+                self.lookups += len(keys)
+                for key, (person, error) in zip(keys, lookups):
+                    if error is not None:
+                        log.warning('Failed to resolve {}: {}'.format(key, error))
+                        continue
+                    if person is None:
+                        self._by_email[key] = (now + self.negative_ttl, None)
+                    else:
+                        self._add(person, now + self.ttl)
+                        # the address might not be the primary address of the person
+                        self._by_email[key] = (now + self.ttl, person)
+                    for email in missing[key]:
+                        result[email] = person
+        return result
+
+    def resolve(self, email):
+        ''' person with the given e-mail address (or None)
+        '''
+        return self.resolve_people([email]).get(email)
+
+    def get(self, person_id):
+        ''' person with the given id. People not seen before are read using get_person_details()
+        '''
+        with self._lock:
+            entry = self._by_id.get(person_id)
+            if entry is not None and entry[0] >= time.monotonic():
+                self.hits += 1
+                return entry[1]
+        person = self.spark.get_person_details(person_id)
+        self.add(person)
+        return person
+
+    def find_by_name(self, display_name):
+        ''' all people seen so far with the given display name
+        '''
+        with self._lock:
+            now = time.monotonic()
+            return [entry[1] for entry in (self._by_id[i] for i in self._by_name.get(display_name, ()))
+                    if entry[0] >= now]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
+
+    def stats(self):
+        with self._lock:
+            return {'people' : len(self._by_id), 'addresses' : len(self._by_email), 'lookups' : self.lookups,
+                    'hits' : self.hits}
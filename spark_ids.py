@@ -0,0 +1,136 @@
+'''
+Encoding and decoding of Spark IDs
+
+Spark IDs are the base64 encoding (w/o padding) of an URI like ciscospark://us/ROOM/<uuid>:
+
+    spark_ids.decode(room_id)           # 'ciscospark://us/ROOM/9a3f..'
+    spark_ids.parse(room_id)            # SparkId(cluster='us', type='ROOM', uuid='9a3f..')
+    spark_ids.resource(room_id)         # 'rooms'
+    spark_ids.encode(uid, 'rooms')      # room_id
+
+Some IDs show up over and over again (every message has the ID of its room and of its author), others only once
+(message IDs). The plain functions don't cache anything. cached_decode() and cached_parse() keep the results in a LRU
+cache and only pay off for IDs which are decoded repeatedly.
+
+decode_many() and parse_many() decode lists of IDs (for example the roomId of all messages of a page). Each distinct
+ID is decoded once and all IDs w/o padding are decoded with a single base64 decode of the joined IDs.
+'''
+from collections import namedtuple
+from functools import lru_cache
+import binascii
+import base64
+
+# type names used in Spark IDs
+ID_TYPES = {'people' : 'PEOPLE',
+            'rooms' : 'ROOM',
+            'memberships' : 'MEMBERSHIP',
+            'messages' : 'MESSAGE',
+            'teams' : 'TEAM',
+            'team/memberships' : 'TEAM_MEMBERSHIP',
+            'webhooks' : 'WEBHOOK',
+            'contents' : 'CONTENT',
+            'organizations' : 'ORGANIZATION'}
+RESOURCES = {v : k for k, v in ID_TYPES.items()}
+
+PREFIX = 'ciscospark://'
+
+# number of decoded IDs cached
+CACHE_SIZE = 65536
+
+SparkId = namedtuple('SparkId', ['cluster', 'type', 'uuid'])
+
+def decode(spark_id):
+    ''' decoded Spark ID: ciscospark://<cluster>/<type>/<uuid>
+    '''
+    try:
+        return base64.b64decode(spark_id + '=' * (-len(spark_id) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('Invalid Spark ID: {}'.format(spark_id))
+
+cached_decode = lru_cache(maxsize = CACHE_SIZE)(decode)
+
+def _parse(decoded):
+    try:
+        cluster, type, uid = decoded.rsplit('/', 2)
+    except ValueError:
+        raise ValueError('Invalid Spark ID: {}'.format(decoded))
+    if cluster.startswith(PREFIX):
+        cluster = cluster[len(PREFIX):]
+    # tuple.__new__ avoids the argument handling of the namedtuple constructor
+    return tuple.__new__(SparkId, (cluster, type, uid))
+
+def parse(spark_id):
+    ''' cluster, type and UUID of a Spark ID as SparkId
+    '''
+    return _parse(decode(spark_id))
+
+cached_parse = lru_cache(maxsize = CACHE_SIZE)(parse)
+
+def to_uuid(spark_id):
+    ''' UUID (str) of a Spark ID
+    '''
+    return decode(spark_id).rpartition('/')[2]
+
+def resource_type(spark_id):
+    ''' type of a Spark ID: 'ROOM', 'PEOPLE', ..
+    '''
+    return parse(spark_id).type
+
+def resource(spark_id):
+    ''' resource of a Spark ID as used in the API endpoints: 'rooms', 'people', .. (None for unknown types)
+    '''
+    return RESOURCES.get(parse(spark_id).type)
+
+def encode(uid, type, cluster = 'us'):
+    ''' Spark ID for an UUID (uuid.UUID or str) and a type. The type can be given as type ('ROOM') or as
+    resource ('rooms')
+    '''
+    type = ID_TYPES.get(type, type)
+    s = '{}{}/{}/{}'.format(PREFIX, cluster, type, uid)
+    return base64.b64encode(s.encode()).decode().rstrip('=')
+
+def decode_many(spark_ids):
+    ''' decode a list of Spark IDs. Returns the decoded IDs in the same order
+    '''
+    spark_ids = list(spark_ids)
+    decoded = {}
+    # IDs w/o padding (length a multiple of 4) can be joined and decoded at once
+    batch = []
+    for spark_id in dict.fromkeys(spark_ids):
+        if len(spark_id) % 4 or spark_id.endswith('='):
+            decoded[spark_id] = decode(spark_id)
+        else:
+            batch.append(spark_id)
+    if batch:
+        try:
+            # validate: characters silently dropped would shift all following IDs
+            data = base64.b64decode(''.join(batch), validate = True)
+        except binascii.Error:
+            data = None
+        offset = 0
+        for spark_id in batch:
+            length = len(spark_id) // 4 * 3
+            if data is None:
+                decoded[spark_id] = decode(spark_id)
+            else:
+                try:
+                    decoded[spark_id] = data[offset:offset + length].decode()
+                except UnicodeDecodeError:
+                    raise ValueError('Invalid Spark ID: {}'.format(spark_id))
+            offset += length
+    return [decoded[spark_id] for spark_id in spark_ids]
+
+def parse_many(spark_ids):
+    ''' parse a list of Spark IDs. Returns a SparkId for each ID
+    '''
+    spark_ids = list(spark_ids)
+    unique = list(dict.fromkeys(spark_ids))
+    parsed = {spark_id : _parse(d) for spark_id, d in zip(unique, decode_many(unique))}
+    return [parsed[spark_id] for spark_id in spark_ids]
+
+def cache_info():
+    return {'decode' : cached_decode.cache_info(), 'parse' : cached_parse.cache_info()}
+
+def clear_cache():
+    cached_decode.cache_clear()
+    cached_parse.cache_clear()
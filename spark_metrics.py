@@ -0,0 +1,149 @@
+'''
+Metrics for Spark API calls
+
+Each SparkAPI instance records all HTTP requests in a Metrics instance (spark.metrics):
+    * latency histogram per endpoint and HTTP method
+    * responses per endpoint, method and status code
+    * retries per endpoint, method and reason (connection error, 429, 500, 502)
+    * number and total time of sleeps per reason (rate limit, Retry-After of a 429, back off after 5xx)
+    * bytes sent and received per endpoint and method
+
+snapshot() returns all values as a dictionary, to_prometheus() as text in the Prometheus exposition format.
+'''
+import threading
+from collections import defaultdict
+import bisect
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        ''' (upper bound, cumulative count) for all buckets including +Inf
+        '''
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'), ), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        ''' estimate of quantile q: upper bound of the bucket containing the quantile
+        '''
+        if not self.count: return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in labels.items()) + '}'
+
+def _bound(b):
+    return '+Inf' if b == float('inf') else repr(float(b))
+
+class Metrics:
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latency = {}
+            self.responses = defaultdict(int)
+            self.retries = defaultdict(int)
+            self.errors = defaultdict(int)
+            self.sleeps = defaultdict(int)
+            self.sleep_time = defaultdict(float)
+            self.bytes_sent = defaultdict(int)
+            self.bytes_received = defaultdict(int)
+
+    ############################ recording
+    def request(self, endpoint, method, status, latency, sent = 0, received = 0):
+        key = (endpoint, method)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(self.buckets)
+            histogram.observe(latency)
+            self.responses[(endpoint, method, status)] += 1
+            self.bytes_sent[key] += sent
+            self.bytes_received[key] += received
+
+    def retry(self, endpoint, method, reason):
+        with self._lock:
+            self.retries[(endpoint, method, reason)] += 1
+
+    def error(self, endpoint, method, reason):
+        with self._lock:
+            self.errors[(endpoint, method, reason)] += 1
+
+    def sleep(self, reason, seconds):
+        with self._lock:
+            self.sleeps[reason] += 1
+            self.sleep_time[reason] += seconds
+
+    ############################ queries
+    def snapshot(self):
+        ''' all metrics as a dictionary
+        '''
+        with self._lock:
+            return {'latency' : {'{} {}'.format(m, e) : {'count' : h.count,
+                                                         'sum' : h.sum,
+                                                         'p50' : h.quantile(0.5),
+                                                         'p90' : h.quantile(0.9),
+                                                         'p99' : h.quantile(0.99)} for (e, m), h in self.latency.items()},
+                    'responses' : {'{} {} {}'.format(m, e, s) : c for (e, m, s), c in self.responses.items()},
+                    'retries' : {'{} {} {}'.format(m, e, r) : c for (e, m, r), c in self.retries.items()},
+                    'errors' : {'{} {} {}'.format(m, e, r) : c for (e, m, r), c in self.errors.items()},
+                    'sleeps' : dict(self.sleeps),
+                    'sleep_time' : dict(self.sleep_time),
+                    'bytes_sent' : sum(self.bytes_sent.values()),
+                    'bytes_received' : sum(self.bytes_received.values())}
+
+    def to_prometheus(self, prefix = 'spark_api'):
+        ''' all metrics as text in the Prometheus exposition format
+        '''
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{}_{}{}{} {}'.format(prefix, name, suffix, _labels(**labels), value))
+
+        with self._lock:
+            samples = []
+            for (endpoint, method), h in sorted(self.latency.items()):
+                for bound, total in h.cumulative():
+                    samples.append(('_bucket', dict(endpoint=endpoint, method=method, le=_bound(bound)), total))
+                samples.append(('_sum', dict(endpoint=endpoint, method=method), h.sum))
+                samples.append(('_count', dict(endpoint=endpoint, method=method), h.count))
+            metric('request_duration_seconds', 'histogram', 'Latency of HTTP requests', samples)
+            metric('responses_total', 'counter', 'HTTP responses by status code',
+                   [('', dict(endpoint=e, method=m, status=s), c) for (e, m, s), c in sorted(self.responses.items())])
+            metric('retries_total', 'counter', 'Retried HTTP requests by reason',
+                   [('', dict(endpoint=e, method=m, reason=r), c) for (e, m, r), c in sorted(self.retries.items())])
+            metric('errors_total', 'counter', 'HTTP requests failed w/o response',
+                   [('', dict(endpoint=e, method=m, reason=r), c) for (e, m, r), c in sorted(self.errors.items())])
+            metric('sleeps_total', 'counter', 'Sleeps before sending requests by reason',
+                   [('', dict(reason=r), c) for r, c in sorted(self.sleeps.items())])
+            metric('sleep_seconds_total', 'counter', 'Time slept before sending requests by reason',
+                   [('', dict(reason=r), c) for r, c in sorted(self.sleep_time.items())])
+            metric('request_bytes_total', 'counter', 'Bytes sent in request bodies',
+                   [('', dict(endpoint=e, method=m), c) for (e, m), c in sorted(self.bytes_sent.items())])
+            metric('response_bytes_total', 'counter', 'Bytes received in response bodies',
+                   [('', dict(endpoint=e, method=m), c) for (e, m), c in sorted(self.bytes_received.items())])
+        return '\n'.join(lines) + '\n'
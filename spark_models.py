@@ -0,0 +1,190 @@
+'''
+Compact models for Spark API resources
+
+The API returns all resources as dictionaries. Holding many of them in memory (for example the full message history of
+a room) is expensive as each dictionary has its own hash table. The model classes defined here store the documented
+attributes of a resource in __slots__. Attributes not known to the model are kept in a separate dictionary which only
+exists if needed.
+
+Models can be used like the dictionaries returned by the API:
+    message['created'], message.get('files'), 'files' in message, message.items()
+and like objects:
+    message.created
+Values of attributes referencing other resources (roomId, personId, ..) are interned: all messages of a room share a
+single roomId string. Timestamps are kept as strings. The datetime for a timestamp attribute is only created on first access using the
+attribute name with a '_time' suffix: message.created_time
+
+SparkAPI(token, models=True) returns models instead of dictionaries.
+'''
+from sys import intern
+
+import spark_time
+
+class Model:
+    __slots__ = ('_extra', '_parsed')
+    # attributes stored in slots
+    _fields = ()
+    # attributes holding a timestamp
+    _timestamps = ()
+    # attributes with values shared by many instances
+    _interned = ()
+    _field_set = frozenset()
+
+    def __init__(self, d = {}):
+        self._extra = None
+        self._parsed = None
+        fields = self._field_set
+        interned = self._interned
+        for k, v in d.items():
+            if k in fields:
+                if k in interned and type(v) is str: v = intern(v)
+                setattr(self, k, v)
+            else:
+                if self._extra is None: self._extra = {}
+                self._extra[k] = v
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls._fields)
+
+    def __getattr__(self, name):
+        # only called if an attribute is not found: unset slots, unknown attributes and parsed timestamps
+        if name[0] == '_':
+            raise AttributeError(name)
+        if name.endswith('_time') and name[:-5] in self._timestamps:
+            if self._parsed is None: self._parsed = {}
+            t = self._parsed.get(name)
+            if t is None:
+                try:
+                    value = self[name[:-5]]
+                except KeyError:
+                    # hasattr(), getattr(.., default), copy and pickle rely on AttributeError
+                    raise AttributeError(name)
+                if value is None: return None
+                t = self._parsed[name] = spark_time.parse(value)
+            return t
+        if self._extra and name in self._extra:
+            return self._extra[name]
+        raise AttributeError(name)
+
+    ############################ dictionary interface
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None: raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            if self._extra is None: self._extra = {}
+            self._extra[key] = value
+        if self._parsed:
+            self._parsed.pop(key + '_time', None)
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def keys(self):
+        for k in self._fields:
+            try:
+                getattr(self, k)
+            except AttributeError:
+                continue
+            yield k
+        if self._extra:
+            yield from self._extra
+
+    __iter__ = keys
+
+    def values(self):
+        return (self[k] for k in self.keys())
+
+    def items(self):
+        return ((k, self[k]) for k in self.keys())
+
+    def __len__(self):
+        return sum(1 for _ in self.keys())
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Model):
+            return self.__class__ == other.__class__ and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.to_dict())
+
+class Person(Model):
+    _fields = ('id', 'emails', 'displayName', 'nickName', 'firstName', 'lastName', 'avatar', 'orgId', 'roles',
+               'licenses', 'created', 'timezone', 'lastActivity', 'status', 'type')
+    _timestamps = ('created', 'lastActivity')
+    _interned = ('orgId', 'type', 'status', 'timezone')
+    __slots__ = _fields
+
+class Room(Model):
+    _fields = ('id', 'title', 'type', 'isLocked', 'teamId', 'lastActivity', 'created', 'creatorId', 'sipAddress')
+    _timestamps = ('created', 'lastActivity')
+    _interned = ('type', 'teamId', 'creatorId')
+    __slots__ = _fields
+
+class Membership(Model):
+    _fields = ('id', 'roomId', 'personId', 'personEmail', 'personDisplayName', 'personOrgId', 'isModerator',
+               'isMonitor', 'created')
+    _timestamps = ('created', )
+    _interned = ('roomId', 'personId', 'personEmail', 'personOrgId')
+    __slots__ = _fields
+
+class Message(Model):
+    _fields = ('id', 'roomId', 'roomType', 'toPersonId', 'toPersonEmail', 'text', 'markdown', 'html', 'files',
+               'personId', 'personEmail', 'mentionedPeople', 'created')
+    _timestamps = ('created', )
+    _interned = ('roomId', 'roomType', 'toPersonId', 'toPersonEmail', 'personId', 'personEmail')
+    __slots__ = _fields
+
+class Team(Model):
+    _fields = ('id', 'name', 'created', 'creatorId')
+    _timestamps = ('created', )
+    _interned = ('creatorId', )
+    __slots__ = _fields
+
+class TeamMembership(Model):
+    _fields = ('id', 'teamId', 'personId', 'personEmail', 'personDisplayName', 'personOrgId', 'isModerator', 'created')
+    _timestamps = ('created', )
+    _interned = ('teamId', 'personId', 'personEmail', 'personOrgId')
+    __slots__ = _fields
+
+class Webhook(Model):
+    _fields = ('id', 'name', 'targetUrl', 'resource', 'event', 'filter', 'secret', 'status', 'created')
+    _timestamps = ('created', )
+    _interned = ('resource', 'event', 'status')
+    __slots__ = _fields
+
+# model classes for the API resources (as used in the API endpoint URLs)
+MODELS = {'people' : Person,
+          'rooms' : Room,
+          'memberships' : Membership,
+          'messages' : Message,
+          'teams' : Team,
+          'team/memberships' : TeamMembership,
+          'webhooks' : Webhook}
@@ -0,0 +1,401 @@
+#!/usr/bin/python3
+'''
+Local stand-in for the Spark API
+
+StandIn is an HTTP server on localhost serving the v1 endpoints used by spark_api.SparkAPI (people, rooms,
+memberships, messages, teams, team/memberships, webhooks), attachment downloads and the access_token endpoint used by
+identity_broker. It allows offline tests and load tests w/o touching the real service:
+
+    with StandIn() as standin:
+        spark = SparkAPI('any token', base_url=standin.base_url)
+        ib = SparkDevIdentityBroker(host=standin.host, scheme='http')
+        ...
+
+The data is served from a tenant. MemoryTenant keeps all records in dictionaries and is populated through the API or
+directly (tenant.create('rooms', {'title' : 'test'}), tenant.add_content(..)). Any object with the same methods can
+be used instead (see spark_tenant.SyntheticTenant for a large generated tenant).
+
+List endpoints are paginated with Link headers exactly like the real API. Latency and errors can be injected:
+    standin.latency = 0.05                          # seconds added to each request
+    standin.inject(429, count=3, retry_after=2)     # next 3 requests get a 429 with Retry-After: 2
+    standin.inject(502, path='messages')            # next request for a path containing 'messages' gets a 502
+    standin.error_rates = {500 : 0.01}              # 1% of all requests fail with a 500
+
+Standalone:
+    python3 spark_standin.py [port]
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl, urlencode
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+import threading
+import random
+import uuid
+import json
+import time
+import sys
+import logging
+
+from spark_ids import ID_TYPES
+import spark_ids
+
+log = logging.getLogger(__name__)
+
+# query parameters used to filter list results
+FILTERS = {'people' : ('email', 'displayName'),
+           'rooms' : ('teamId', 'type'),
+           'memberships' : ('roomId', 'personId', 'personEmail'),
+           'messages' : ('roomId', ),
+           'teams' : (),
+           'team/memberships' : ('teamId', ),
+           'webhooks' : ()}
+
+# sortBy values for rooms: attribute and descending order
+SORT_KEYS = {'id' : ('id', False),
+             'lastactivity' : ('lastActivity', True),
+             'created' : ('created', True)}
+
+# default number of items per page
+DEFAULT_MAX = 100
+
+def spark_id(resource, uid):
+    ''' Spark ID for a resource type and an UUID
+    '''
+    return spark_ids.encode(uid, ID_TYPES[resource])
+
+def timestamp(t = None):
+    ''' Spark timestamp for a datetime (or now)
+    '''
+    t = t or datetime.utcnow()
+    return t.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(t.microsecond // 1000)
+
+def matches(resource, item, params):
+    for k, v in params.items():
+        if k not in FILTERS[resource]: continue
+        if k == 'email':
+            if v not in item.get('emails', ()): return False
+        elif k == 'displayName':
+            if not item.get('displayName', '').startswith(v): return False
+        elif item.get(k) != v:
+            return False
+    return True
+
+class MemoryTenant:
+    ''' all records of a tenant held in memory
+    '''
+    def __init__(self):
+        self.records = {resource : OrderedDict() for resource in FILTERS}
+        self.contents = {}
+        self._lock = threading.Lock()
+
+    def list(self, resource, params, offset, limit):
+        ''' items offset .. offset + limit of a (filtered) list. Returns the items and a flag indicating whether more
+        items exist
+        '''
+        with self._lock:
+            items = [i for i in self.records[resource].values() if matches(resource, i, params)]
+        if resource == 'messages':
+            # newest first
+            items.reverse()
+            if 'before' in params:
+                items = [i for i in items if i['created'] < params['before']]
+        elif resource == 'rooms' and params.get('sortBy') in SORT_KEYS:
+            key, reverse = SORT_KEYS[params['sortBy']]
+            items.sort(key = lambda i: i.get(key) or '', reverse = reverse)
+        return items[offset:offset + limit], offset + limit < len(items)
+
+    def get(self, resource, resource_id):
+        with self._lock:
+            return self.records[resource].get(resource_id)
+
+    def create(self, resource, values):
+        item = dict(values)
+        item['id'] = spark_id(resource, uuid.uuid4())
+        item['created'] = timestamp()
+        if resource == 'rooms':
+            item.setdefault('type', 'group')
+            item.setdefault('isLocked', False)
+            item['lastActivity'] = item['created']
+        elif resource == 'messages':
+            room = self.get('rooms', item.get('roomId'))
+            if room:
+                room['lastActivity'] = item['created']
+                item['roomType'] = room['type']
+        elif resource in ('memberships', 'team/memberships'):
+            item.setdefault('isModerator', False)
+            if 'personEmail' in item and 'personId' not in item:
+                item['personId'] = spark_id('people', uuid.uuid5(uuid.NAMESPACE_DNS, item['personEmail']))
+        with self._lock:
+            self.records[resource][item['id']] = item
+        return item
+
+    def update(self, resource, resource_id, values):
+        with self._lock:
+            item = self.records[resource].get(resource_id)
+            if item is None: return None
+            item.update((k, v) for k, v in values.items() if k not in ('id', 'created'))
+            return item
+
+    def delete(self, resource, resource_id):
+        with self._lock:
+            return self.records[resource].pop(resource_id, None) is not None
+
+    def add_content(self, file_name, data, content_type = 'application/octet-stream'):
+        ''' add an attachment. Returns the path of the content relative to the base URL ('contents/<id>') to be used
+        in the 'files' attribute of a message
+        '''
+        content_id = spark_id('contents', uuid.uuid4())
+        with self._lock:
+            self.contents[content_id] = (file_name, content_type, data)
+        return 'contents/' + content_id
+
+    def content(self, content_id):
+        ''' (file name, content type, length, iterable of chunks) of an attachment (or None)
+        '''
+        with self._lock:
+            entry = self.contents.get(content_id)
+        if entry is None: return None
+        file_name, content_type, data = entry
+        return file_name, content_type, len(data), (data, )
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt % args)
+
+    ############################ responses
+    def send(self, status, body = None, headers = None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('TrackingID', 'STANDIN_{}'.format(uuid.uuid4()))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if data: self.wfile.write(data)
+
+    def error(self, status, message, headers = None):
+        self.send(status, {'message' : message, 'errors' : [{'description' : message}], 'trackingId' : 'STANDIN'},
+                  headers)
+
+    def body(self):
+        n = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(n) if n else b''
+
+    def json_body(self):
+        try:
+            return json.loads(self.body() or b'{}')
+        except ValueError:
+            return None
+
+    ############################ request handling
+    def handle_request(self, method):
+        standin = self.server.standin
+        url = urlparse(self.path)
+        path = url.path.strip('/')
+        standin.count(method, path)
+        fault = standin.fault(method, path)
+        if standin.latency:
+            time.sleep(standin.latency)
+        if fault:
+            # the body of the request has to be consumed to keep the connection usable
+            self.body()
+            status, retry_after = fault
+            headers = {'Retry-After' : str(retry_after)} if status == 429 else None
+            return self.error(status, 'Injected error', headers)
+        if path.endswith('access_token') and method == 'POST':
+            return self.access_token()
+        if not path.startswith('v1/'):
+            self.body()
+            return self.error(404, 'The requested resource could not be found.')
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self.body()
+            return self.error(401, 'The request requires a valid access token set in the Authorization request header.')
+        path = path[3:]
+        if path.startswith('contents/') and method == 'GET':
+            return self.download(path[len('contents/'):])
+        if path.startswith('team/'):
+            parts = path.split('/')
+            resource, resource_id = '/'.join(parts[:2]), '/'.join(parts[2:])
+        else:
+            resource, _, resource_id = path.partition('/')
+        if resource not in FILTERS:
+            self.body()
+            return self.error(404, 'The requested resource could not be found.')
+        tenant = standin.tenant
+        if not resource_id:
+            if method == 'GET':
+                return self.list(resource, dict(parse_qsl(url.query)))
+            if method == 'POST':
+                values = self.json_body()
+                if values is None: return self.error(400, 'Invalid JSON')
+                return self.send(200, self.expand(resource, tenant.create(resource, values)))
+            self.body()
+            return self.error(405, 'Method not allowed')
+        if method == 'GET':
+            item = tenant.get(resource, resource_id)
+        elif method == 'PUT':
+            values = self.json_body()
+            if values is None: return self.error(400, 'Invalid JSON')
+            item = tenant.update(resource, resource_id, values)
+        elif method == 'DELETE':
+            self.body()
+            if tenant.delete(resource, resource_id):
+                return self.send(204)
+            item = None
+        else:
+            self.body()
+            return self.error(405, 'Method not allowed')
+        if item is None:
+            return self.error(404, 'The requested resource could not be found.')
+        return self.send(200, self.expand(resource, item))
+
+    def expand(self, resource, item):
+        ''' attachments are stored relative to the base URL
+        '''
+        if resource == 'messages' and 'files' in item:
+            base = self.server.standin.base_url + '/'
+            item = dict(item)
+            item['files'] = [f if f.startswith('http') else base + f for f in item['files']]
+        return item
+
+    def list(self, resource, params):
+        try:
+            limit = int(params.get('max', DEFAULT_MAX))
+            offset = int(params.get('cursor', 0))
+        except ValueError:
+            return self.error(400, 'Invalid parameter')
+        items, more = self.server.standin.tenant.list(resource, params, offset, limit)
+        headers = {}
+        if more:
+            params['cursor'] = offset + limit
+            headers['Link'] = '<{}/{}?{}>; rel="next"'.format(self.server.standin.base_url, resource, urlencode(params))
+        self.send(200, {'items' : [self.expand(resource, i) for i in items]}, headers)
+
+    def download(self, content_id):
+        content = self.server.standin.tenant.content(content_id)
+        if content is None:
+            return self.error(404, 'The requested resource could not be found.')
+        file_name, content_type, length, chunks = content
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Disposition', 'attachment; filename="{}"'.format(file_name))
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def access_token(self):
+        form = dict(parse_qsl(self.body().decode()))
+        if form.get('grant_type') not in ('authorization_code', 'refresh_token'):
+            return self.error(400, 'unsupported_grant_type')
+        standin = self.server.standin
+        token = {'access_token' : 'STANDIN_ACCESS_{}'.format(uuid.uuid4().hex),
+                 'expires_in' : standin.access_token_lifetime,
+                 'refresh_token' : form.get('refresh_token') or 'STANDIN_REFRESH_{}'.format(uuid.uuid4().hex),
+                 'refresh_token_expires_in' : standin.refresh_token_lifetime}
+        self.send(200, token)
+
+    def do_GET(self): self.handle_request('GET')
+    def do_POST(self): self.handle_request('POST')
+    def do_PUT(self): self.handle_request('PUT')
+    def do_DELETE(self): self.handle_request('DELETE')
+
+class StandIn:
+    def __init__(self, tenant = None, host = '127.0.0.1', port = 0, latency = 0, error_rates = None, seed = None):
+        '''
+        parameters:
+            tenant: data served by the stand-in. Defaults to an empty MemoryTenant
+            host, port: address to listen on. Port 0 picks a free port
+            latency: seconds added to the processing time of each request
+            error_rates: dictionary status code -> probability of random errors (429, 500, 502, ..)
+            seed:   seed for the random errors
+        '''
+        self.tenant = tenant if tenant is not None else MemoryTenant()
+        self.latency = latency
+        self.error_rates = error_rates or {}
+        self.retry_after = 1
+        self.access_token_lifetime = 1209600
+        self.refresh_token_lifetime = 7776000
+        self.requests = defaultdict(int)
+        self._faults = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def host(self):
+        ''' host:port of the stand-in (as expected by the identity brokers)
+        '''
+        host, port = self._server.server_address[:2]
+        return '{}:{}'.format(host, port)
+
+    @property
+    def base_url(self):
+        ''' base URL of the v1 API to be passed to SparkAPI
+        '''
+        return 'http://{}/v1'.format(self.host)
+
+    def start(self):
+        self._thread = threading.Thread(target = self._server.serve_forever, name = 'standin', daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    ############################ fault injection
+    def inject(self, status, count = 1, retry_after = None, path = None):
+        ''' let the next count requests (with path containing path) fail with the given status code
+        '''
+        with self._lock:
+            self._faults.append([status, count, self.retry_after if retry_after is None else retry_after, path])
+
+    def fault(self, method, path):
+        ''' status code and Retry-After of a fault for a request (or None)
+        '''
+        with self._lock:
+            for fault in self._faults:
+                status, count, retry_after, fault_path = fault
+                if fault_path and fault_path not in path: continue
+                fault[1] -= 1
+                if fault[1] <= 0: self._faults.remove(fault)
+                return status, retry_after
+            for status, rate in self.error_rates.items():
+                if self._random.random() < rate:
+                    return status, self.retry_after
+        return None
+
+    def count(self, method, path):
+        # ids are not counted individually
+        parts = path.split('/')
+        label = '/'.join(parts[:3] if path.startswith('v1/team/') else parts[:2])
+        if len(parts) > label.count('/') + 1: label += '/{id}'
+        with self._lock:
+            self.requests['{} {}'.format(method, label)] += 1
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    standin = StandIn(port = port)
+    print('Spark API stand-in listening on {}'.format(standin.base_url))
+    try:
+        standin._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
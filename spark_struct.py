@@ -3,6 +3,7 @@ Created on 07.12.2015
 
 @author: jkrohn
 '''
+from collections.abc import Sequence
 
 class Struct:
     ''' helper class mapping dictionaries to a class
@@ -18,8 +19,21 @@ class Struct:
         for k,v in d.items():
             self.__dict__[k] = self._to_struct(v)
             
+    def _from_struct(self, obj):
+        if isinstance(obj, Struct):
+            return obj.get_dict()
+        if isinstance(obj, list):
+            return [self._from_struct(v) for v in obj]
+        return obj
+    
     def get_dict(self):
-        return {k:v.get_dict() if isinstance(v, Struct) else v for k,v in self.__dict__.items()}
+        return {k:self._from_struct(v) for k,v in self.__dict__.items()}
+    
+    @staticmethod
+    def view(d):
+        ''' zero-copy alternative to Struct(d): see StructView
+        '''
+        return StructView(d)
     
     def __str__(self):
         return str(self.get_dict())
@@ -51,4 +65,104 @@ class Struct:
         if isinstance(other, Struct):
             return not self.__eq__(other)
         else:
-            return NotImplemented
\ No newline at end of file
+            return NotImplemented
+
+def _view(obj):
+    if isinstance(obj, dict):
+        return StructView(obj)
+    if isinstance(obj, list):
+        return ListView(obj)
+    return obj
+
+def _unview(obj):
+    if isinstance(obj, (StructView, ListView)):
+        return obj._source
+    return obj
+
+class StructView:
+    ''' helper class mapping dictionaries to a class w/o copying
+    
+    Other than Struct a StructView doesn't copy the dictionary: attributes are looked up in the wrapped dictionary and
+    nested dictionaries and lists are only wrapped in views when they are accessed. Attributes set on the view are set
+    in the wrapped dictionary. get_dict() returns the wrapped dictionary itself.
+    '''
+    __slots__ = ('_source', )
+    
+    def __init__(self, d = None):
+        object.__setattr__(self, '_source', {} if d is None else d)
+        
+    def __getattr__(self, name):
+        # _source not set yet (copy, pickle) and special methods are never looked up in the dictionary
+        if name == '_source' or name[:2] == '__':
+            raise AttributeError(name)
+        try:
+            return _view(self._source[name])
+        except KeyError:
+            raise AttributeError(name)
+        
+    def __setattr__(self, name, value):
+        if name == '_source':
+            # copy and pickle restore the slot
+            object.__setattr__(self, name, value)
+            return
+        self._source[name] = _unview(value)
+        
+    def __delattr__(self, name):
+        try:
+            del self._source[name]
+        except KeyError:
+            raise AttributeError(name)
+        
+    def get_dict(self):
+        return self._source
+    
+    def __str__(self):
+        return str(self._source)
+    
+    def __repr__(self):
+        return 'StructView({!r})'.format(self._source)
+    
+    def __contains__(self, key):
+        return key in self._source
+    
+    def __eq__(self, other):
+        if isinstance(other, (StructView, Struct)):
+            other = other.get_dict()
+        elif not isinstance(other, dict):
+            return NotImplemented
+        return self._source is other or self._source == other
+    
+    def __ne__(self, other):
+        r = self.__eq__(other)
+        return r if r is NotImplemented else not r
+    
+    # mutable like the wrapped dictionary
+    __hash__ = None
+    
+class ListView(Sequence):
+    ''' read-only view on a list: dictionaries and lists in the list are returned as views
+    '''
+    __slots__ = ('_source', )
+    
+    def __init__(self, l):
+        self._source = l
+        
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ListView(self._source[index])
+        return _view(self._source[index])
+    
+    def __len__(self):
+        return len(self._source)
+    
+    def __eq__(self, other):
+        if isinstance(other, ListView):
+            other = other._source
+        elif not isinstance(other, list):
+            return NotImplemented
+        return self._source is other or self._source == other
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return 'ListView({!r})'.format(self._source)
@@ -0,0 +1,506 @@
+#!/usr/bin/python3
+'''
+Synthetic large tenant for spark_standin
+
+SyntheticTenant describes a tenant with tens of thousands of rooms and millions of messages w/o holding it in memory:
+every record is computed on request from the seed and the position of the record. The same seed always produces the
+same tenant. Records created, changed or deleted through the API are kept in an overlay in memory.
+
+    tenant = SyntheticTenant(seed=1, rooms=20000, messages_per_room=100)
+    with StandIn(tenant) as standin:
+        spark = SparkAPI('any token', base_url=standin.base_url)
+
+Distributions:
+    * messages per room: log-normal (many small rooms, few very busy rooms) with the given mean
+    * members per group room: log-normal with a median of 8; direct rooms have two members
+    * a share of attachment_ratio of all messages has one (sometimes up to three) attachments
+    * attachment sizes: log-normal with the given median, capped at max_attachment_size
+
+export() streams the complete tenant to a gzip compressed JSON lines file.
+
+Usage:
+    python3 spark_tenant.py [rooms] [messages per room] [file name]
+prints the size of the tenant and optionally exports it.
+'''
+from datetime import datetime, timedelta
+import itertools
+import bisect
+import heapq
+import uuid
+import math
+import json
+import gzip
+import sys
+
+import spark_ids
+from spark_standin import MemoryTenant, ID_TYPES, FILTERS, SORT_KEYS, spark_id, timestamp
+
+# time span covered by the tenant
+START = datetime(2015, 1, 1)
+END = datetime(2017, 1, 1)
+
+# kinds of records. Part of the UUIDs so that a Spark ID can be mapped back to the record
+_KINDS = {'people' : 1, 'rooms' : 2, 'memberships' : 3, 'messages' : 4, 'teams' : 5, 'team/memberships' : 6,
+          'contents' : 7}
+_MASK64 = (1 << 64) - 1
+
+_FIRST = ('Anna', 'Ben', 'Carla', 'David', 'Eva', 'Frank', 'Greta', 'Hugo', 'Ines', 'Jan', 'Kim', 'Lars', 'Mia',
+          'Nils', 'Olga', 'Paul', 'Rosa', 'Sven', 'Tina', 'Uwe')
+_LAST = ('Adams', 'Berg', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hansen', 'Ito', 'Jones', 'Kowalski', 'Lopez',
+         'Meyer', 'Nguyen', 'Olsen', 'Patel', 'Rossi', 'Schmidt', 'Tanaka', 'Weber')
+_WORDS = ('meeting', 'update', 'release', 'customer', 'demo', 'build', 'review', 'slides', 'call', 'budget', 'plan',
+          'issue', 'fix', 'deploy', 'test', 'lab', 'design', 'roadmap', 'status', 'feedback')
+_EXTENSIONS = (('pdf', 'application/pdf'), ('png', 'image/png'), ('jpg', 'image/jpeg'),
+               ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+               ('pptx', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+               ('zip', 'application/zip'), ('txt', 'text/plain'))
+
+# size of the block of pseudo random bytes attachments are made of
+_BLOCK_SIZE = 65536
+
+def _mix(x):
+    ''' splitmix64 finalizer
+    '''
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & _MASK64
+    return x ^ (x >> 31)
+
+class SyntheticTenant:
+    def __init__(self, seed = 0, rooms = 20000, people = 5000, teams = 200, messages_per_room = 100,
+                 attachment_ratio = 0.05, attachment_size = 200000, max_attachment_size = 50 * 2**20,
+                 direct_ratio = 0.3, team_ratio = 0.2):
+        '''
+        parameters:
+            seed:   the same seed (and parameters) always gives the same tenant
+            rooms, people, teams: number of rooms, people and teams
+            messages_per_room: mean number of messages per room
+            attachment_ratio: share of messages with attachments
+            attachment_size: median size of attachments in bytes
+            max_attachment_size: maximum size of attachments in bytes
+            direct_ratio: share of 1:1 rooms
+            team_ratio: share of group rooms belonging to a team
+        '''
+        self.seed = seed
+        self.rooms = rooms
+        self.people = people
+        self.teams = teams
+        self.messages_per_room = messages_per_room
+        self.attachment_ratio = attachment_ratio
+        self.attachment_size = attachment_size
+        self.max_attachment_size = max_attachment_size
+        self.direct_ratio = direct_ratio
+        self.team_ratio = team_ratio
+        self.overlay = MemoryTenant()
+        # synthetic records changed (dictionary) or deleted (None) through the API
+        self.changes = {}
+        # (sort key, room index) of all synthetic rooms per sortBy value. Computed on first use
+        self._room_order = {}
+        self._prefix = _mix(seed & _MASK64 ^ 0x5350524b)
+        self._org_id = spark_id('organizations', uuid.UUID(int = self._prefix << 64))
+        self._span = (END - START).total_seconds()
+        block = bytearray()
+        x = self._prefix
+        while len(block) < _BLOCK_SIZE:
+            x = _mix(x + 1)
+            block += x.to_bytes(8, 'little')
+        self._block = bytes(block)
+
+    ############################ deterministic random numbers
+    def _hash(self, *parts):
+        h = self._prefix
+        for p in parts:
+            h = _mix(h ^ (p & _MASK64))
+        return h
+
+    def _uniform(self, *parts):
+        return (self._hash(*parts) >> 11) / 2**53
+
+    def _lognormal(self, median, sigma, *parts):
+        # Box-Muller with two independent uniforms
+        u1 = max(self._uniform(*parts, 1), 1e-12)
+        u2 = self._uniform(*parts, 2)
+        return median * math.exp(sigma * math.sqrt(-2 * math.log(u1)) * math.cos(2 * math.pi * u2))
+
+    ############################ IDs
+    def _id(self, resource, a, b = 0):
+        uid = uuid.UUID(int = (self._prefix << 64) | (_KINDS[resource] << 56) | (a << 28) | b)
+        return spark_id(resource, uid)
+
+    def _decode(self, resource, resource_id):
+        ''' (a, b) for an ID of a synthetic record (or None)
+        '''
+        try:
+            parsed = spark_ids.cached_parse(resource_id)
+            if parsed.type != ID_TYPES[resource]: return None
+            n = uuid.UUID(parsed.uuid).int
+        except Exception:
+            return None
+        if n >> 64 != self._prefix or (n >> 56) & 0xff != _KINDS[resource]: return None
+        return (n >> 28) & (2**28 - 1), n & (2**28 - 1)
+
+    ############################ records
+    def _time(self, t):
+        return timestamp(START + timedelta(seconds = t))
+
+    def person(self, p):
+        first = _FIRST[self._hash(1, p) % len(_FIRST)]
+        last = _LAST[self._hash(2, p) % len(_LAST)]
+        email = '{}.{}{}@example.com'.format(first.lower(), last.lower(), p)
+        return {'id' : self._id('people', p),
+                'emails' : [email],
+                'displayName' : '{} {}'.format(first, last),
+                'firstName' : first,
+                'lastName' : last,
+                'orgId' : self._org_id,
+                'created' : self._time(self._uniform(3, p) * self._span * 0.2),
+                'type' : 'person'}
+
+    def _room_info(self, r):
+        ''' type, team, created, time between messages and number of messages of a room
+        '''
+        direct = self._uniform(10, r) < self.direct_ratio
+        team = None
+        if not direct and self.teams and self._uniform(11, r) < self.team_ratio:
+            team = self._hash(12, r) % self.teams
+        created = self._uniform(13, r) * self._span * 0.5
+        # log-normal with sigma 1.5 and the requested mean
+        n = int(self._lognormal(self.messages_per_room * math.exp(-1.5**2 / 2), 1.5, 14, r))
+        n = max(min(n, 2**26 - 1), 1)
+        interval = (self._span - created) * (0.2 + 0.8 * self._uniform(15, r)) / n
+        return direct, team, created, interval, n
+
+    def _members(self, r, direct):
+        ''' first person and number of members of a room (members are consecutive people)
+        '''
+        if direct:
+            n = 2
+        else:
+            n = int(min(max(self._lognormal(8, 1, 16, r), 3), self.people))
+        return self._hash(17, r) % self.people, min(n, self.people)
+
+    def room(self, r):
+        direct, team, created, interval, n = self._room_info(r)
+        room = {'id' : self._id('rooms', r),
+                'title' : 'Room {} {}'.format(r, _WORDS[self._hash(18, r) % len(_WORDS)]),
+                'type' : 'direct' if direct else 'group',
+                'isLocked' : False,
+                'lastActivity' : self._time(created + (n - 1) * interval),
+                'created' : self._time(created),
+                'creatorId' : self._id('people', self._members(r, direct)[0])}
+        if team is not None:
+            room['teamId'] = self._id('teams', team)
+        return room
+
+    def membership(self, r, k):
+        direct, _, created, _, _ = self._room_info(r)
+        first, _ = self._members(r, direct)
+        p = (first + k) % self.people
+        person = self.person(p)
+        return {'id' : self._id('memberships', r, k),
+                'roomId' : self._id('rooms', r),
+                'personId' : person['id'],
+                'personEmail' : person['emails'][0],
+                'personDisplayName' : person['displayName'],
+                'isModerator' : k == 0 and not direct,
+                'isMonitor' : False,
+                'created' : self._time(created)}
+
+    def _files(self, r, m):
+        ''' (file name, content type, size) of the attachments of a message
+        '''
+        if self._uniform(20, r, m) >= self.attachment_ratio: return []
+        count = 1 if self._uniform(21, r, m) < 0.9 else 2 + self._hash(22, r, m) % 2
+        files = []
+        for k in range(count):
+            ext, content_type = _EXTENSIONS[self._hash(23, r, m, k) % len(_EXTENSIONS)]
+            size = int(min(max(self._lognormal(self.attachment_size, 1.8, 24, r, m, k), 1), self.max_attachment_size))
+            files.append(('{}_{}_{}.{}'.format(_WORDS[self._hash(25, r, m, k) % len(_WORDS)], r, m, ext),
+                          content_type, size))
+        return files
+
+    def message(self, r, m, info = None):
+        direct, _, created, interval, _ = info or self._room_info(r)
+        first, members = self._members(r, direct)
+        person = self.person((first + self._hash(26, r, m) % members) % self.people)
+        words = 3 + self._hash(27, r, m) % 20
+        message = {'id' : self._id('messages', r, m),
+                   'roomId' : self._id('rooms', r),
+                   'roomType' : 'direct' if direct else 'group',
+                   'text' : ' '.join(_WORDS[self._hash(28, r, m, w) % len(_WORDS)] for w in range(words)),
+                   'personId' : person['id'],
+                   'personEmail' : person['emails'][0],
+                   'created' : self._time(created + m * interval)}
+        files = self._files(r, m)
+        if files:
+            message['files'] = ['contents/' + self._id('contents', r, m * 4 + k) for k in range(len(files))]
+        return message
+
+    def team(self, t):
+        return {'id' : self._id('teams', t),
+                'name' : 'Team {} {}'.format(t, _WORDS[self._hash(30, t) % len(_WORDS)]),
+                'created' : self._time(self._uniform(31, t) * self._span * 0.3),
+                'creatorId' : self._id('people', self._hash(32, t) % self.people)}
+
+    def team_membership(self, t, k):
+        team = self.team(t)
+        person = self.person((self._hash(33, t) + k) % self.people)
+        return {'id' : self._id('team/memberships', t, k),
+                'teamId' : team['id'],
+                'personId' : person['id'],
+                'personEmail' : person['emails'][0],
+                'personDisplayName' : person['displayName'],
+                'isModerator' : k == 0,
+                'created' : team['created']}
+
+    def _team_members(self, t):
+        return min(2 + self._hash(34, t) % 20, self.people)
+
+    ############################ lists
+    def _indexed(self, resource, params):
+        ''' (number of records, function returning record i) for lists which can be addressed by position or None
+        '''
+        filters = {k : v for k, v in params.items() if k in FILTERS[resource]}
+        if resource == 'people' and not filters:
+            return self.people, self.person
+        if resource == 'people' and list(filters) == ['email']:
+            # the index of the person is part of the e-mail address
+            local = filters['email'].partition('@')[0]
+            digits = len(local) - len(local.rstrip('0123456789'))
+            p = int(local[-digits:]) if digits else self.people
+            if p >= self.people or self.person(p)['emails'][0] != filters['email']: return 0, None
+            return 1, lambda k: self.person(p)
+        if resource == 'rooms' and not filters:
+            return self.rooms, self.room
+        if resource == 'teams':
+            return self.teams, self.team
+        if resource == 'memberships' and list(filters) == ['roomId']:
+            r = self._decode('rooms', filters['roomId'])
+            if r is None: return 0, None
+            r = r[0]
+            _, members = self._members(r, self._room_info(r)[0])
+            return members, lambda k: self.membership(r, k)
+        if resource == 'team/memberships' and list(filters) == ['teamId']:
+            t = self._decode('teams', filters['teamId'])
+            if t is None: return 0, None
+            t = t[0]
+            return self._team_members(t), lambda k: self.team_membership(t, k)
+        if resource == 'messages':
+            r = self._decode('rooms', filters.get('roomId', ''))
+            if r is None: return 0, None
+            r = r[0]
+            info = self._room_info(r)
+            n = info[4]
+            before = params.get('before')
+            if before:
+                n = bisect.bisect_left(range(n), before, key = lambda m: self._time(info[2] + m * info[3]))
+            # newest first
+            return n, lambda k: self.message(r, n - 1 - k, info)
+        return None
+
+    def _scan(self, resource, params):
+        ''' all records of a list with filters which can't be addressed by position
+        '''
+        if resource == 'people':
+            records = map(self.person, range(self.people))
+        elif resource == 'rooms':
+            records = map(self.room, range(self.rooms))
+        elif resource == 'memberships':
+            records = (self.membership(r, k) for r in range(self.rooms)
+                       for k in range(self._members(r, self._room_info(r)[0])[1]))
+        elif resource == 'team/memberships':
+            records = (self.team_membership(t, k) for t in range(self.teams) for k in range(self._team_members(t)))
+        else:
+            records = iter(())
+        filters = {k : v for k, v in params.items() if k in FILTERS[resource]}
+        for record in records:
+            ok = True
+            for k, v in filters.items():
+                if k == 'email':
+                    ok = v in record['emails']
+                elif k == 'displayName':
+                    ok = record['displayName'].startswith(v)
+                else:
+                    ok = record.get(k) == v
+                if not ok: break
+            if ok: yield record
+
+    def _changed(self, records):
+        for record in records:
+            if record['id'] in self.changes:
+                record = self.changes[record['id']]
+                if record is None: continue
+            yield record
+
+    def _sorted_rooms(self, params, offset, limit):
+        ''' rooms sorted by sortBy: synthetic rooms merged with the rooms created through the API
+        '''
+        key, reverse = SORT_KEYS[params['sortBy']]
+        overlay = self.overlay.list('rooms', params, 0, sys.maxsize)[0]
+        if any(k in FILTERS['rooms'] for k in params):
+            rooms = list(self._changed(self._scan('rooms', params))) + overlay
+            rooms.sort(key = lambda room: room.get(key) or '', reverse = reverse)
+            return rooms[offset:offset + limit], offset + limit < len(rooms)
+        order = self._room_order.get(key)
+        if order is None:
+            order = self._room_order[key] = sorted(((self.room(r)[key], r) for r in range(self.rooms)),
+                                                   reverse = reverse)
+
+        def merged():
+            for _, room in heapq.merge(order, ((o.get(key) or '', o) for o in overlay), key = lambda x: x[0],
+                                       reverse = reverse):
+                # synthetic rooms are represented by their index
+                if type(room) is int and self.changes:
+                    room_id = self._id('rooms', room)
+                    if room_id in self.changes:
+                        room = self.changes[room_id]
+                        if room is None: continue
+                yield room
+
+        page = list(itertools.islice(merged(), offset, offset + limit + 1))
+        return [self.room(r) if type(r) is int else r for r in page[:limit]], len(page) > limit
+
+    def list(self, resource, params, offset, limit):
+        ''' same as MemoryTenant.list(). Records created through the API follow the synthetic records unless rooms
+        are sorted
+        '''
+        if resource == 'rooms' and params.get('sortBy') in SORT_KEYS:
+            return self._sorted_rooms(params, offset, limit)
+        indexed = self._indexed(resource, params)
+        if indexed is not None:
+            count, record = indexed
+            items = [record(i) for i in range(offset, min(offset + limit, count))]
+        else:
+            scan = list(self._scan(resource, params))
+            count = len(scan)
+            items = scan[offset:offset + limit]
+        items = list(self._changed(items))
+        more = offset + limit < count
+        if offset + limit >= count:
+            # continue with records created through the API
+            overlay, more = self.overlay.list(resource, params, max(offset - count, 0),
+                                              offset + limit - max(offset, count))
+            items.extend(overlay)
+        return items, more
+
+    ############################ single records
+    def get(self, resource, resource_id):
+        if resource_id in self.changes:
+            return self.changes[resource_id]
+        key = self._decode(resource, resource_id)
+        if key is None:
+            return self.overlay.get(resource, resource_id)
+        a, b = key
+        if resource == 'people':
+            return self.person(a) if a < self.people else None
+        if resource == 'rooms':
+            return self.room(a) if a < self.rooms else None
+        if resource == 'teams':
+            return self.team(a) if a < self.teams else None
+        if resource == 'messages':
+            if a >= self.rooms or b >= self._room_info(a)[4]: return None
+            return self.message(a, b)
+        if resource == 'memberships':
+            if a >= self.rooms or b >= self._members(a, self._room_info(a)[0])[1]: return None
+            return self.membership(a, b)
+        if resource == 'team/memberships':
+            if a >= self.teams or b >= self._team_members(a): return None
+            return self.team_membership(a, b)
+        return None
+
+    def create(self, resource, values):
+        return self.overlay.create(resource, values)
+
+    def update(self, resource, resource_id, values):
+        item = self.overlay.update(resource, resource_id, values)
+        if item is not None: return item
+        item = self.get(resource, resource_id)
+        if item is None: return None
+        item.update((k, v) for k, v in values.items() if k not in ('id', 'created'))
+        self.changes[resource_id] = item
+        return item
+
+    def delete(self, resource, resource_id):
+        if self.overlay.delete(resource, resource_id): return True
+        if self.get(resource, resource_id) is None: return False
+        self.changes[resource_id] = None
+        return True
+
+    ############################ attachments
+    def add_content(self, file_name, data, content_type = 'application/octet-stream'):
+        return self.overlay.add_content(file_name, data, content_type)
+
+    def _chunks(self, size, offset):
+        while size > 0:
+            chunk = self._block[offset:offset + size]
+            offset = 0
+            size -= len(chunk)
+            yield chunk
+
+    def content(self, content_id):
+        key = self._decode('contents', content_id)
+        if key is None:
+            return self.overlay.content(content_id)
+        r, mk = key
+        m, k = divmod(mk, 4)
+        if r >= self.rooms or m >= self._room_info(r)[4]: return None
+        files = self._files(r, m)
+        if k >= len(files): return None
+        file_name, content_type, size = files[k]
+        return file_name, content_type, size, self._chunks(size, self._hash(35, r, m, k) % _BLOCK_SIZE)
+
+    ############################ whole tenant
+    def size(self):
+        ''' number of records and total size of attachments. Needs to look at every message (but not to create them)
+        '''
+        result = {'people' : self.people, 'rooms' : self.rooms, 'teams' : self.teams, 'memberships' : 0,
+                  'messages' : 0, 'attachments' : 0, 'attachment_bytes' : 0}
+        for r in range(self.rooms):
+            direct, _, _, _, n = self._room_info(r)
+            result['memberships'] += self._members(r, direct)[1]
+            result['messages'] += n
+            for m in range(n):
+                files = self._files(r, m)
+                result['attachments'] += len(files)
+                result['attachment_bytes'] += sum(f[2] for f in files)
+        return result
+
+    def records(self):
+        ''' (resource, record) for all records of the tenant. Generated one by one
+        '''
+        for p in range(self.people):
+            yield 'people', self.person(p)
+        for t in range(self.teams):
+            yield 'teams', self.team(t)
+            for k in range(self._team_members(t)):
+                yield 'team/memberships', self.team_membership(t, k)
+        for r in range(self.rooms):
+            yield 'rooms', self.room(r)
+            info = self._room_info(r)
+            for k in range(self._members(r, info[0])[1]):
+                yield 'memberships', self.membership(r, k)
+            for m in range(info[4]):
+                yield 'messages', self.message(r, m, info)
+
+    def export(self, file_name):
+        ''' stream all records to a gzip compressed JSON lines file: {"resource" : .., "record" : ..} per line
+        Returns the number of records written
+        '''
+        n = 0
+        with gzip.open(file_name, 'wt', encoding = 'utf-8', compresslevel = 5) as f:
+            for resource, record in self.records():
+                f.write(json.dumps({'resource' : resource, 'record' : record}))
+                f.write('\n')
+                n += 1
+        return n
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    tenant = SyntheticTenant(rooms = rooms, messages_per_room = messages)
+    for k, v in tenant.size().items():
+        print('{:20s} {:>15,}'.format(k, v))
+    if len(sys.argv) > 3:
+        print('{:,} records written to {}'.format(tenant.export(sys.argv[3]), sys.argv[3]))
+
+if __name__ == '__main__':
+    main()
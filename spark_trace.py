@@ -0,0 +1,185 @@
+'''
+Hooks and tracing for Spark API calls
+
+Hooks
+    Callbacks registered with SparkAPI.add_hook(event, callback) are called with keyword arguments for these events:
+        before_request  method, url, kwargs         before a request is sent (also before each retry)
+        after_response  method, url, response, latency
+        retry           method, url, reason, wait   a request will be retried ('connection_error', '429', '500', ..)
+        page_fetched    url, response               a page of a list_* iterator has been read
+        error           method, url, error          an API call failed
+    Hooks are called on the thread executing the request and should return quickly.
+
+Tracing
+    If a SparkAPI instance has a Tracer then each API call, each page read by a list_* iterator and each HTTP request
+    is recorded as a Span. Spans are nested: the current span of a thread is the parent of new spans. Applications can
+    add their own spans to build a tree:
+
+        tracer = Tracer()
+        spark = SparkAPI(token, tracer=tracer)
+        with tracer.span('room', title=room['title']):
+            for message in spark.list_messages(room['id']):
+                ...
+        print('\\n'.join(tracer.format()))
+
+    A Tracer keeps all spans in memory. For long running applications pass a sink: each top level span is handed to
+    the sink when it finishes and then dropped, so only the spans still active are kept:
+
+        tracer = Tracer(sink=lambda span: trace_file.write('\\n'.join(span.format()) + '\\n'))
+        for room in tracer.traced(rooms, 'room', lambda room: {'title' : room['title']}):
+            ...
+'''
+import threading
+import time
+from contextlib import contextmanager
+
+# events supported by SparkAPI.add_hook()
+EVENTS = ('before_request', 'after_response', 'retry', 'page_fetched', 'error')
+
+# parent of a span which has to be a top level span, even if the thread has a current span
+_ROOT = object()
+
+class Span:
+    def __init__(self, name, parent = None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.children = []
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    def to_dict(self):
+        return {'name' : self.name,
+                'attributes' : self.attributes,
+                'duration' : self.duration,
+                'error' : self.error,
+                'children' : [c.to_dict() for c in self.children]}
+
+    def format(self, indent = 0):
+        ''' lines with the span and all child spans
+        '''
+        attributes = ', '.join('{}={}'.format(k, v) for k, v in self.attributes.items())
+        lines = ['{}{} {:.1f} ms{}{}'.format('  ' * indent, self.name, self.duration * 1000,
+                                              ' (' + attributes + ')' if attributes else '',
+                                              ' error: ' + self.error if self.error else '')]
+        for child in self.children:
+            lines.extend(child.format(indent + 1))
+        return lines
+
+class Tracer:
+    def __init__(self, sink = None):
+        '''
+        parameters:
+            sink:   optional callable. Called with each top level span when it finishes. Spans passed to the sink
+                    are not kept in roots
+        '''
+        self.roots = []
+        self.sink = sink
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        ''' current span of the calling thread (or None)
+        '''
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, parent = None, **attributes):
+        ''' context manager for a new span. The span is the current span of the thread while the context is active
+        parameters:
+            name:   name of the span
+            parent: parent span. Defaults to the current span of the thread. Needed for spans created on other
+                    threads (for example when prefetching pages)
+            attributes: additional information stored with the span
+        '''
+        if parent is None:
+            parent = self.current()
+        elif parent is _ROOT:
+            parent = None
+        span = Span(name, parent, **attributes)
+        with self._lock:
+            if parent is None:
+                self.roots.append(span)
+            else:
+                parent.children.append(span)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = '{}: {}'.format(e.__class__.__name__, e)
+            raise
+        finally:
+            # spans of generators (see traced()) don't necessarily end in the order they were started
+            if stack and stack[-1] is span:
+                stack.pop()
+            elif span in stack:
+                stack.remove(span)
+            span.finish()
+            if parent is None and self.sink is not None:
+                with self._lock:
+                    self.roots.remove(span)
+                self.sink(span)
+
+    def traced(self, items, name, attributes = None):
+        ''' iterate over items with a span for each item
+        The span of an item is active until the next item is requested or the iteration ends. A loop left early
+        ends the span when the generator is closed (immediately in CPython, or explicitly with close()). All spans
+        are children of the span current when traced() is called, even if other spans were started in between.
+        Exceptions raised while processing an item are not recorded in the span.
+        parameters:
+            items:  iterable
+            name:   name of the spans
+            attributes: optional callable returning the attributes of the span for an item
+        '''
+        parent = self.current() or _ROOT
+
+        def spans():
+            for item in items:
+                with self.span(name, parent, **(attributes(item) if attributes else {})):
+                    yield item
+            # for item ..
+        return spans()
+
+    def clear(self):
+        with self._lock:
+            self.roots = []
+
+    def to_dict(self):
+        with self._lock:
+            return [span.to_dict() for span in self.roots]
+
+    def format(self):
+        ''' all spans as indented lines
+        '''
+        with self._lock:
+            return [line for span in self.roots for line in span.format()]
+
+class NullTracer:
+    ''' tracer which records nothing. Can be used by applications instead of a Tracer if tracing is disabled
+    '''
+    @contextmanager
+    def span(self, name, parent = None, **attributes):
+        yield None
+
+    def traced(self, items, name, attributes = None):
+        return iter(items)
+
+    def current(self):
+        return None
@@ -0,0 +1,28 @@
+'''
+Fixtures for the offline tests. The tests run against a spark_standin.StandIn serving a MemoryTenant:
+
+    python3 -m pytest tests
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spark_api
+import rate_governor
+from spark_standin import StandIn
+
+@pytest.fixture
+def standin():
+    ''' stand-in with an empty MemoryTenant
+    '''
+    with StandIn() as server:
+        yield server
+
+@pytest.fixture
+def spark(standin):
+    ''' API instance using the stand-in with its own (unpaced) governor
+    '''
+    return spark_api.SparkAPI('test token', base_url=standin.base_url, governor=rate_governor.RateGovernor())
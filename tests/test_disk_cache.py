@@ -0,0 +1,67 @@
+'''
+Tests for disk_cache: records and lists are served from the SQLite file across processes
+'''
+import os
+import subprocess
+import sys
+
+import spark_api
+import rate_governor
+from disk_cache import DiskCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a run of a script: list all rooms and resolve some people with a persistent cache
+RUN = '''
+import sys
+import spark_api, rate_governor
+from disk_cache import DiskCache
+cache = DiskCache(sys.argv[2], list_ttls={'rooms' : 3600, 'people' : 3600})
+spark = spark_api.SparkAPI('test token', base_url=sys.argv[1], governor=rate_governor.RateGovernor(), cache=cache)
+rooms = list(spark.list_rooms())
+people = spark.resolve_people(['alice@example.com', 'nobody@example.com'])
+print(len(rooms), people['alice@example.com']['id'], people['nobody@example.com'])
+'''
+
+def run(standin, file_name):
+    return subprocess.check_output([sys.executable, '-c', RUN, standin.base_url, file_name], cwd=ROOT).decode().strip()
+
+def test_second_run_served_from_file(standin, tmp_path):
+    for i in range(3):
+        standin.tenant.create('rooms', {'title' : 'room {}'.format(i)})
+    person = standin.tenant.create('people', {'emails' : ['alice@example.com'], 'displayName' : 'Alice'})
+    file_name = str(tmp_path / 'cache.db')
+    assert run(standin, file_name) == '3 {} None'.format(person['id'])
+    requests = dict(standin.requests)
+    assert requests == {'GET v1/rooms' : 1, 'GET v1/people' : 2}
+    # the 2nd process doesn't send any request
+    assert run(standin, file_name) == '3 {} None'.format(person['id'])
+    assert dict(standin.requests) == requests
+
+def test_changes_drop_cached_lists(standin, tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.db'), list_ttls={'rooms' : 3600})
+    spark = spark_api.SparkAPI('test token', base_url=standin.base_url, governor=rate_governor.RateGovernor(),
+                               cache=cache)
+    room = spark.create_room('A')
+    assert len(list(spark.list_rooms())) == 1
+    assert len(list(spark.list_rooms())) == 1
+    assert standin.requests['GET v1/rooms'] == 1
+    spark.create_room('B')
+    assert len(list(spark.list_rooms())) == 2
+    spark.delete_room(room['id'])
+    assert [r['title'] for r in spark.list_rooms()] == ['B']
+    assert standin.requests['GET v1/rooms'] == 3
+
+def test_ttl_and_refresh(standin, tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache.db'), list_ttls={'rooms' : 0})
+    spark = spark_api.SparkAPI('test token', base_url=standin.base_url, governor=rate_governor.RateGovernor(),
+                               cache=cache)
+    list(spark.list_rooms())
+    list(spark.list_rooms())
+    assert standin.requests['GET v1/rooms'] == 2
+    cache.list_ttls['rooms'] = 3600
+    list(spark.list_rooms())
+    assert standin.requests['GET v1/rooms'] == 2
+    cache.refresh()
+    list(spark.list_rooms())
+    assert standin.requests['GET v1/rooms'] == 3
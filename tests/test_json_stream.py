@@ -0,0 +1,42 @@
+'''
+Tests for json_stream
+'''
+import json
+
+import pytest
+
+import json_stream
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+PAGE = {'items' : [{'id' : 'a', 'text' : 'quote " and \\\\ backslash', 'nested' : [[1, 2], {'x' : '}]'}]},
+                   'ünïcödé', 1.5e3, -12, True, None, [], {}],
+        'other' : {'items' : 'not these'}}
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 1000])
+def test_items_in_small_chunks(size):
+    data = json.dumps(PAGE, ensure_ascii=False).encode('utf-8')
+    assert list(json_stream.iter_items(chunked(data, size))) == PAGE['items']
+
+def test_large_item_decoded_once(monkeypatch):
+    item = {'id' : 'large', 'text' : 'x' * 100000, 'files' : ['f{}'.format(i) for i in range(1000)]}
+    data = json.dumps({'items' : [item, {'id' : 'small'}]}).encode('utf-8')
+    calls = []
+    decoder = json_stream._decoder
+
+    class Counting:
+        def raw_decode(self, s, pos):
+            calls.append(pos)
+            return decoder.raw_decode(s, pos)
+
+    monkeypatch.setattr(json_stream, '_decoder', Counting())
+    items = list(json_stream.iter_items(chunked(data, 64)))
+    assert items == [item, {'id' : 'small'}]
+    # 'items' plus one call per item: no retries while the large item is incomplete
+    assert len(calls) == 3
+
+def test_truncated_document():
+    data = json.dumps(PAGE).encode('utf-8')
+    with pytest.raises(json.JSONDecodeError):
+        list(json_stream.iter_items(chunked(data[:len(data) // 2], 10)))
@@ -0,0 +1,25 @@
+'''
+Tests for the list_* iterators against the stand-in
+'''
+import time
+
+def add_rooms(standin, count):
+    for i in range(count):
+        standin.tenant.create('rooms', {'title' : 'room {}'.format(i)})
+
+def test_prefetch_reads_all_pages(standin, spark):
+    add_rooms(standin, 35)
+    titles = [room['title'] for room in spark.list_rooms(p_max=10, prefetch=2)]
+    assert sorted(titles) == sorted('room {}'.format(i) for i in range(35))
+    assert standin.requests['GET v1/rooms'] == 4
+
+def test_prefetch_bounded_by_depth(standin, spark):
+    add_rooms(standin, 50)
+    rooms = spark.list_rooms(p_max=10, prefetch=1)
+    for i, room in enumerate(rooms):
+        # slow consumer: the prefetch thread has plenty of time to run ahead
+        time.sleep(0.02)
+        if i == 9: break
+    # first page and one page prefetched while the first page was processed
+    time.sleep(0.3)
+    assert standin.requests['GET v1/rooms'] == 2
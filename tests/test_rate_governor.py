@@ -0,0 +1,58 @@
+'''
+Tests for rate_governor: token bucket pacing and Retry-After handling against the stand-in
+'''
+import threading
+import time
+
+import spark_api
+import rate_governor
+
+def test_retry_after_honored(standin, spark):
+    room = standin.tenant.create('rooms', {'title' : 'throttled'})
+    standin.inject(429, retry_after=1)
+    start = time.perf_counter()
+    assert spark.get_room_details(room['id'])['title'] == 'throttled'
+    assert time.perf_counter() - start >= 1
+    assert standin.requests['GET v1/rooms/{id}'] == 2
+    assert spark.governor.budget()['throttled'] == 1
+
+def test_retry_after_blocks_all_callers(standin):
+    ''' a 429 seen by one instance also holds back other instances sharing the governor
+    '''
+    governor = rate_governor.RateGovernor()
+    first, second = (spark_api.SparkAPI('test token', base_url=standin.base_url, governor=governor)
+                     for _ in range(2))
+    throttled = standin.tenant.create('rooms', {'title' : 'throttled'})
+    other = standin.tenant.create('rooms', {'title' : 'other'})
+    standin.inject(429, retry_after=1, path=throttled['id'])
+    start = time.perf_counter()
+    thread = threading.Thread(target=first.get_room_details, args=(throttled['id'], ))
+    thread.start()
+    while not governor.budget()['throttled']:
+        time.sleep(0.01)
+    second.get_room_details(other['id'])
+    assert time.perf_counter() - start >= 1
+    thread.join()
+    assert standin.requests['GET v1/rooms/{id}'] == 3
+
+def test_token_bucket_pacing(standin):
+    governor = rate_governor.RateGovernor(rate=10, burst=2)
+    spark = spark_api.SparkAPI('test token', base_url=standin.base_url, governor=governor)
+    room = standin.tenant.create('rooms', {'title' : 'paced'})
+    start = time.perf_counter()
+    for _ in range(6):
+        spark.get_room_details(room['id'])
+    # burst of two, then one request every 100 ms
+    assert time.perf_counter() - start >= 0.35
+    assert spark.metrics.snapshot()['sleeps']['rate_limit'] >= 3
+
+def test_budget_after_retry_after():
+    governor = rate_governor.RateGovernor(rate=10, burst=5)
+    assert governor.budget()['tokens'] == 5
+    governor.retry_after(2)
+    budget = governor.budget()
+    assert budget['tokens'] <= 0
+    assert 1.5 < budget['blocked_for'] <= 2
+    assert budget['throttled'] == 1
+    # the first request after the block waits for the block to end
+    assert governor.reserve() > 1.5
@@ -0,0 +1,50 @@
+'''
+Tests for spark_api.ResponseCache and the invalidation of cached results by updates and deletes
+'''
+import pytest
+
+import spark_api
+import rate_governor
+from spark_api import ResponseCache
+
+def test_invalidate_all_parameter_variants():
+    cache = ResponseCache()
+    cache.put('rooms', 'a', {'title' : 'A'})
+    cache.put('rooms', 'a', {'title' : 'A', 'sipAddress' : 'x'}, (('p_showSipAddress', True), ))
+    cache.put('rooms', 'b', {'title' : 'B'})
+    cache.put('teams', 'a', {'name' : 'A'})
+    cache.invalidate('rooms', 'a')
+    with pytest.raises(KeyError):
+        cache.get('rooms', 'a')
+    with pytest.raises(KeyError):
+        cache.get('rooms', 'a', (('p_showSipAddress', True), ))
+    assert cache.get('rooms', 'b') == {'title' : 'B'}
+    assert cache.get('teams', 'a') == {'name' : 'A'}
+    cache.invalidate('rooms', 'unknown')
+
+def test_eviction_and_expiry_keep_index_consistent():
+    cache = ResponseCache(max_size = 2, ttls = {'people' : -1})
+    for i in range(5):
+        cache.put('rooms', str(i), i)
+    assert cache.stats()['size'] == 2
+    assert set(cache._keys) == {('rooms', '3'), ('rooms', '4')}
+    cache.put('people', 'p', 'expired')
+    with pytest.raises(KeyError):
+        cache.get('people', 'p')
+    assert ('people', 'p') not in cache._keys
+    cache.clear()
+    assert cache._keys == {}
+
+def test_updates_invalidate_cached_details(standin):
+    spark = spark_api.SparkAPI('test token', base_url=standin.base_url, governor=rate_governor.RateGovernor(),
+                               cache=ResponseCache())
+    room = spark.create_room('A')
+    assert spark.get_room_details(room['id'])['title'] == 'A'
+    assert spark.get_room_details(room['id'])['title'] == 'A'
+    assert standin.requests['GET v1/rooms/{id}'] == 1
+    spark.update_room(room['id'], p_title='B')
+    assert spark.get_room_details(room['id'])['title'] == 'B'
+    spark.delete_room(room['id'])
+    with pytest.raises(spark_api.APIError):
+        spark.get_room_details(room['id'])
+    assert standin.requests['GET v1/rooms/{id}'] == 3
@@ -0,0 +1,64 @@
+'''
+Tests for spark_directory
+'''
+import threading
+import time
+
+def test_created_room_is_found(spark):
+    assert spark.find_room('A') is None
+    room = spark.create_room('A')
+    # within min_age of the last refresh: only the create hook can have added the room
+    assert spark.find_room('A')['id'] == room['id']
+
+def test_renamed_and_deleted_rooms(spark):
+    room = spark.create_room('B')
+    assert spark.find_room('B')
+    spark.update_room(room['id'], p_title='C')
+    assert spark.find_room('B') is None
+    assert spark.find_room('C')['id'] == room['id']
+    spark.delete_room(room['id'])
+    assert spark.find_room('C') is None
+
+def test_room_created_by_other_client(standin, spark):
+    directory = spark.room_directory
+    directory.min_age = 0
+    assert spark.find_room('D') is None
+    room = standin.tenant.create('rooms', {'title' : 'D'})
+    # a miss triggers an incremental refresh
+    assert spark.find_room('D')['id'] == room['id']
+    assert directory.refreshes >= 1
+
+def test_stale_index_within_min_age(standin, spark):
+    spark.room_directory.min_age = 300
+    assert spark.find_room('E') is None
+    standin.tenant.create('rooms', {'title' : 'E'})
+    assert spark.find_room('E') is None
+    spark.room_directory.refresh()
+    assert spark.find_room('E')
+
+def test_lookup_does_not_wait_for_refresh(standin, spark):
+    directory = spark.room_directory
+    spark.create_room('F')
+    directory.refresh()
+    standin.latency = 0.5
+    refresh = threading.Thread(target = directory.refresh, kwargs = {'full' : True})
+    refresh.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    directory.max_age = 0
+    assert spark.find_room('F')
+    assert time.monotonic() - start < 0.3
+    refresh.join()
+
+def test_create_during_full_refresh(standin, spark):
+    directory = spark.room_directory
+    directory.refresh()
+    standin.latency = 0.3
+    refresh = threading.Thread(target = directory.refresh, kwargs = {'full' : True})
+    refresh.start()
+    time.sleep(0.1)
+    # the room is created after the refresh has read the rooms
+    standin.latency = 0
+    room = spark.create_room('G')
+    refresh.join()
+    assert directory.get(room['id'])
@@ -0,0 +1,34 @@
+'''
+Tests for spark_models
+'''
+import copy
+import datetime
+import pickle
+
+from spark_models import Room, Message
+
+ROOM = {'id' : 'room id', 'title' : 'Project X', 'type' : 'group', 'lastActivity' : '2016-06-24T17:01:31.123Z',
+        'extra' : 1}
+
+def test_dictionary_and_attribute_access():
+    room = Room(ROOM)
+    assert room['title'] == room.title == 'Project X'
+    assert room.extra == 1
+    assert room.get('teamId') is None
+    assert 'teamId' not in room
+    assert room.to_dict() == ROOM
+    assert room.lastActivity_time == datetime.datetime(2016, 6, 24, 17, 1, 31, 123000)
+
+def test_missing_attributes():
+    room = Room(ROOM)
+    assert not hasattr(room, 'created_time')
+    assert getattr(room, 'created_time', 'default') == 'default'
+    assert not hasattr(room, 'teamId')
+    assert Room({'created' : None}).created_time is None
+
+def test_copy_and_pickle():
+    message = Message({'id' : 'message id', 'created' : '2016-06-24T17:01:31.123Z', 'unknown' : [1]})
+    message.created_time
+    for other in (copy.copy(message), copy.deepcopy(message), pickle.loads(pickle.dumps(message))):
+        assert other == message
+        assert other.created_time == message.created_time
@@ -0,0 +1,44 @@
+'''
+Tests for spark_trace
+'''
+from spark_trace import Tracer, NullTracer
+
+def test_sink_drops_finished_roots():
+    finished = []
+    tracer = Tracer(sink=finished.append)
+    for room in tracer.traced(['a', 'b'], 'room', lambda room: {'title' : room}):
+        with tracer.span('page'):
+            pass
+    assert tracer.roots == []
+    assert [(span.name, span.attributes['title'], len(span.children)) for span in finished] == \
+        [('room', 'a', 1), ('room', 'b', 1)]
+
+def test_loop_left_early():
+    tracer = Tracer()
+    for room in tracer.traced(['a', 'b'], 'room'):
+        break
+    # the generator has been closed when the loop was left
+    assert tracer.current() is None
+    with tracer.span('other'):
+        pass
+    assert [span.name for span in tracer.roots] == ['room', 'other']
+
+def test_interleaved_iterators():
+    tracer = Tracer()
+    with tracer.span('crawl') as crawl:
+        rooms = tracer.traced(['a', 'b'], 'room')
+        teams = tracer.traced(['x', 'y'], 'team')
+        for room, team in zip(rooms, teams):
+            pass
+        rooms.close()
+        teams.close()
+        assert tracer.current() is crawl
+    assert [span.name for span in crawl.children] == ['room', 'team', 'room', 'team']
+    assert all(span.end is not None for span in crawl.children)
+    assert tracer.current() is None
+
+def test_null_tracer():
+    tracer = NullTracer()
+    with tracer.span('room') as span:
+        assert span is None
+    assert list(tracer.traced([1, 2], 'item')) == [1, 2]